@@ -1,54 +1,210 @@
 """
 API endpoints для CrimeVision.kz
 """
-from fastapi import APIRouter, HTTPException, UploadFile, File
-from fastapi.responses import JSONResponse
-from typing import Optional, List
+from fastapi import APIRouter, HTTPException, UploadFile, File, Request
+from fastapi.responses import JSONResponse, Response, StreamingResponse
+from typing import Optional, List, Dict, Callable
 from datetime import datetime, timedelta
+import asyncio
+import hashlib
 import pandas as pd
 import json
 
-from app.database import get_db_connection
-from app.services.ml_service import MLService
-from app.services.gis_service import GISService
-from app.services.data_service import DataService
+from app.cache import result_cache, tile_cache, ResultCache
+
+from app.database import pool
+from app.services.ml_service import (
+    MLService, CELL_MAX_WEEKS, MAX_BACKTEST_FOLDS, MAX_BACKTEST_HORIZON, MAX_FORECAST_MONTHS,
+    RISK_WINDOW_DAYS, model_registry
+)
+from app.services.forecast_models import FORECAST_MODELS
+from app.services.gis_service import GISService, HOTSPOT_EPS_KM, HOTSPOT_MIN_INCIDENTS
+from app.services.data_service import DataService, MAX_PAGE_SIZE
+from app.services.upload_service import UploadService
+from app.services.tile_service import TileService
+from app.services.snapshot_service import snapshot
+from app.services.memory_engine import memory_engine
+from app.services.anomaly_service import MAX_ALERTS, anomaly_detector
+from app.workers import iterate_light, run_light, run_heavy
 
 router = APIRouter()
 
 ml_service = MLService()
 gis_service = GISService()
 data_service = DataService()
+upload_service = UploadService()
+tile_service = TileService()
+
+# Server-sent events: период опроса детектора и комментарий-пинг для прокси, секунд
+SSE_POLL_SECONDS = 1.0
+SSE_KEEPALIVE_SECONDS = 15.0
+
+
+def parse_bbox(bbox: Optional[str]) -> Optional[tuple]:
+    """bbox=min_lat,min_lon,max_lat,max_lon -> кортеж чисел"""
+    if not bbox:
+        return None
+    try:
+        min_lat, min_lon, max_lat, max_lon = (float(v) for v in bbox.split(","))
+    except ValueError:
+        raise HTTPException(status_code=400, detail="bbox: min_lat,min_lon,max_lat,max_lon")
+    if min_lat > max_lat or min_lon > max_lon:
+        raise HTTPException(status_code=400, detail="bbox: минимум больше максимума")
+    return (min_lat, min_lon, max_lat, max_lon)
+
+
+def parse_date(value: Optional[str], name: str, end: bool = False) -> Optional[str]:
+    """
+    Дата фильтра -> YYYY-MM-DD. Кроме полной даты принимаются YYYY-MM и YYYY:
+    начало периода - первый день месяца (года), конец (end=True) - последний.
+    Остальное - 400: в SQL некорректная дата дала бы молча пустой ответ.
+    """
+    if not value:
+        return None
+    value = value.strip()
+    for fmt in ("%Y-%m-%d", "%Y-%m", "%Y"):
+        try:
+            parsed = datetime.strptime(value, fmt)
+        except ValueError:
+            continue
+        if end and fmt == "%Y-%m":
+            parsed = (parsed.replace(day=28) + timedelta(days=4)).replace(day=1) - timedelta(days=1)
+        elif end and fmt == "%Y":
+            parsed = parsed.replace(month=12, day=31)
+        return parsed.strftime("%Y-%m-%d")
+    raise HTTPException(status_code=400, detail=f"{name}: дата в формате YYYY-MM-DD, YYYY-MM или YYYY")
+
+
+def parse_period(start_date: Optional[str], end_date: Optional[str]) -> tuple:
+    """start_date, end_date -> даты YYYY-MM-DD (см. parse_date); начало не позже конца"""
+    start, end = parse_date(start_date, "start_date"), parse_date(end_date, "end_date", end=True)
+    if start and end and start > end:
+        raise HTTPException(status_code=400, detail="start_date позже end_date")
+    return start, end
+
+
+def parse_near(lat: Optional[float], lon: Optional[float],
+               radius_km: Optional[float]) -> Optional[tuple]:
+    """lat, lon, radius_km -> (lat, lon, radius_km) для поиска по радиусу"""
+    if radius_km is None and lat is None and lon is None:
+        return None
+    if radius_km is None or lat is None or lon is None:
+        raise HTTPException(status_code=400, detail="Для поиска по радиусу нужны lat, lon и radius_km")
+    if radius_km <= 0:
+        raise HTTPException(status_code=400, detail="radius_km должен быть больше 0")
+    return (lat, lon, radius_km)
+
+
+def check_forecast_model(model: str):
+    """Проверить имя модели прогноза"""
+    if model not in FORECAST_MODELS:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Неизвестная модель: {model}. Доступные: {', '.join(FORECAST_MODELS)}"
+        )
+
+
+def check_forecast_months(months: int):
+    """Проверить горизонт прогноза в месяцах"""
+    if not 1 <= months <= MAX_FORECAST_MONTHS:
+        raise HTTPException(status_code=400, detail=f"months должен быть от 1 до {MAX_FORECAST_MONTHS}")
+
+
+async def cached_response(request: Request, namespace: str, params: Dict,
+                          render: Callable[[], bytes], media_type: str,
+                          heavy: bool = False, cache: ResultCache = result_cache) -> Response:
+    """
+    Ответ из кэша результатов (ключ - параметры запроса и версия данных).
+    Поддерживает ETag/If-None-Match: неизменившийся ответ отдаётся как 304.
+    """
+    key, version = cache.make_key(namespace, params)
+    entry = cache.get(key)
+    if entry is None:
+        def compute():
+            body = render()
+            return {"body": body, "etag": f'"{hashlib.md5(body).hexdigest()}"'}
+
+        entry = await (run_heavy if heavy else run_light)(compute)
+        cache.put(key, entry, version)
+
+    headers = {"ETag": entry["etag"], "Cache-Control": "no-cache"}
+    if_none_match = request.headers.get("if-none-match", "")
+    if entry["etag"] in [tag.strip() for tag in if_none_match.split(",")]:
+        return Response(status_code=304, headers=headers)
+    return Response(content=entry["body"], media_type=media_type, headers=headers)
+
+
+async def cached_json(request: Request, namespace: str, params: Dict,
+                      compute: Callable[[], Dict], heavy: bool = False) -> Response:
+    """JSON ответ из кэша результатов"""
+    return await cached_response(
+        request, namespace, params,
+        lambda: JSONResponse(content=compute()).body,
+        "application/json", heavy
+    )
 
 
 @router.post("/upload")
-async def upload_data(file: UploadFile = File(...)):
-    """Загрузка CSV файла с данными о преступлениях"""
+async def upload_data(file: UploadFile = File(...), stream: bool = False):
+    """
+    Загрузка CSV файла с данными о преступлениях.
+    stream=true - потоковая загрузка по частям, возвращает job_id для опроса прогресса.
+    """
     try:
         if not file.filename.endswith('.csv'):
             raise HTTPException(status_code=400, detail="Требуется CSV файл")
         
-        df = pd.read_csv(file.file)
-        result = data_service.save_to_db(df)
+        if stream:
+            job = await run_heavy(upload_service.start, file.file, file.filename)
+            return JSONResponse(status_code=202, content={
+                "status": "accepted",
+                "message": "Файл принят в обработку",
+                "job_id": job["job_id"],
+                "job": job
+            })
+        
+        df = await run_heavy(pd.read_csv, file.file)
+        result = await run_heavy(data_service.save_to_db, df)
+        
+        message = f"Загружено {result['count']} записей"
+        if result['rejected']:
+            message += f", отклонено {result['rejected']}"
         
         return {
             "status": "success",
-            "message": f"Загружено {result['count']} записей",
+            "message": message,
             "details": result
         }
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 
+@router.get("/upload/{job_id}")
+async def get_upload_status(job_id: str):
+    """Прогресс потоковой загрузки: строки разобраны / сохранены / отклонены"""
+    job = upload_service.get_job(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Задача загрузки не найдена")
+    return JSONResponse(content=job)
+
+
 @router.get("/stats/summary")
 async def get_summary_stats(
+    request: Request,
     start_date: Optional[str] = None,
     end_date: Optional[str] = None,
     region: Optional[str] = None
 ):
     """Получить общую статистику"""
+    start_date, end_date = parse_period(start_date, end_date)
     try:
-        stats = data_service.get_summary_stats(start_date, end_date, region)
-        return JSONResponse(content=stats)
+        return await cached_json(
+            request, "stats_summary",
+            {"start_date": start_date, "end_date": end_date, "region": region},
+            lambda: data_service.get_summary_stats(start_date, end_date, region)
+        )
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
@@ -59,111 +215,467 @@ async def get_crimes(
     end_date: Optional[str] = None,
     region: Optional[str] = None,
     crime_type: Optional[str] = None,
-    limit: int = 1000
+    limit: int = 1000,
+    cursor: Optional[str] = None,
+    bbox: Optional[str] = None,
+    lat: Optional[float] = None,
+    lon: Optional[float] = None,
+    radius_km: Optional[float] = None,
+    format: str = "json"
 ):
-    """Получить список преступлений с фильтрами"""
+    """
+    Получить список преступлений с фильтрами (новые первыми).
+    limit - размер страницы (не больше MAX_PAGE_SIZE), cursor - next_cursor из
+    предыдущего ответа; bbox=min_lat,min_lon,max_lat,max_lon - область;
+    lat, lon, radius_km - круг вокруг точки; format=geojson - ответ в GeoJSON.
+    """
+    start_date, end_date = parse_period(start_date, end_date)
+    bounds = parse_bbox(bbox)
+    near = parse_near(lat, lon, radius_km)
+    if format not in ("json", "geojson"):
+        raise HTTPException(status_code=400, detail="Параметр format: json или geojson")
+    if not 1 <= limit <= MAX_PAGE_SIZE:
+        raise HTTPException(status_code=400, detail=f"limit должен быть от 1 до {MAX_PAGE_SIZE}")
+    if cursor:
+        try:
+            data_service.decode_cursor(cursor)
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+    
     try:
-        crimes = data_service.get_crimes(
-            start_date, end_date, region, crime_type, limit
+        if format == "geojson":
+            collection = await run_light(
+                gis_service.get_crimes_geojson, start_date, end_date, region, crime_type,
+                limit, bounds, near
+            )
+            return JSONResponse(content=collection)
+        
+        page = await run_light(
+            data_service.get_crimes_page, start_date, end_date, region, crime_type,
+            limit, bounds, near, cursor
         )
-        return JSONResponse(content={"crimes": crimes})
+        return JSONResponse(content=page)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+
+@router.get("/crimes/export")
+async def export_crimes(
+    start_date: Optional[str] = None,
+    end_date: Optional[str] = None,
+    region: Optional[str] = None,
+    crime_type: Optional[str] = None,
+    bbox: Optional[str] = None,
+    lat: Optional[float] = None,
+    lon: Optional[float] = None,
+    radius_km: Optional[float] = None,
+    format: str = "ndjson"
+):
+    """
+    Потоковая выгрузка всех отфильтрованных преступлений (format=ndjson|csv)
+    без ограничения числа строк; память сервера не зависит от объёма.
+    """
+    start_date, end_date = parse_period(start_date, end_date)
+    bounds = parse_bbox(bbox)
+    near = parse_near(lat, lon, radius_km)
+    media_types = {"ndjson": "application/x-ndjson", "csv": "text/csv; charset=utf-8"}
+    if format not in media_types:
+        raise HTTPException(status_code=400, detail="Параметр format: ndjson или csv")
+    
+    rows = data_service.export_crimes(format, start_date, end_date, region, crime_type, bounds, near)
+    # Генератор закрывается и при обрыве соединения: иначе он держит соединение из пула
+    return StreamingResponse(
+        iterate_light(rows), media_type=media_types[format],
+        headers={"Content-Disposition": f'attachment; filename="crimes.{format}"'}
+    )
+
+
+@router.get("/snapshot")
+async def get_snapshot_manifest():
+    """Колоночный снимок crimes: столбцы, словари и партиции по месяцам"""
+    try:
+        return JSONResponse(content=await run_light(snapshot.manifest))
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+
+@router.get("/snapshot/{month}")
+async def get_snapshot_partition(month: str):
+    """Партиция снимка за месяц (YYYY-MM) в формате .npz: столбцы .npy и словари кодов"""
+    try:
+        archive = await run_heavy(snapshot.partition_archive, month)
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
+    if archive is None:
+        raise HTTPException(status_code=404, detail="Партиция снимка не найдена")
+    return Response(
+        content=archive, media_type="application/zip",
+        headers={"Content-Disposition": f'attachment; filename="crimes_{month}.npz"'}
+    )
 
 
 @router.get("/heatmap")
 async def get_heatmap_data(
+    request: Request,
     start_date: Optional[str] = None,
     end_date: Optional[str] = None,
-    region: Optional[str] = None
+    region: Optional[str] = None,
+    crime_type: Optional[str] = None,
+    mode: str = "points",
+    zoom: int = 6,
+    bbox: Optional[str] = None,
+    weeks: int = 1
 ):
-    """Получить данные для тепловой карты"""
+    """
+    Получить данные для тепловой карты.
+    mode=points - отдельные точки (до 5000), mode=grid - агрегация по ячейкам
+    сетки с размером по zoom; bbox=min_lat,min_lon,max_lat,max_lon - область карты.
+    mode=forecast - та же сетка с прогнозом числа преступлений в ячейке на weeks
+    недель после end_date (start_date не используется: история берётся по модели).
+    """
+    start_date, end_date = parse_period(start_date, end_date)
+    if mode not in ("points", "grid", "forecast"):
+        raise HTTPException(status_code=400, detail="Параметр mode: points, grid или forecast")
+    if not 1 <= weeks <= CELL_MAX_WEEKS:
+        raise HTTPException(status_code=400, detail=f"weeks: от 1 до {CELL_MAX_WEEKS}")
+    bounds = parse_bbox(bbox)
     try:
-        heatmap_data = gis_service.get_heatmap_data(
-            start_date, end_date, region
+        if mode == "points":
+            heatmap_data = await run_heavy(
+                gis_service.get_heatmap_data, start_date, end_date, region
+            )
+            return JSONResponse(content=heatmap_data)
+        
+        if mode == "forecast":
+            return await cached_json(
+                request, "heatmap_forecast",
+                {"end_date": end_date, "region": region, "crime_type": crime_type,
+                 "zoom": zoom, "bbox": bounds, "weeks": weeks},
+                lambda: gis_service.get_heatmap_forecast(end_date, region, zoom, bounds, crime_type, weeks),
+                heavy=True
+            )
+        
+        return await cached_json(
+            request, "heatmap_grid",
+            {"start_date": start_date, "end_date": end_date, "region": region,
+             "crime_type": crime_type, "zoom": zoom, "bbox": bounds},
+            lambda: gis_service.get_heatmap_grid(start_date, end_date, region, zoom, bounds, crime_type)
+        )
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+
+@router.get("/hotspots")
+async def get_hotspots(
+    request: Request,
+    start_date: Optional[str] = None,
+    end_date: Optional[str] = None,
+    region: Optional[str] = None,
+    crime_type: Optional[str] = None,
+    bbox: Optional[str] = None,
+    eps_km: float = HOTSPOT_EPS_KM,
+    min_incidents: int = HOTSPOT_MIN_INCIDENTS,
+    format: str = "json"
+):
+    """
+    Очаги преступности (DBSCAN по сетке): центр, контур, число преступлений и
+    средняя тяжесть. eps_km - радиус соседства, min_incidents - минимум
+    преступлений в радиусе для ядра очага; format=geojson - контуры в GeoJSON.
+    """
+    start_date, end_date = parse_period(start_date, end_date)
+    bounds = parse_bbox(bbox)
+    if format not in ("json", "geojson"):
+        raise HTTPException(status_code=400, detail="Параметр format: json или geojson")
+    if not 0.1 <= eps_km <= 50:
+        raise HTTPException(status_code=400, detail="eps_km должен быть от 0.1 до 50")
+    if min_incidents < 1:
+        raise HTTPException(status_code=400, detail="min_incidents должен быть больше 0")
+    try:
+        def compute():
+            hotspots = gis_service.get_hotspots(start_date, end_date, region, crime_type,
+                                                bounds, eps_km, min_incidents)
+            return gis_service.hotspots_geojson(hotspots) if format == "geojson" else hotspots
+
+        return await cached_json(
+            request, "hotspots",
+            {"start_date": start_date, "end_date": end_date, "region": region,
+             "crime_type": crime_type, "bbox": bounds, "eps_km": eps_km,
+             "min_incidents": min_incidents, "format": format},
+            compute,
+            heavy=True
         )
-        return JSONResponse(content=heatmap_data)
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 
 @router.get("/map")
 async def get_map_html(
+    request: Request,
     start_date: Optional[str] = None,
     end_date: Optional[str] = None,
     region: Optional[str] = None
 ):
-    """Получить HTML с картой"""
+    """Получить HTML с картой (тепловой слой подгружается тайлами)"""
+    start_date, end_date = parse_period(start_date, end_date)
     try:
-        map_html = gis_service.generate_map(
-            start_date, end_date, region
+        return await cached_json(
+            request, "map_html",
+            {"start_date": start_date, "end_date": end_date, "region": region},
+            lambda: {"map_html": gis_service.generate_map(start_date, end_date, region)},
+            heavy=True
+        )
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+
+@router.get("/tiles/{z}/{x}/{y}")
+async def get_heatmap_tile(
+    request: Request,
+    z: int,
+    x: int,
+    y: int,
+    start_date: Optional[str] = None,
+    end_date: Optional[str] = None,
+    region: Optional[str] = None,
+    crime_type: Optional[str] = None,
+    format: str = "png"
+):
+    """
+    Тайл тепловой карты 256x256 (Web Mercator).
+    format=png - изображение, format=json - агрегаты по ячейкам тайла.
+    """
+    start_date, end_date = parse_period(start_date, end_date)
+    if format not in ("png", "json"):
+        raise HTTPException(status_code=400, detail="Параметр format: png или json")
+    if not 0 <= z <= 18 or not (0 <= x < 2 ** z and 0 <= y < 2 ** z):
+        raise HTTPException(status_code=404, detail="Тайл вне диапазона")
+    
+    filters = {"start_date": start_date, "end_date": end_date,
+               "region": region, "crime_type": crime_type}
+    try:
+        if format == "json":
+            return await cached_response(
+                request, "tile_json", {"z": z, "x": x, "y": y, **filters},
+                lambda: JSONResponse(content=tile_service.get_tile_data(z, x, y, **filters)).body,
+                "application/json", cache=tile_cache
+            )
+        return await cached_response(
+            request, "tile_png", {"z": z, "x": x, "y": y, **filters},
+            lambda: tile_service.render_tile(z, x, y, **filters),
+            "image/png", cache=tile_cache
         )
-        return JSONResponse(content={"map_html": map_html})
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 
 @router.get("/analytics/timeline")
 async def get_timeline(
+    request: Request,
     start_date: Optional[str] = None,
     end_date: Optional[str] = None,
     region: Optional[str] = None,
     group_by: str = "month"
 ):
     """Получить динамику преступности по времени"""
+    start_date, end_date = parse_period(start_date, end_date)
     try:
-        timeline = data_service.get_timeline(
-            start_date, end_date, region, group_by
+        return await cached_json(
+            request, "timeline",
+            {"start_date": start_date, "end_date": end_date, "region": region, "group_by": group_by},
+            lambda: data_service.get_timeline(start_date, end_date, region, group_by)
         )
-        return JSONResponse(content=timeline)
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 
 @router.get("/analytics/regions")
 async def get_regions_comparison(
+    request: Request,
     start_date: Optional[str] = None,
     end_date: Optional[str] = None
 ):
     """Сравнение регионов"""
+    start_date, end_date = parse_period(start_date, end_date)
     try:
-        comparison = data_service.get_regions_comparison(start_date, end_date)
-        return JSONResponse(content=comparison)
+        return await cached_json(
+            request, "regions_comparison",
+            {"start_date": start_date, "end_date": end_date},
+            lambda: data_service.get_regions_comparison(start_date, end_date)
+        )
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 
 @router.get("/forecast")
 async def get_forecast(
+    request: Request,
     region: Optional[str] = None,
     crime_type: Optional[str] = None,
-    months: int = 3
+    months: int = 3,
+    model: str = "linear"
+):
+    """
+    Получить прогноз преступности.
+    model: linear (по умолчанию), seasonal_naive, harmonic, holt_winters
+    """
+    check_forecast_model(model)
+    check_forecast_months(months)
+    try:
+        return await cached_json(
+            request, "forecast",
+            {"region": region, "crime_type": crime_type, "months": months, "model": model},
+            lambda: ml_service.get_forecast(region, crime_type, months, model),
+            heavy=True
+        )
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+
+@router.get("/forecast/batch")
+async def get_batch_forecast(
+    request: Request,
+    regions: Optional[str] = None,
+    crime_types: Optional[str] = None,
+    months: int = 3,
+    model: str = "linear"
 ):
-    """Получить прогноз преступности"""
+    """
+    Прогноз для всех пар регион x тип преступления одним запросом.
+    regions и crime_types - списки через запятую (по умолчанию - все из данных).
+    """
+    check_forecast_model(model)
+    check_forecast_months(months)
     try:
-        forecast = ml_service.get_forecast(region, crime_type, months)
-        return JSONResponse(content=forecast)
+        region_list = [r.strip() for r in regions.split(",") if r.strip()] if regions else None
+        type_list = [t.strip() for t in crime_types.split(",") if t.strip()] if crime_types else None
+        return await cached_json(
+            request, "forecast_batch",
+            {"regions": tuple(region_list or ()), "crime_types": tuple(type_list or ()),
+             "months": months, "model": model},
+            lambda: ml_service.get_batch_forecast(region_list, type_list, months, model),
+            heavy=True
+        )
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+
+@router.get("/forecast/backtest")
+async def get_forecast_backtest(
+    request: Request,
+    horizon: int = 3,
+    folds: int = 6,
+    by: str = "region"
+):
+    """Сравнение моделей прогноза на истории: MAE, RMSE, sMAPE и время обучения"""
+    if by not in ("region", "crime_type"):
+        raise HTTPException(status_code=400, detail="Параметр by: region или crime_type")
+    if not 1 <= horizon <= MAX_BACKTEST_HORIZON:
+        raise HTTPException(status_code=400, detail=f"horizon должен быть от 1 до {MAX_BACKTEST_HORIZON}")
+    if not 1 <= folds <= MAX_BACKTEST_FOLDS:
+        raise HTTPException(status_code=400, detail=f"folds должен быть от 1 до {MAX_BACKTEST_FOLDS}")
+    try:
+        return await cached_json(
+            request, "forecast_backtest",
+            {"horizon": horizon, "folds": folds, "by": by},
+            lambda: ml_service.backtest_models(horizon, folds, by=by),
+            heavy=True
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 
 @router.get("/risk-assessment")
 async def get_risk_assessment(
+    request: Request,
     region: Optional[str] = None
 ):
     """Оценка уровня риска по региону"""
     try:
-        risk = ml_service.assess_risk(region)
-        return JSONResponse(content=risk)
+        return await cached_json(
+            request, "risk_assessment",
+            {"region": region},
+            lambda: ml_service.assess_risk(region),
+            heavy=True
+        )
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 
+@router.get("/risk-assessment/all")
+async def get_risk_assessment_all(
+    request: Request,
+    end_date: Optional[str] = None,
+    days: int = RISK_WINDOW_DAYS
+):
+    """Рейтинг риска всех регионов за последние days дней (по умолчанию - до последней даты в данных, не позже сегодняшней)"""
+    end_date = parse_date(end_date, "end_date", end=True)
+    if not 2 <= days <= 366:
+        raise HTTPException(status_code=400, detail="days должен быть от 2 до 366")
+    try:
+        return await cached_json(
+            request, "risk_assessment_all",
+            {"end_date": end_date, "days": days},
+            lambda: ml_service.assess_risk_all(end_date, days)
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+
+@router.get("/anomalies")
+async def get_anomalies(
+    since: int = 0,
+    limit: int = 100,
+    region: Optional[str] = None
+):
+    """Оповещения о всплесках преступности (id больше since) и состояние детектора"""
+    if not 1 <= limit <= MAX_ALERTS:
+        raise HTTPException(status_code=400, detail=f"limit должен быть от 1 до {MAX_ALERTS}")
+    return JSONResponse(content={
+        "alerts": anomaly_detector.alerts(since, limit, region),
+        "detector": anomaly_detector.stats()
+    })
+
+
+@router.get("/anomalies/stream")
+async def stream_anomalies(request: Request, region: Optional[str] = None):
+    """
+    Server-sent events: новые оповещения о всплесках (event: anomaly) по мере
+    загрузки данных. После переподключения отправка продолжается с Last-Event-ID.
+    """
+    try:
+        last = int(request.headers.get("last-event-id") or anomaly_detector.last_id())
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Last-Event-ID должен быть числом")
+    
+    async def events():
+        nonlocal last
+        idle = 0.0
+        while not await request.is_disconnected():
+            # Курсор сдвигается только до отправленных оповещений: оповещение,
+            # добавленное во время опроса, уйдёт на следующем шаге
+            for alert in anomaly_detector.alerts(last, MAX_ALERTS, region):
+                yield f"id: {alert['id']}\nevent: anomaly\ndata: {json.dumps(alert, ensure_ascii=False)}\n\n"
+                last = max(last, alert["id"])
+                idle = 0.0
+            if idle >= SSE_KEEPALIVE_SECONDS:
+                yield ": keepalive\n\n"
+                idle = 0.0
+            await asyncio.sleep(SSE_POLL_SECONDS)
+            idle += SSE_POLL_SECONDS
+    
+    return StreamingResponse(events(), media_type="text/event-stream",
+                             headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+
 @router.get("/regions")
 async def get_regions_list():
     """Список доступных регионов"""
     try:
-        regions = data_service.get_regions_list()
+        regions = await run_light(data_service.get_regions_list)
         return JSONResponse(content={"regions": regions})
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
@@ -173,8 +685,47 @@ async def get_regions_list():
 async def get_crime_types():
     """Список типов преступлений"""
     try:
-        crime_types = data_service.get_crime_types()
+        crime_types = await run_light(data_service.get_crime_types)
         return JSONResponse(content={"crime_types": crime_types})
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
+
+@router.get("/meta")
+async def get_meta():
+    """Метаданные фильтров одним запросом: регионы, типы преступлений, диапазон дат"""
+    try:
+        meta = await run_light(data_service.get_meta)
+        return JSONResponse(content=meta)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+
+@router.get("/system/db-pool")
+async def get_db_pool_stats():
+    """Метрики пула соединений с БД"""
+    return JSONResponse(content=pool.stats())
+
+
+@router.get("/system/cache")
+async def get_cache_stats():
+    """Метрики кэша результатов: попадания, промахи, вытеснения"""
+    return JSONResponse(content={**result_cache.stats(), "tiles": tile_cache.stats()})
+
+
+@router.get("/system/models")
+async def get_models_stats():
+    """Состояние реестра обученных моделей прогноза"""
+    return JSONResponse(content=model_registry.stats())
+
+
+@router.get("/system/anomalies")
+async def get_anomaly_detector_stats():
+    """Состояние детектора всплесков: открытый день, число пар, оповещения"""
+    return JSONResponse(content=anomaly_detector.stats())
+
+
+@router.get("/system/memory-engine")
+async def get_memory_engine_stats():
+    """Состояние in-memory движка агрегаций (CRIMEVISION_MEMORY_ENGINE=1)"""
+    return JSONResponse(content=memory_engine.stats())
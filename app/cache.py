@@ -0,0 +1,184 @@
+"""
+Кэш результатов аналитических запросов с инвалидацией по версии данных
+
+Версия данных увеличивается при каждой загрузке (DataService.save_to_db),
+поэтому после загрузки все ранее посчитанные ответы сразу становятся недействительными.
+Фоновые обработчики изменения данных (снимок, модели) при загрузке по частям
+откладываются до конца загрузки (defer_data_change).
+"""
+import os
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, Hashable, List, Optional, Tuple
+
+CACHE_SIZE = int(os.getenv("CRIMEVISION_CACHE_SIZE", "512"))
+CACHE_TTL = float(os.getenv("CRIMEVISION_CACHE_TTL", "300"))
+
+_version = 0
+_version_lock = threading.Lock()
+_listeners: List[Callable[[int], None]] = []
+_caches: List["ResultCache"] = []
+# Сколько блоков defer_data_change открыто и последняя версия, отложенная в них
+_deferred = 0
+_deferred_version: Optional[int] = None
+
+
+def get_data_version() -> int:
+    """Текущая версия данных"""
+    return _version
+
+
+def bump_data_version() -> int:
+    """Отметить изменение данных: старые записи кэша удаляются"""
+    global _version, _deferred_version
+    with _version_lock:
+        _version += 1
+        version = _version
+        deferred = _deferred > 0
+        if deferred:
+            _deferred_version = version
+    for cache in _caches:
+        cache.drop_older_than(version)
+    if not deferred:
+        _notify(version)
+    return version
+
+
+def _notify(version: int):
+    for callback in _listeners:
+        try:
+            callback(version)
+        except Exception as e:
+            print(f"Ошибка обработчика изменения данных: {e}")
+
+
+@contextmanager
+def defer_data_change():
+    """
+    Внутри блока версия данных растёт как обычно (кэш сбрасывается сразу),
+    а обработчики on_data_change вызываются один раз при выходе из внешнего блока.
+    Используется загрузкой по частям: снимок и модели обновляются один раз на файл.
+    """
+    global _deferred, _deferred_version
+    with _version_lock:
+        _deferred += 1
+    try:
+        yield
+    finally:
+        with _version_lock:
+            _deferred -= 1
+            version = _deferred_version if not _deferred else None
+            if not _deferred:
+                _deferred_version = None
+        if version is not None:
+            _notify(version)
+
+
+def on_data_change(callback: Callable[[int], None]):
+    """Подписаться на изменение версии данных (callback получает новую версию)"""
+    if callback not in _listeners:
+        _listeners.append(callback)
+
+
+def normalize_params(params: Dict[str, Any]) -> Tuple:
+    """Ключ из параметров запроса: без пустых значений, в фиксированном порядке"""
+    items = []
+    for name, value in params.items():
+        if isinstance(value, str):
+            value = value.strip()
+        if value is None or value == "":
+            continue
+        items.append((name, value))
+    return tuple(sorted(items))
+
+
+class ResultCache:
+    """LRU кэш с ограничением времени жизни записей"""
+
+    def __init__(self, max_entries: int = CACHE_SIZE, ttl: float = CACHE_TTL):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._stats = {"hits": 0, "misses": 0, "evictions": 0, "expirations": 0, "invalidations": 0}
+        _caches.append(self)
+
+    def make_key(self, namespace: str, params: Dict[str, Any]) -> Tuple[Hashable, int]:
+        """Ключ записи и версия данных, на которой она считается"""
+        version = get_data_version()
+        return (namespace, normalize_params(params), version), version
+
+    def get(self, key: Hashable) -> Optional[Any]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self._stats["misses"] += 1
+                return None
+            expires_at, _, value = entry
+            if expires_at < time.monotonic():
+                del self._entries[key]
+                self._stats["expirations"] += 1
+                self._stats["misses"] += 1
+                return None
+            self._entries.move_to_end(key)
+            self._stats["hits"] += 1
+            return value
+
+    def put(self, key: Hashable, value: Any, version: int):
+        # Результат, посчитанный до загрузки новых данных, не сохраняем
+        if version < get_data_version():
+            return
+        with self._lock:
+            self._entries[key] = (time.monotonic() + self.ttl, version, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self._stats["evictions"] += 1
+
+    def get_or_compute(self, namespace: str, params: Dict[str, Any], compute: Callable[[], Any]) -> Any:
+        """
+        Значение из кэша по (namespace, параметры, версия данных)
+        или результат compute(), который сохраняется в кэш.
+        Возвращаемые объекты общие для всех запросов - их нельзя изменять.
+        """
+        key, version = self.make_key(namespace, params)
+        value = self.get(key)
+        if value is None:
+            value = compute()
+            self.put(key, value, version)
+        return value
+
+    def drop_older_than(self, version: int):
+        """Удалить записи, посчитанные на старой версии данных"""
+        with self._lock:
+            stale = [key for key, (_, v, _) in self._entries.items() if v < version]
+            for key in stale:
+                del self._entries[key]
+            self._stats["invalidations"] += len(stale)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self) -> Dict:
+        """Счётчики попаданий/промахов/вытеснений"""
+        with self._lock:
+            lookups = self._stats["hits"] + self._stats["misses"]
+            return {
+                **self._stats,
+                "hit_rate": round(self._stats["hits"] / lookups, 3) if lookups else 0.0,
+                "entries": len(self._entries),
+                "max_entries": self.max_entries,
+                "ttl_sec": self.ttl,
+                "data_version": get_data_version(),
+            }
+
+
+result_cache = ResultCache()
+# Отдельный кэш для тайлов карты: их много, и они не должны вытеснять аналитику
+tile_cache = ResultCache(
+    max_entries=int(os.getenv("CRIMEVISION_TILE_CACHE_SIZE", "4096")),
+    ttl=float(os.getenv("CRIMEVISION_TILE_CACHE_TTL", "3600"))
+)
@@ -1,46 +1,650 @@
 """
 Модуль работы с базой данных
 """
+import math
+import os
+import queue
 import sqlite3
+import threading
+import time
+from contextlib import contextmanager
 from pathlib import Path
+from typing import Dict, Iterator
 
 DB_PATH = Path("data/crime_vision.db")
 DB_PATH.parent.mkdir(parents=True, exist_ok=True)
 
+# Максимум одновременно открытых соединений на чтение
+DB_READERS = int(os.getenv("CRIMEVISION_DB_READERS", "8"))
+
+# Настройки, применяемые к каждому соединению из пула
+CONNECTION_PRAGMAS = (
+    "PRAGMA cache_size = -32768",      # 32 МБ страничного кэша
+    "PRAGMA mmap_size = 268435456",    # 256 МБ memory-mapped I/O
+    "PRAGMA temp_store = MEMORY",
+)
+WRITER_PRAGMAS = (
+    "PRAGMA journal_mode = WAL",       # читатели не блокируются писателем
+    "PRAGMA synchronous = NORMAL",
+)
+
+
+EARTH_RADIUS_KM = 6371.0088
+
+
+def distance_km(lat1, lon1, lat2, lon2):
+    """Расстояние по большому кругу (haversine), км; доступно в SQL как distance_km()"""
+    if None in (lat1, lon1, lat2, lon2):
+        return None
+    phi1, phi2 = math.radians(lat1), math.radians(lat2)
+    dphi = phi2 - phi1
+    dlambda = math.radians(lon2 - lon1)
+    a = math.sin(dphi / 2) ** 2 + math.cos(phi1) * math.cos(phi2) * math.sin(dlambda / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * math.asin(math.sqrt(a))
+
 
 def get_db_connection():
-    """Получить соединение с БД"""
+    """Получить отдельное соединение с БД (вне пула)"""
     conn = sqlite3.connect(str(DB_PATH))
     conn.row_factory = sqlite3.Row
     return conn
 
 
+class ConnectionPool:
+    """
+    Пул соединений SQLite: несколько read-only соединений для чтения
+    и одно соединение-писатель для загрузки данных.
+    """
+
+    def __init__(self, path: Path, max_readers: int = DB_READERS):
+        self.path = path
+        self.max_readers = max_readers
+        self._idle = queue.LifoQueue()
+        self._lock = threading.Lock()
+        self._writer = None
+        self._writer_lock = threading.Lock()
+        self._open_readers = 0
+        self._trace = None
+        self._stats = {"checkouts": 0, "waits": 0, "wait_time_ms": 0.0, "writer_checkouts": 0, "writer_waits": 0}
+
+    def _connect(self, read_only: bool) -> sqlite3.Connection:
+        if read_only:
+            uri = f"{self.path.resolve().as_uri()}?mode=ro"
+            conn = sqlite3.connect(uri, uri=True, check_same_thread=False, cached_statements=256)
+        else:
+            conn = sqlite3.connect(str(self.path), check_same_thread=False, cached_statements=256)
+        conn.row_factory = sqlite3.Row
+        conn.create_function("distance_km", 4, distance_km, deterministic=True)
+        for pragma in CONNECTION_PRAGMAS:
+            conn.execute(pragma)
+        if not read_only:
+            for pragma in WRITER_PRAGMAS:
+                conn.execute(pragma)
+        return conn
+
+    def _ensure_writer(self) -> sqlite3.Connection:
+        # Писатель создаёт файл БД и включает WAL до открытия читателей
+        with self._lock:
+            if self._writer is None:
+                self._writer = self._connect(read_only=False)
+            return self._writer
+
+    @contextmanager
+    def reader(self) -> Iterator[sqlite3.Connection]:
+        """Соединение только для чтения"""
+        conn = self._checkout()
+        trace = self._trace
+        if trace:
+            conn.set_trace_callback(trace)
+        try:
+            yield conn
+        finally:
+            if trace:
+                conn.set_trace_callback(None)
+            if conn.in_transaction:
+                conn.rollback()
+            self._idle.put(conn)
+
+    @contextmanager
+    def trace(self, callback):
+        """Передавать в callback текст каждого запроса на чтение (аудит планов запросов)"""
+        self._trace = callback
+        try:
+            yield
+        finally:
+            self._trace = None
+
+    @contextmanager
+    def writer(self) -> Iterator[sqlite3.Connection]:
+        """
+        Единственное соединение на запись. Транзакция фиксируется при
+        успешном выходе из блока и откатывается при исключении.
+        """
+        conn = self._ensure_writer()
+        if not self._writer_lock.acquire(blocking=False):
+            with self._lock:
+                self._stats["writer_waits"] += 1
+            self._writer_lock.acquire()
+        try:
+            with self._lock:
+                self._stats["writer_checkouts"] += 1
+            with conn:
+                yield conn
+        finally:
+            self._writer_lock.release()
+
+    def _checkout(self) -> sqlite3.Connection:
+        with self._lock:
+            self._stats["checkouts"] += 1
+        try:
+            return self._idle.get_nowait()
+        except queue.Empty:
+            pass
+
+        with self._lock:
+            can_open = self._open_readers < self.max_readers
+            if can_open:
+                self._open_readers += 1
+        if can_open:
+            self._ensure_writer()
+            try:
+                return self._connect(read_only=True)
+            except Exception:
+                with self._lock:
+                    self._open_readers -= 1
+                raise
+
+        # Все соединения заняты - ждём освобождения
+        start = time.perf_counter()
+        conn = self._idle.get()
+        with self._lock:
+            self._stats["waits"] += 1
+            self._stats["wait_time_ms"] += (time.perf_counter() - start) * 1000
+        return conn
+
+    def stats(self) -> Dict:
+        """Метрики пула"""
+        with self._lock:
+            return {
+                **self._stats,
+                "wait_time_ms": round(self._stats["wait_time_ms"], 2),
+                "open_readers": self._open_readers,
+                "idle_readers": self._idle.qsize(),
+                "max_readers": self.max_readers,
+                "writer_open": self._writer is not None,
+            }
+
+    def close(self):
+        """Закрыть все соединения пула"""
+        while True:
+            try:
+                self._idle.get_nowait().close()
+            except queue.Empty:
+                break
+        with self._lock:
+            self._open_readers = 0
+            if self._writer is not None:
+                self._writer.close()
+                self._writer = None
+
+
+pool = ConnectionPool(DB_PATH)
+
+
+def db_reader():
+    """Соединение на чтение из пула (использовать с with)"""
+    return pool.reader()
+
+
+def db_writer():
+    """Соединение на запись (использовать с with)"""
+    return pool.writer()
+
+
+# Словари значений: в crimes и crime_daily хранятся целочисленные ключи
+LOOKUP_TABLES = {"region": "regions", "city": "cities", "crime_type": "crime_types"}
+# Словари с каталогом: число записей, первый и последний день (фильтры интерфейса)
+CATALOG_TABLES = {"region": "regions", "crime_type": "crime_types"}
+CATALOG_COLUMNS = (
+    ("incidents", "INTEGER NOT NULL DEFAULT 0"),
+    ("first_day", "INTEGER"),
+    ("last_day", "INTEGER"),
+)
+
+# Гистограмма тяжести в crime_daily: столбец severity_N - число записей с тяжестью N
+SEVERITY_LEVELS = (1, 2, 3, 4, 5)
+SEVERITY_HISTOGRAM_COLUMNS = tuple(f"severity_{level}" for level in SEVERITY_LEVELS)
+
+# Даты хранятся номером дня от 1970-01-01: SQL-выражения перевода в обе стороны
+DAY_FROM_DATE_SQL = "CAST(julianday({}) - 2440587.5 AS INTEGER)"
+DATE_FROM_DAY_SQL = "date({} * 86400, 'unixepoch')"
+
+# Разумные пределы координат для Казахстана: (min_lat, min_lon, max_lat, max_lon)
+KZ_BOUNDS = (40.0, 46.0, 55.0, 87.0)
+# Недельные агрегаты crime_cells - по сетке от угла KZ_BOUNDS с ячейкой тепловой
+# карты zoom 7 (22.5 / 2^7 градуса): самой мелкой, в которую карта всей страны
+# укладывается без укрупнения; ячейки крупнее - объединения 2^k x 2^k ячеек агрегата
+CELL_ROLLUP_SIZE = 22.5 / 2 ** 7
+# Вес тяжести в ячейке тепловой карты
+CELL_WEIGHT_SQL = "MAX(0.5, MIN(5.0, COALESCE(severity, 1)))"
+
+
 def init_db():
     """Инициализация базы данных"""
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    
-    # Таблица для преступлений
-    cursor.execute("""
+    with db_writer() as conn:
+        has_crimes_table = conn.execute(
+            "SELECT EXISTS(SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'crimes')"
+        ).fetchone()[0]
+
+        if has_crimes_table:
+            applied = migrate_schema(conn)
+        else:
+            # Новая БД создаётся сразу в последней версии схемы
+            create_tables(conn)
+            create_indexes(conn)
+            conn.execute(f"PRAGMA user_version = {len(SCHEMA_MIGRATIONS)}")
+            applied = []
+
+        has_crimes = conn.execute("SELECT EXISTS(SELECT 1 FROM crimes)").fetchone()[0]
+        init_spatial_index(conn, backfill=has_crimes)
+
+    if _migration_dictionary_encoding in applied:
+        # Освободить место, занятое строковыми столбцами старой таблицы
+        with db_writer() as conn:
+            conn.execute("VACUUM")
+
+    print("[OK] База данных инициализирована")
+
+
+def create_tables(conn):
+    """Таблицы последней версии схемы"""
+    for table in LOOKUP_TABLES.values():
+        catalog = "".join(f", {name} {definition}" for name, definition in CATALOG_COLUMNS
+                          if table in CATALOG_TABLES.values())
+        conn.execute(f"""
+            CREATE TABLE IF NOT EXISTS {table} (
+                id INTEGER PRIMARY KEY,
+                name TEXT NOT NULL UNIQUE{catalog}
+            )
+        """)
+
+    # Таблица для преступлений; day - номер дня от 1970-01-01
+    conn.execute("""
         CREATE TABLE IF NOT EXISTS crimes (
             id INTEGER PRIMARY KEY AUTOINCREMENT,
-            date DATE NOT NULL,
-            region TEXT NOT NULL,
-            city TEXT,
-            crime_type TEXT NOT NULL,
+            day INTEGER NOT NULL,
+            region_id INTEGER NOT NULL REFERENCES regions(id),
+            city_id INTEGER REFERENCES cities(id),
+            crime_type_id INTEGER NOT NULL REFERENCES crime_types(id),
             latitude REAL,
             longitude REAL,
             severity INTEGER DEFAULT 1,
             created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
         )
     """)
-    
-    # Индексы для быстрого поиска
-    cursor.execute("CREATE INDEX IF NOT EXISTS idx_date ON crimes(date)")
-    cursor.execute("CREATE INDEX IF NOT EXISTS idx_region ON crimes(region)")
-    cursor.execute("CREATE INDEX IF NOT EXISTS idx_crime_type ON crimes(crime_type)")
-    
-    conn.commit()
-    conn.close()
-    print("[OK] База данных инициализирована")
 
+    # Дневные агрегаты для дашборда: время ответа зависит от числа
+    # дней x регионов x типов, а не от числа записей в crimes
+    histogram = "".join(f"{name} INTEGER NOT NULL DEFAULT 0,\n" for name in SEVERITY_HISTOGRAM_COLUMNS)
+    conn.execute(f"""
+        CREATE TABLE IF NOT EXISTS crime_daily (
+            day INTEGER NOT NULL,
+            region_id INTEGER NOT NULL,
+            crime_type_id INTEGER NOT NULL,
+            count INTEGER NOT NULL,
+            severity_sum INTEGER NOT NULL,
+            severity_count INTEGER NOT NULL,
+            {histogram}
+            PRIMARY KEY (day, region_id, crime_type_id)
+        ) WITHOUT ROWID
+    """)
+
+    # Недельные агрегаты по ячейкам сетки CELL_ROLLUP_SIZE для тепловой карты
+    # и прогноза по всей стране; неделя - (day + 3) / 7, с понедельника
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS crime_cells (
+            week INTEGER NOT NULL,
+            region_id INTEGER NOT NULL,
+            crime_type_id INTEGER NOT NULL,
+            cell_row INTEGER NOT NULL,
+            cell_col INTEGER NOT NULL,
+            count INTEGER NOT NULL,
+            weight_sum REAL NOT NULL,
+            lat_sum REAL NOT NULL,
+            lon_sum REAL NOT NULL,
+            PRIMARY KEY (week, region_id, crime_type_id, cell_row, cell_col)
+        ) WITHOUT ROWID
+    """)
+
+
+def create_indexes(conn):
+    """
+    Индексы под фильтры DataService: равенство по региону или типу + диапазон дней.
+    Индексы crimes узкие: каждый столбец индекса - лишняя запись в B-дерево
+    на каждую загруженную строку. Покрывающие чтения (сводка, динамика,
+    прогнозы) идут по дневным агрегатам crime_daily.
+    """
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_crimes_day ON crimes(day)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_crimes_region_day ON crimes(region_id, day)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_crimes_type_day ON crimes(crime_type_id, day)")
+
+    # crime_daily хранится по первичному ключу (day, region_id, crime_type_id)
+    conn.execute("""
+        CREATE INDEX IF NOT EXISTS idx_daily_region_day
+        ON crime_daily(region_id, day, count, severity_sum, severity_count)
+    """)
+    conn.execute("""
+        CREATE INDEX IF NOT EXISTS idx_daily_type_day
+        ON crime_daily(crime_type_id, day, count, severity_sum, severity_count)
+    """)
+    # Сводка группирует по (регион, тип): индекс в этом порядке отдаёт группы без сортировки
+    conn.execute(f"""
+        CREATE INDEX IF NOT EXISTS idx_daily_region_type
+        ON crime_daily(region_id, crime_type_id, day, count, severity_sum, severity_count,
+                       {", ".join(SEVERITY_HISTOGRAM_COLUMNS)})
+    """)
+
+
+def _table_exists(conn, name: str) -> bool:
+    return conn.execute(
+        "SELECT EXISTS(SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?)", (name,)
+    ).fetchone()[0] == 1
+
+
+def _migration_composite_indexes(conn):
+    """
+    Составные индексы под фильтры DataService
+
+    Фильтры API - равенство по региону и/или типу + диапазон дат. Индексы crimes
+    узкие (без координат и тяжести), чтобы не замедлять загрузку; покрывающие
+    индексы есть только у дневных агрегатов. Одностолбцовые индексы становятся
+    префиксами составных и удаляются.
+    """
+    conn.execute("DROP INDEX IF EXISTS idx_date")
+    conn.execute("DROP INDEX IF EXISTS idx_region")
+    conn.execute("DROP INDEX IF EXISTS idx_crime_type")
+    conn.execute("DROP INDEX IF EXISTS idx_daily_region")
+
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_crimes_date ON crimes(date)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_crimes_region_date ON crimes(region, date)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_crimes_type_date ON crimes(crime_type, date)")
+
+    # БД, созданные до появления дневных агрегатов, получат их в следующей миграции
+    if _table_exists(conn, "crime_daily"):
+        conn.execute("""
+            CREATE INDEX IF NOT EXISTS idx_daily_region_date
+            ON crime_daily(region, date, count, severity_sum, severity_count)
+        """)
+        conn.execute("""
+            CREATE INDEX IF NOT EXISTS idx_daily_type_date
+            ON crime_daily(crime_type, date, count, severity_sum, severity_count)
+        """)
+    # Статистика для планировщика: без неё выбор между индексами случаен
+    conn.execute("ANALYZE")
+
+
+def _migration_dictionary_encoding(conn):
+    """
+    Словари регионов, городов и типов, даты - номером дня
+
+    Строковые столбцы crimes и crime_daily заменяются целочисленными ключами
+    таблиц regions, cities, crime_types, дата YYYY-MM-DD - номером дня от 1970-01-01.
+    Таблицы строятся заново с теми же id; строки с нераспознаваемой датой пропускаются.
+    """
+    conn.execute("ALTER TABLE crimes RENAME TO crimes_legacy")
+    if _table_exists(conn, "crime_daily"):
+        conn.execute("DROP TABLE crime_daily")
+    create_tables(conn)
+
+    conn.execute("INSERT OR IGNORE INTO regions (name) SELECT DISTINCT region FROM crimes_legacy")
+    conn.execute("""
+        INSERT OR IGNORE INTO cities (name)
+        SELECT DISTINCT city FROM crimes_legacy WHERE city IS NOT NULL
+    """)
+    conn.execute("INSERT OR IGNORE INTO crime_types (name) SELECT DISTINCT crime_type FROM crimes_legacy")
+
+    conn.execute(f"""
+        INSERT INTO crimes (id, day, region_id, city_id, crime_type_id, latitude, longitude, severity, created_at)
+        SELECT c.id, {DAY_FROM_DATE_SQL.format("c.date")}, reg.id, cty.id, typ.id,
+               c.latitude, c.longitude, c.severity, c.created_at
+        FROM crimes_legacy c
+        JOIN regions reg ON reg.name = c.region
+        LEFT JOIN cities cty ON cty.name = c.city
+        JOIN crime_types typ ON typ.name = c.crime_type
+        WHERE julianday(c.date) IS NOT NULL
+    """)
+    skipped = conn.execute("SELECT COUNT(*) FROM crimes_legacy WHERE julianday(date) IS NULL").fetchone()[0]
+    if skipped:
+        print(f"[WARNING] Пропущено записей с некорректной датой: {skipped}")
+
+    # Вместе со старой таблицей удаляются её индексы и триггеры R*Tree;
+    # триггеры для новой таблицы создаёт init_spatial_index
+    conn.execute("DROP TABLE crimes_legacy")
+    if skipped and _table_exists(conn, "crimes_rtree"):
+        conn.execute("DELETE FROM crimes_rtree WHERE id NOT IN (SELECT id FROM crimes)")
+
+    rebuild_rollup(conn)
+    create_indexes(conn)
+    # Статистика ANALYZE удалена вместе со старыми таблицами и заново не собирается,
+    # как и в новой БД: с ней планировщик недооценивает диапазоны дат и координат
+    # и предпочитает их индексам региона, типа и R*Tree
+
+
+def _migration_dimension_catalog(conn):
+    """
+    Каталог регионов и типов: число записей, первый и последний день
+
+    Столбцы добавляются в словари regions и crime_types (если словари созданы
+    предыдущей миграцией, столбцы уже есть) и заполняются по crime_daily.
+    Дальше каталог ведёт загрузка данных.
+    """
+    for table in CATALOG_TABLES.values():
+        existing = {row[1] for row in conn.execute(f"PRAGMA table_info({table})")}
+        for name, definition in CATALOG_COLUMNS:
+            if name not in existing:
+                conn.execute(f"ALTER TABLE {table} ADD COLUMN {name} {definition}")
+    rebuild_catalog(conn)
+
+
+def _migration_severity_histogram(conn):
+    """
+    Гистограмма тяжести в дневных агрегатах
+
+    Столбцы severity_1..severity_5 crime_daily (число записей с данной тяжестью)
+    позволяют считать распределение и процентили тяжести в сводке тем же
+    проходом по агрегатам. Агрегаты пересчитываются по crimes,
+    индекс idx_daily_region_type покрывает группировку сводки.
+    """
+    existing = {row[1] for row in conn.execute("PRAGMA table_info(crime_daily)")}
+    for name in SEVERITY_HISTOGRAM_COLUMNS:
+        if name not in existing:
+            conn.execute(f"ALTER TABLE crime_daily ADD COLUMN {name} INTEGER NOT NULL DEFAULT 0")
+    rebuild_rollup(conn)
+    create_indexes(conn)
+
+
+def _migration_narrow_indexes(conn):
+    """
+    Узкие индексы crimes
+
+    Покрывающие индексы crimes (день, регион или тип + координаты и тяжесть)
+    замедляли загрузку в несколько раз: каждая строка дописывалась в три
+    широких B-дерева. Они заменяются индексами (day), (region_id, day) и
+    (crime_type_id, day); покрывающие чтения идут по crime_daily.
+    """
+    for name in ("idx_crimes_day", "idx_crimes_region_day", "idx_crimes_type_day"):
+        conn.execute(f"DROP INDEX IF EXISTS {name}")
+    create_indexes(conn)
+
+
+def _migration_cell_rollup(conn):
+    """
+    Недельные агрегаты по ячейкам сетки
+
+    Тепловая карта и прогноз по ячейкам без области (вся страна) группировали
+    всю таблицу crimes. Таблица crime_cells хранит число, сумму весов и сумму
+    координат по (неделя, регион, тип, ячейка) и заполняется по crimes;
+    дальше её ведёт загрузка данных.
+    """
+    create_tables(conn)
+    rebuild_cells(conn)
+
+
+# Миграции схемы по порядку; номер последней применённой хранится в PRAGMA user_version
+SCHEMA_MIGRATIONS = (
+    _migration_composite_indexes,
+    _migration_dictionary_encoding,
+    _migration_dimension_catalog,
+    _migration_severity_histogram,
+    _migration_narrow_indexes,
+    _migration_cell_rollup,
+)
+
+
+def migrate_schema(conn) -> list:
+    """Применить миграции схемы, которые ещё не применялись к этой БД; возвращает применённые"""
+    version = conn.execute("PRAGMA user_version").fetchone()[0]
+    applied = []
+    for number, migration in enumerate(SCHEMA_MIGRATIONS[version:], start=version + 1):
+        migration(conn)
+        conn.execute(f"PRAGMA user_version = {number}")
+        applied.append(migration)
+        print(f"[OK] Миграция схемы {number}: {migration.__doc__.strip().splitlines()[0]}")
+    return applied
+
+
+# Триггеры держат R*Tree в синхронизации при записи отдельных строк;
+# массовая загрузка обходит построчный триггер (bulk_spatial_index)
+RTREE_INSERT_TRIGGER_SQL = """
+    CREATE TRIGGER IF NOT EXISTS crimes_rtree_insert AFTER INSERT ON crimes
+    WHEN NEW.latitude IS NOT NULL AND NEW.longitude IS NOT NULL
+    BEGIN
+        INSERT INTO crimes_rtree VALUES (NEW.id, NEW.latitude, NEW.latitude, NEW.longitude, NEW.longitude);
+    END
+"""
+
+
+def init_spatial_index(conn, backfill: bool = True):
+    """
+    Пространственный индекс R*Tree по координатам, синхронизируемый триггерами.
+    Если SQLite собран без R*Tree, запросы по области работают без индекса.
+    """
+    global _spatial_index
+    _spatial_index = None
+    try:
+        conn.execute("""
+            CREATE VIRTUAL TABLE IF NOT EXISTS crimes_rtree
+            USING rtree(id, min_lat, max_lat, min_lon, max_lon)
+        """)
+    except sqlite3.OperationalError as e:
+        print(f"[WARNING] R*Tree недоступен, пространственный индекс отключён: {e}")
+        return
+
+    conn.execute(RTREE_INSERT_TRIGGER_SQL)
+    conn.execute("""
+        CREATE TRIGGER IF NOT EXISTS crimes_rtree_delete AFTER DELETE ON crimes
+        BEGIN
+            DELETE FROM crimes_rtree WHERE id = OLD.id;
+        END
+    """)
+    conn.execute("""
+        CREATE TRIGGER IF NOT EXISTS crimes_rtree_update AFTER UPDATE OF latitude, longitude ON crimes
+        BEGIN
+            DELETE FROM crimes_rtree WHERE id = OLD.id;
+            INSERT INTO crimes_rtree
+            SELECT NEW.id, NEW.latitude, NEW.latitude, NEW.longitude, NEW.longitude
+            WHERE NEW.latitude IS NOT NULL AND NEW.longitude IS NOT NULL;
+        END
+    """)
+
+    # Миграция существующих БД: индекс строится по уже загруженным данным
+    if backfill and not conn.execute("SELECT EXISTS(SELECT 1 FROM crimes_rtree)").fetchone()[0]:
+        conn.execute("""
+            INSERT INTO crimes_rtree
+            SELECT id, latitude, latitude, longitude, longitude FROM crimes
+            WHERE latitude IS NOT NULL AND longitude IS NOT NULL
+        """)
+
+
+@contextmanager
+def bulk_spatial_index(conn):
+    """
+    Массовая вставка в crimes без построчного триггера R*Tree. В транзакции
+    загрузки триггер снимается, после вставки индекс дополняется одним
+    запросом по новым id и триггер создаётся заново. При ошибке откат
+    транзакции возвращает триггер вместе с данными.
+    """
+    if not _table_exists(conn, "crimes_rtree"):
+        yield
+        return
+    # DDL в режиме sqlite3 по умолчанию не открывает транзакцию сам
+    if not conn.in_transaction:
+        conn.execute("BEGIN")
+    last_id = conn.execute("SELECT COALESCE(MAX(id), 0) FROM crimes").fetchone()[0]
+    conn.execute("DROP TRIGGER IF EXISTS crimes_rtree_insert")
+    yield
+    # Вставка по ячейкам ~1 км: соседние точки попадают в одни узлы дерева,
+    # это быстрее вставки в порядке id
+    conn.execute("""
+        INSERT INTO crimes_rtree
+        SELECT id, latitude, latitude, longitude, longitude FROM crimes
+        WHERE id > ? AND latitude IS NOT NULL AND longitude IS NOT NULL
+        ORDER BY CAST(latitude * 100 AS INTEGER), CAST(longitude * 100 AS INTEGER)
+    """, (last_id,))
+    conn.execute(RTREE_INSERT_TRIGGER_SQL)
+
+
+def has_spatial_index() -> bool:
+    """Есть ли в БД таблица crimes_rtree; результат (в том числе отрицательный) кэшируется"""
+    global _spatial_index
+    if _spatial_index is None:
+        with db_reader() as conn:
+            _spatial_index = conn.execute(
+                "SELECT EXISTS(SELECT 1 FROM sqlite_master WHERE name = 'crimes_rtree')"
+            ).fetchone()[0] == 1
+    return _spatial_index
+
+
+# None - ещё не проверялось; сбрасывается в init_spatial_index
+_spatial_index = None
+
+
+def rebuild_rollup(conn):
+    """Пересчитать таблицу crime_daily по всей таблице crimes"""
+    histogram = ", ".join(SEVERITY_HISTOGRAM_COLUMNS)
+    histogram_sums = ", ".join(f"SUM(severity IS {level})" for level in SEVERITY_LEVELS)
+    conn.execute("DELETE FROM crime_daily")
+    conn.execute(f"""
+        INSERT INTO crime_daily (day, region_id, crime_type_id, count, severity_sum, severity_count, {histogram})
+        SELECT day, region_id, crime_type_id, COUNT(*), COALESCE(SUM(severity), 0), COUNT(severity),
+               {histogram_sums}
+        FROM crimes
+        GROUP BY day, region_id, crime_type_id
+    """)
+
+
+def rebuild_cells(conn):
+    """Пересчитать таблицу crime_cells по всей таблице crimes"""
+    min_lat, min_lon, max_lat, max_lon = KZ_BOUNDS
+    conn.execute("DELETE FROM crime_cells")
+    conn.execute(f"""
+        INSERT INTO crime_cells (week, region_id, crime_type_id, cell_row, cell_col,
+                                 count, weight_sum, lat_sum, lon_sum)
+        SELECT (day + 3) / 7, region_id, crime_type_id,
+               CAST((latitude - ?) / ? AS INTEGER), CAST((longitude - ?) / ? AS INTEGER),
+               COUNT(*), SUM({CELL_WEIGHT_SQL}), SUM(latitude), SUM(longitude)
+        FROM crimes
+        WHERE latitude BETWEEN ? AND ? AND longitude BETWEEN ? AND ?
+        GROUP BY 1, 2, 3, 4, 5
+    """, (min_lat, CELL_ROLLUP_SIZE, min_lon, CELL_ROLLUP_SIZE, min_lat, max_lat, min_lon, max_lon))
+
+
+def rebuild_catalog(conn):
+    """Пересчитать каталог словарей CATALOG_TABLES по таблице crime_daily"""
+    for dimension, table in CATALOG_TABLES.items():
+        conn.execute(f"""
+            UPDATE {table} SET (incidents, first_day, last_day) = (
+                SELECT COALESCE(SUM(count), 0), MIN(day), MAX(day)
+                FROM crime_daily WHERE {dimension}_id = {table}.id
+            )
+        """)
@@ -0,0 +1,165 @@
+"""
+Аудит планов запросов API (EXPLAIN QUERY PLAN)
+
+Методы DataService вызываются с типичными для эндпоинтов фильтрами, текст
+каждого выполненного SQL перехватывается через пул соединений, и для него
+строится план. Полное сканирование таблицы (SCAN без индекса) считается
+ошибкой, сканирование всего индекса и временные B-деревья - замечаниями.
+Сценарий может явно разрешить полное чтение таблицы, если оно ожидаемо
+(например, пакетный прогноз читает все дневные агрегаты).
+
+Запуск (код возврата 1, если найдены полные сканирования):
+    python -m app.query_audit
+    python -m app.query_audit --verbose
+"""
+import argparse
+import re
+import sys
+from typing import Callable, Dict, FrozenSet, List, Tuple
+
+from app.database import CELL_ROLLUP_SIZE, DATE_FROM_DAY_SQL, KZ_BOUNDS, db_reader, init_db, pool
+from app.services.data_service import DataService, REGIONS_KZ
+
+# "SCAN crimes", "SCAN c" - чтение всей таблицы; "SCAN c USING INDEX ..." - всего индекса
+FULL_SCAN = re.compile(r"^SCAN (\w+)$")
+INDEX_SCAN = re.compile(r"^SCAN (\w+) USING (COVERING )?INDEX")
+# Служебные запросы SQLite: каталог схемы, статистика, внутренние таблицы R*Tree
+INTERNAL_SQL = re.compile(r"sqlite_master|sqlite_stat1|'main'\.")
+
+data_service = DataService()
+
+
+def _scenarios() -> List[Tuple[str, Callable, FrozenSet[str]]]:
+    """
+    Вызовы DataService с фильтрами, которые передают эндпоинты API,
+    и таблицы, полное чтение которых для сценария ожидаемо
+    """
+    with db_reader() as conn:
+        first, last = conn.execute(
+            f"SELECT {DATE_FROM_DAY_SQL.format('MIN(day)')}, {DATE_FROM_DAY_SQL.format('MAX(day)')} FROM crime_daily"
+        ).fetchone()
+    first, last = first or "2024-01-01", last or "2024-12-31"
+    region = data_service.get_regions_list()[0]
+    crime_type = data_service.get_crime_types()[0]
+    center = REGIONS_KZ.get(region, {"lat": 43.2220, "lon": 76.8512})
+    lat, lon = center["lat"], center["lon"]
+    small = (lat - 0.1, lon - 0.1, lat + 0.1, lon + 0.1)
+    country = (40.5, 46.5, 55.5, 87.5)
+
+    scenarios = [
+        ("/crimes", lambda: data_service.get_crimes(limit=100)),
+        ("/crimes?dates", lambda: data_service.get_crimes(first, last, limit=100)),
+        ("/crimes?region", lambda: data_service.get_crimes(region=region, limit=100)),
+        ("/crimes?crime_type", lambda: data_service.get_crimes(crime_type=crime_type, limit=100)),
+        ("/crimes?dates&region&crime_type",
+         lambda: data_service.get_crimes(first, last, region, crime_type, limit=100)),
+        ("/crimes?region&cursor",
+         lambda: data_service.get_crimes(region=region, limit=100, after=(last, 2 ** 62))),
+        ("/crimes/export?region&dates",
+         lambda: list(data_service.export_crimes("csv", first, last, region))),
+        ("/crimes?bbox", lambda: data_service.get_crimes(bbox=small, limit=100)),
+        ("/crimes?radius", lambda: data_service.get_crimes(near=(lat, lon, 5.0), limit=100)),
+        ("/heatmap?mode=grid&dates",
+         lambda: data_service.get_heatmap_cells(0.5, country, first, last)),
+        ("/heatmap?mode=grid&region",
+         lambda: data_service.get_heatmap_cells(0.5, country, region=region)),
+        ("/heatmap?mode=grid&crime_type",
+         lambda: data_service.get_heatmap_cells(0.5, country, crime_type=crime_type)),
+        # Карта всей страны (без bbox) - по недельным агрегатам crime_cells
+        ("/heatmap?mode=grid", lambda: data_service.get_heatmap_cells(CELL_ROLLUP_SIZE, KZ_BOUNDS)),
+        ("/heatmap?mode=grid&dates (вся страна)",
+         lambda: data_service.get_heatmap_cells(CELL_ROLLUP_SIZE * 2, KZ_BOUNDS, first, last)),
+        ("/heatmap?mode=grid&region (вся страна)",
+         lambda: data_service.get_heatmap_cells(CELL_ROLLUP_SIZE, KZ_BOUNDS, first, last, region)),
+        ("/heatmap?mode=forecast (вся страна)",
+         lambda: data_service.get_cell_week_counts(CELL_ROLLUP_SIZE, KZ_BOUNDS, first, last,
+                                                   crime_type=crime_type)),
+        ("/heatmap?mode=forecast",
+         lambda: data_service.get_cell_week_counts(0.5, country, first, last)),
+        ("/heatmap?mode=forecast&region",
+         lambda: data_service.get_cell_week_counts(0.5, country, first, last, region)),
+        ("/tiles (zoom 12)", lambda: data_service.get_heatmap_cells(0.0003, small, first, last)),
+        ("/analytics/timeline?region",
+         lambda: data_service.get_timeline(first, last, region)),
+        ("/analytics/regions", lambda: data_service.get_regions_comparison(first, last)),
+        ("/forecast (ряд)",
+         lambda: data_service.get_count_series(region, crime_type, freq="month")),
+        ("/regions", lambda: data_service.get_regions_list()),
+        ("/crime-types", lambda: data_service.get_crime_types()),
+    ]
+    # Таблица в плане называется так же, как в запросе, - по имени или псевдониму;
+    # s в сводке - уже сгруппированные пары (регион, тип)
+    return [
+        ("/stats/summary", lambda: data_service.get_summary_stats(), frozenset({"s"})),
+        ("/stats/summary?dates&region",
+         lambda: data_service.get_summary_stats(first, last, region), frozenset({"s"})),
+    ] + [(name, call, frozenset()) for name, call in scenarios] + [
+        ("/analytics/timeline", lambda: data_service.get_timeline(), frozenset({"crime_daily"})),
+        ("/forecast/batch (матрица)", lambda: data_service.get_count_matrix(),
+         frozenset({"crime_daily", "d"})),
+    ]
+
+
+def explain(sql: str) -> List[str]:
+    """Строки плана запроса"""
+    with db_reader() as conn:
+        return [row[3] for row in conn.execute(f"EXPLAIN QUERY PLAN {sql}").fetchall()]
+
+
+def classify(plan: List[str], allowed: FrozenSet[str] = frozenset()) -> Dict[str, List[str]]:
+    """Полные сканирования таблиц и замечания по плану"""
+    full_scans, notes = [], []
+    for step in plan:
+        match = FULL_SCAN.match(step)
+        if match and match.group(1) in allowed:
+            notes.append(f"{step} (ожидаемо)")
+        elif match:
+            full_scans.append(step)
+        elif INDEX_SCAN.match(step) or step.startswith("USE TEMP B-TREE"):
+            notes.append(step)
+    return {"full_scans": full_scans, "notes": notes}
+
+
+def audit_queries() -> List[Dict]:
+    """Планы всех запросов, которые выполняют сценарии API"""
+    report = []
+    for name, call, allowed in _scenarios():
+        statements = []
+        with pool.trace(statements.append):
+            call()
+        for sql in statements:
+            if not sql.lstrip().upper().startswith(("SELECT", "WITH")) or INTERNAL_SQL.search(sql):
+                continue
+            plan = explain(sql)
+            report.append({"endpoint": name, "sql": " ".join(sql.split()), "plan": plan,
+                           **classify(plan, allowed)})
+    return report
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Аудит планов запросов API")
+    parser.add_argument("--verbose", action="store_true", help="печатать SQL и полный план")
+    args = parser.parse_args()
+
+    init_db()
+    report = audit_queries()
+    failed = 0
+    for entry in report:
+        status = "FULL SCAN" if entry["full_scans"] else "OK"
+        failed += bool(entry["full_scans"])
+        print(f"[{status:9}] {entry['endpoint']}")
+        for step in entry["full_scans"]:
+            print(f"    ! {step}")
+        for step in entry["notes"]:
+            print(f"    ~ {step}")
+        if args.verbose:
+            print(f"    {entry['sql']}")
+            for step in entry["plan"]:
+                print(f"      {step}")
+
+    print(f"\nЗапросов: {len(report)}, с полным сканированием: {failed}")
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,248 @@
+"""
+Детектор всплесков преступности по парам (регион, тип преступления)
+
+Для каждой пары ведётся экспоненциально сглаженное среднее и дисперсия (EWMA)
+дневного числа преступлений. Состояние - массивы NumPy [регион, тип], индексы -
+ключи словарей regions и crime_types. Последний день в данных "открыт": его
+число растёт с каждой загрузкой и сравнивается с EWMA закрытых дней; когда
+приходят данные за следующий день, открытый день закрывается и входит в EWMA.
+
+DataService.save_to_db передаёт сюда дневные суммы каждой загруженной пачки,
+поэтому обновление стоит O(регионы x типы) на день пачки и не зависит от объёма
+истории. Пачка с данными за уже закрытые дни (догрузка истории) вызывает
+фоновое восстановление состояния по дневным агрегатам crime_daily - так же
+состояние строится при запуске приложения. Дни позже сегодняшнего (ошибочные
+даты) детектор не учитывает, иначе одна такая запись "закрыла" бы все настоящие дни.
+"""
+import threading
+import time
+from collections import deque
+from datetime import datetime
+from typing import Dict, List, Optional
+import numpy as np
+import pandas as pd
+from app.database import CATALOG_TABLES, db_reader
+from app.workers import CoalescingJob
+
+# Коэффициент сглаживания EWMA (доля нового дня)
+EWMA_ALPHA = 0.1
+# Всплеск: z-оценка не ниже порога и не меньше MIN_COUNT преступлений за день
+ZSCORE_THRESHOLD = 3.0
+MIN_COUNT = 5
+# Пара проверяется после стольких закрытых дней истории
+WARMUP_DAYS = 14
+# Состояние восстанавливается по стольким последним дням crime_daily
+REBUILD_DAYS = 365
+# Дольше такого перерыва в данных EWMA уже не меняется заметно
+MAX_GAP_DAYS = 200
+# Оповещения ищутся в последних днях пачки (и при восстановлении), а не во всей истории
+ALERT_REPLAY_DAYS = 7
+# Сколько последних оповещений хранится в памяти
+MAX_ALERTS = 1000
+
+
+def _today() -> int:
+    """Номер сегодняшнего дня от 1970-01-01"""
+    return int(np.datetime64(datetime.now().date(), "D").astype(np.int64))
+
+
+class AnomalyDetector:
+    """Инкрементальный EWMA-детектор всплесков по дневным числам преступлений"""
+
+    def __init__(self, alpha: float = EWMA_ALPHA, threshold: float = ZSCORE_THRESHOLD):
+        self.alpha = alpha
+        self.threshold = threshold
+        self._lock = threading.Lock()
+        self._alerts = deque(maxlen=MAX_ALERTS)
+        self._next_id = 1
+        self._names = {dimension: {} for dimension in CATALOG_TABLES}
+        self._reset()
+
+    def _reset(self):
+        self.day: Optional[int] = None
+        self.current = np.zeros((0, 0), dtype=np.int64)
+        self.mean = np.zeros((0, 0))
+        self.var = np.zeros((0, 0))
+        self.seen = np.zeros((0, 0), dtype=np.int64)
+        # (день, регион, тип) уже отмеченных всплесков - повторно не оповещаем
+        self._alerted = set()
+
+    # --- обновление состояния ---
+
+    def _ensure_shape(self, n_regions: int, n_types: int):
+        """Расширить массивы под новые ключи словарей (новые пары без истории)"""
+        rows, cols = self.current.shape
+        if n_regions <= rows and n_types <= cols:
+            return
+        shape = (max(rows, n_regions), max(cols, n_types))
+        for name in ("current", "mean", "var", "seen"):
+            old = getattr(self, name)
+            new = np.zeros(shape, dtype=old.dtype)
+            new[:rows, :cols] = old
+            setattr(self, name, new)
+
+    def _close_day(self, counts: np.ndarray):
+        """Добавить закрытый день в EWMA; первый день пары задаёт начальное среднее"""
+        first = self.seen == 0
+        diff = counts - self.mean
+        increment = self.alpha * diff
+        self.mean = np.where(first, counts, self.mean + increment)
+        self.var = np.where(first, 0.0, (1 - self.alpha) * (self.var + diff * increment))
+        self.seen += 1
+
+    def _advance(self, day: int):
+        """Закрыть открытый день и дни без данных до day, открыть day"""
+        self._close_day(self.current)
+        zeros = np.zeros_like(self.current)
+        for _ in range(min(day - self.day - 1, MAX_GAP_DAYS)):
+            self._close_day(zeros)
+        self.current = zeros
+        self.day = day
+        self._alerted = {key for key in self._alerted if key[0] > day - ALERT_REPLAY_DAYS}
+
+    def _replay(self, first_day: int, cube: np.ndarray):
+        """
+        Прогнать дни first_day.. (cube [день, регион, тип]) через состояние.
+        Всплески проверяются только в последних ALERT_REPLAY_DAYS днях.
+        """
+        self._ensure_shape(*cube.shape[1:])
+        rows, cols = cube.shape[1:]
+        last_day = first_day + len(cube) - 1
+        for offset, counts in enumerate(cube):
+            day = first_day + offset
+            if self.day is None:
+                self.day = day
+            elif day > self.day:
+                self._advance(day)
+            self.current[:rows, :cols] += counts
+            if day > last_day - ALERT_REPLAY_DAYS and counts.any():
+                self._check(*np.nonzero(counts))
+
+    def _check(self, regions: np.ndarray, types: np.ndarray):
+        """Проверить открытый день для пар, в которые пришли новые данные"""
+        count = self.current[regions, types]
+        mean = self.mean[regions, types]
+        # Нижняя граница разброса - пуассоновская: sqrt(среднего), но не меньше 1
+        std = np.maximum(np.sqrt(self.var[regions, types]), np.sqrt(np.maximum(mean, 1.0)))
+        zscore = (count - mean) / std
+        spikes = ((self.seen[regions, types] >= WARMUP_DAYS) & (count >= MIN_COUNT)
+                  & (zscore >= self.threshold))
+        for i in np.flatnonzero(spikes).tolist():
+            key = (self.day, int(regions[i]), int(types[i]))
+            if key in self._alerted:
+                continue
+            self._alerted.add(key)
+            self._alerts.append({
+                "id": self._next_id,
+                "date": str(np.datetime64(self.day, "D")),
+                "region": self._name("region", key[1]),
+                "crime_type": self._name("crime_type", key[2]),
+                "count": int(count[i]),
+                "expected": round(float(mean[i]), 2),
+                "std": round(float(std[i]), 2),
+                "zscore": round(float(zscore[i]), 2),
+                "detected_at": datetime.now().isoformat(timespec="seconds"),
+            })
+            self._next_id += 1
+
+    def _name(self, dimension: str, key: int) -> str:
+        """Название по ключу словаря; словарь перечитывается при новом ключе"""
+        names = self._names[dimension]
+        if key not in names:
+            with db_reader() as conn:
+                names.update(conn.execute(f"SELECT id, name FROM {CATALOG_TABLES[dimension]}").fetchall())
+        return names.get(key, str(key))
+
+    @staticmethod
+    def _to_cube(days: np.ndarray, regions: np.ndarray, types: np.ndarray,
+                 counts: np.ndarray, first_day: int) -> np.ndarray:
+        """Дневные суммы -> плотный куб [день, регион, тип] начиная с first_day"""
+        cube = np.zeros((int(days.max()) - first_day + 1, int(regions.max()) + 1, int(types.max()) + 1),
+                        dtype=np.int64)
+        np.add.at(cube, (days - first_day, regions, types), counts)
+        return cube
+
+    def observe(self, daily: pd.DataFrame):
+        """
+        Учесть загруженную пачку: дневные суммы (day, region_id, crime_type_id, count).
+        Данные за уже закрытые дни ставят восстановление состояния по crime_daily в очередь.
+        """
+        daily = daily[daily["day"] <= _today()]
+        if daily.empty:
+            return
+        try:
+            days = daily["day"].to_numpy(np.int64)
+            with self._lock:
+                if self.day is not None and days.min() < self.day:
+                    late = True
+                else:
+                    late = False
+                    first_day = int(days.min()) if self.day is None else self.day
+                    self._replay(first_day, self._to_cube(
+                        days, daily["region_id"].to_numpy(np.int64),
+                        daily["crime_type_id"].to_numpy(np.int64),
+                        daily["count"].to_numpy(np.int64), first_day
+                    ))
+            if late:
+                schedule_rebuild()
+        except Exception as e:
+            print(f"[WARNING] Ошибка детектора аномалий: {e}")
+
+    def rebuild(self) -> Dict:
+        """Восстановить состояние по последним REBUILD_DAYS дням crime_daily"""
+        started = time.perf_counter()
+        with db_reader() as conn:
+            rows = conn.execute("""
+                SELECT day, region_id, crime_type_id, count FROM crime_daily
+                WHERE day > (SELECT MAX(day) FROM crime_daily WHERE day <= :today) - :days
+                  AND day <= :today
+            """, {"today": _today(), "days": REBUILD_DAYS}).fetchall()
+        with self._lock:
+            alerted = self._alerted
+            self._reset()
+            if rows:
+                days, regions, types, counts = (np.array(column, dtype=np.int64) for column in zip(*rows))
+                first_day = int(days.min())
+                # Уже отправленные оповещения за последние дни не повторяются
+                self._alerted = alerted
+                self._replay(first_day, self._to_cube(days, regions, types, counts, first_day))
+        return {"days": len({r[0] for r in rows}),
+                "time_ms": round((time.perf_counter() - started) * 1000, 1)}
+
+    # --- запросы ---
+
+    def alerts(self, since: int = 0, limit: int = 100, region: Optional[str] = None) -> List[Dict]:
+        """Оповещения с id больше since (по возрастанию id), не больше limit последних"""
+        with self._lock:
+            alerts = [alert for alert in self._alerts
+                      if alert["id"] > since and (region is None or alert["region"] == region)]
+        return alerts[-limit:]
+
+    def last_id(self) -> int:
+        """id последнего оповещения (0 - оповещений ещё не было)"""
+        return self._next_id - 1
+
+    def stats(self) -> Dict:
+        with self._lock:
+            return {
+                "open_date": str(np.datetime64(self.day, "D")) if self.day is not None else None,
+                "pairs": int((self.mean > 0).sum()),
+                "warmed_up": int(((self.seen >= WARMUP_DAYS) & (self.mean > 0)).sum()),
+                "alerts": len(self._alerts),
+                "last_id": self._next_id - 1,
+                "alpha": self.alpha,
+                "threshold": self.threshold,
+            }
+
+
+anomaly_detector = AnomalyDetector()
+
+
+# Восстановление после догрузки истории; серия загрузок объединяется
+rebuild_job = CoalescingJob("anomaly-rebuild", anomaly_detector.rebuild,
+                            "Ошибка восстановления детектора аномалий")
+
+
+def schedule_rebuild():
+    """Поставить восстановление состояния детектора в фоновую очередь"""
+    rebuild_job.schedule()
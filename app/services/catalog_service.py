@@ -0,0 +1,60 @@
+"""
+Каталог измерений: регионы и типы преступлений для фильтров интерфейса
+
+Для каждого значения - число записей, первая и последняя дата. Каталог ведётся
+в словарях regions и crime_types при загрузке данных (IngestService), а здесь
+держится в памяти и перечитывается один раз после каждого изменения данных,
+поэтому списки для фильтров не обращаются к таблице crimes.
+"""
+from typing import Dict, List, Optional
+from app.cache import get_data_version
+from app.database import CATALOG_TABLES, DATE_FROM_DAY_SQL, db_reader
+
+
+class DimensionCatalog:
+    """Каталог регионов и типов преступлений в памяти"""
+
+    def __init__(self):
+        # (версия данных, {измерение: [записи каталога]})
+        self._state = None
+
+    def _load(self) -> Dict[str, List[Dict]]:
+        entries = {}
+        with db_reader() as conn:
+            for dimension, table in CATALOG_TABLES.items():
+                rows = conn.execute(f"""
+                    SELECT name, incidents, {DATE_FROM_DAY_SQL.format('first_day')},
+                           {DATE_FROM_DAY_SQL.format('last_day')}
+                    FROM {table} WHERE incidents > 0 ORDER BY name
+                """).fetchall()
+                entries[dimension] = [
+                    {"name": name, "count": count, "first_date": first, "last_date": last}
+                    for name, count, first, last in rows
+                ]
+        return entries
+
+    def entries(self, dimension: str) -> List[Dict]:
+        """Записи каталога измерения ("region", "crime_type") по алфавиту"""
+        version = get_data_version()
+        state = self._state
+        # Версия читается до загрузки: если данные изменятся во время чтения,
+        # следующий вызов перечитает каталог
+        if state is None or state[0] != version:
+            state = (version, self._load())
+            self._state = state
+        return state[1][dimension]
+
+    def names(self, dimension: str) -> List[str]:
+        """Значения измерения по алфавиту"""
+        return [entry["name"] for entry in self.entries(dimension)]
+
+    def date_range(self) -> Dict[str, Optional[str]]:
+        """Первая и последняя дата по всем данным"""
+        regions = self.entries("region")
+        return {
+            "start": min((r["first_date"] for r in regions), default=None),
+            "end": max((r["last_date"] for r in regions), default=None),
+        }
+
+
+catalog = DimensionCatalog()
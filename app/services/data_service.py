@@ -1,11 +1,26 @@
 """
 Сервис для работы с данными о преступлениях
 """
-import sqlite3
-from datetime import datetime, timedelta
-from typing import Optional, List, Dict
+import base64
+import binascii
+import csv
+import io
+import json
+import math
+from datetime import date
+from typing import Optional, List, Dict, Iterator, Tuple
+import numpy as np
 import pandas as pd
-from app.database import get_db_connection
+from app.cache import bump_data_version
+from app.database import (
+    CELL_ROLLUP_SIZE, CELL_WEIGHT_SQL, DATE_FROM_DAY_SQL, DAY_FROM_DATE_SQL, KZ_BOUNDS, LOOKUP_TABLES,
+    SEVERITY_HISTOGRAM_COLUMNS, SEVERITY_LEVELS, db_reader, has_spatial_index
+)
+from app.services.anomaly_service import anomaly_detector
+from app.services.catalog_service import catalog
+from app.services.ingest_service import IngestService
+from app.services.memory_engine import grid_cells, memory_engine
+from app.services.snapshot_service import snapshot
 
 REGIONS_KZ = {
     "Алматы": {"lat": 43.2220, "lon": 76.8512},
@@ -27,164 +42,723 @@ REGIONS_KZ = {
     "Восточно-Казахстанская область": {"lat": 49.9789, "lon": 82.6103},
 }
 
+# Типы преступлений для пустой БД
+DEFAULT_CRIME_TYPES = ["Кража", "Грабёж", "Разбой", "Убийство", "Другое"]
+
+
+# Области больше этой (кв. градусы) выгоднее читать сканированием, а не через R*Tree
+SPATIAL_INDEX_MAX_AREA = 50.0
+KM_PER_DEGREE = 111.195
+
+# Столбцы записи о преступлении в ответах API и выгрузке
+CRIME_COLUMNS = ("id", "date", "region", "city", "crime_type", "latitude", "longitude", "severity")
+# Наибольший размер страницы /api/crimes; дальше - по курсору или через выгрузку
+MAX_PAGE_SIZE = 10000
+# Строк за одно чтение из курсора SQLite при выгрузке
+EXPORT_BATCH_SIZE = 2000
+
+# Средняя тяжесть по дневным агрегатам crime_daily
+AVG_SEVERITY_SQL = "CAST(SUM(severity_sum) AS REAL) / SUM(severity_count)"
+
+# Процентили тяжести в сводке
+SEVERITY_PERCENTILES = (25, 50, 75, 90)
+
+# Параметры фильтров: дата переводится в номер дня, название - в ключ словаря
+DAY_PARAM = DAY_FROM_DATE_SQL.format("?")
+REGION_PARAM = "(SELECT id FROM regions WHERE name = ?)"
+CRIME_TYPE_PARAM = "(SELECT id FROM crime_types WHERE name = ?)"
+
+# Столбцы CRIME_COLUMNS из crimes c и словарей (см. CRIME_JOINS_SQL)
+CRIME_SELECT_SQL = (
+    f"c.id, {DATE_FROM_DAY_SQL.format('c.day')}, reg.name, cty.name, typ.name, "
+    "c.latitude, c.longitude, c.severity"
+)
+CRIME_JOINS_SQL = """
+    JOIN regions reg ON reg.id = c.region_id
+    LEFT JOIN cities cty ON cty.id = c.city_id
+    JOIN crime_types typ ON typ.id = c.crime_type_id
+"""
+
+
+def _day_number(value: str) -> int:
+    """Дата YYYY-MM-DD -> номер дня от 1970-01-01; другой формат - ValueError"""
+    return (date.fromisoformat(value) - date(1970, 1, 1)).days
+
+
+def severity_percentiles(histogram: List[int]) -> Dict[str, Optional[int]]:
+    """Процентили тяжести по гистограмме SEVERITY_LEVELS (метод ближайшего ранга)"""
+    total = sum(histogram)
+    cumulative = np.cumsum(histogram)
+    return {
+        f"p{p}": SEVERITY_LEVELS[int(np.searchsorted(cumulative, math.ceil(p / 100 * total)))] if total else None
+        for p in SEVERITY_PERCENTILES
+    }
+
 
 class DataService:
     """Сервис для работы с данными"""
     
-    def save_to_db(self, df: pd.DataFrame) -> Dict:
-        """Сохранить DataFrame в базу данных"""
-        conn = get_db_connection()
-        cursor = conn.cursor()
-        
-        count = 0
-        for _, row in df.iterrows():
-            try:
-                # Определяем координаты региона
-                region = row.get('region', 'Алматы')
-                coords = REGIONS_KZ.get(region, REGIONS_KZ["Алматы"])
-                
-                cursor.execute("""
-                    INSERT INTO crimes (date, region, city, crime_type, latitude, longitude, severity)
-                    VALUES (?, ?, ?, ?, ?, ?, ?)
-                """, (
-                    row.get('date', datetime.now().date()),
-                    region,
-                    row.get('city', ''),
-                    row.get('crime_type', 'Другое'),
-                    row.get('latitude', coords['lat']),
-                    row.get('longitude', coords['lon']),
-                    row.get('severity', 1)
-                ))
-                count += 1
-            except Exception as e:
-                print(f"Ошибка при сохранении записи: {e}")
-                continue
-        
-        conn.commit()
-        conn.close()
-        return {"count": count}
+    def save_to_db(self, df: pd.DataFrame, row_offset: int = 0) -> Dict:
+        """
+        Сохранить DataFrame в базу данных.
+        Возвращает количество вставленных строк и отклонённые строки с причинами.
+        """
+        result = IngestService(REGIONS_KZ).ingest(df, row_offset=row_offset,
+                                                  on_daily=anomaly_detector.observe)
+        if result["count"]:
+            bump_data_version()
+        return result
+    
+    def _from_memory(self, method: str, *args):
+        """
+        Ответ in-memory движка или None, если движок выключен, ещё не догнал
+        данные или не поддерживает фильтр (например, дату не в формате YYYY-MM-DD)
+        """
+        if not memory_engine.ready():
+            return None
+        try:
+            return getattr(memory_engine, method)(*args)
+        except ValueError:
+            return None
     
     def get_summary_stats(self, start_date: Optional[str] = None,
                          end_date: Optional[str] = None,
                          region: Optional[str] = None) -> Dict:
-        """Получить общую статистику"""
-        conn = get_db_connection()
-        
-        query = "SELECT COUNT(*) as total, AVG(severity) as avg_severity FROM crimes WHERE 1=1"
+        """
+        Общая статистика: итог и средняя тяжесть, разбивка по типам, регионам
+        и уровням тяжести, процентили тяжести. Всё считается из одного прохода
+        по дневным агрегатам (или по кубу in-memory движка).
+        """
+        groups = self._from_memory("summary_groups", start_date, end_date, region)
+        if groups is None:
+            groups = self._summary_groups(start_date, end_date, region)
+        return self._summarize(*groups)
+    
+    def _summary_groups(self, start_date: Optional[str] = None,
+                        end_date: Optional[str] = None,
+                        region: Optional[str] = None) -> Tuple[List[Tuple], List[int]]:
+        """
+        Один GROUP BY по crime_daily: суммы по парам (регион, тип) -
+        (регион, тип, число, сумма тяжести, число записей с тяжестью) -
+        и гистограмма тяжести (число записей по SEVERITY_LEVELS)
+        """
+        conditions = ""
         params = []
         
         if start_date:
-            query += " AND date >= ?"
+            conditions += f" AND day >= {DAY_PARAM}"
             params.append(start_date)
         if end_date:
-            query += " AND date <= ?"
+            conditions += f" AND day <= {DAY_PARAM}"
             params.append(end_date)
         if region:
-            query += " AND region = ?"
+            conditions += f" AND region_id = {REGION_PARAM}"
             params.append(region)
         
-        cursor = conn.cursor()
-        cursor.execute(query, params)
-        row = cursor.fetchone()
+        histogram = ", ".join(f"SUM({name}) as {name}" for name in SEVERITY_HISTOGRAM_COLUMNS)
+        query = f"""
+            SELECT reg.name, typ.name, s.count, s.severity_sum, s.severity_count,
+                   {", ".join(f"s.{name}" for name in SEVERITY_HISTOGRAM_COLUMNS)}
+            FROM (
+                SELECT region_id, crime_type_id, SUM(count) as count,
+                       SUM(severity_sum) as severity_sum, SUM(severity_count) as severity_count,
+                       {histogram}
+                FROM crime_daily WHERE 1=1 {conditions}
+                GROUP BY region_id, crime_type_id
+            ) s
+            JOIN regions reg ON reg.id = s.region_id
+            JOIN crime_types typ ON typ.id = s.crime_type_id
+        """
         
-        # Статистика по типам преступлений
-        type_query = query.replace("COUNT(*) as total, AVG(severity) as avg_severity", 
-                                  "crime_type, COUNT(*) as count")
-        type_query += " GROUP BY crime_type"
+        with db_reader() as conn:
+            rows = conn.execute(query, params).fetchall()
         
-        cursor.execute(type_query, params)
-        crime_types = [{"type": r[0], "count": r[1]} for r in cursor.fetchall()]
+        groups = [tuple(r[:5]) for r in rows]
+        histogram = [sum(r[5 + i] for r in rows) for i in range(len(SEVERITY_LEVELS))]
+        return groups, histogram
+    
+    @staticmethod
+    def _summarize(groups: List[Tuple], histogram: List[int]) -> Dict:
+        """Ответ /stats/summary из сумм по парам (регион, тип) и гистограммы тяжести"""
+        by_type, by_region = {}, {}
+        for region, crime_type, count, severity_sum, severity_count in groups:
+            for totals, key in ((by_type, crime_type), (by_region, region)):
+                entry = totals.setdefault(key, [0, 0, 0])
+                entry[0] += count
+                entry[1] += severity_sum
+                entry[2] += severity_count
         
-        conn.close()
+        def avg(severity_sum: int, severity_count: int) -> float:
+            return round(severity_sum / severity_count, 2) if severity_count else 0
         
+        total = sum(entry[0] for entry in by_type.values())
         return {
-            "total": row[0] or 0,
-            "avg_severity": round(row[1] or 0, 2),
-            "crime_types": crime_types
+            "total": total,
+            "avg_severity": avg(sum(e[1] for e in by_type.values()), sum(e[2] for e in by_type.values())),
+            "crime_types": [
+                {"type": name, "count": count, "avg_severity": avg(s, n)}
+                for name, (count, s, n) in sorted(by_type.items())
+            ],
+            "regions": [
+                {"region": name, "count": count, "avg_severity": avg(s, n)}
+                for name, (count, s, n) in sorted(by_region.items(), key=lambda item: (-item[1][0], item[0]))
+            ],
+            "severity": [{"severity": level, "count": count} for level, count in zip(SEVERITY_LEVELS, histogram)],
+            "severity_percentiles": severity_percentiles(histogram),
         }
     
+    def _crimes_query(self, start_date: Optional[str] = None,
+                      end_date: Optional[str] = None,
+                      region: Optional[str] = None,
+                      crime_type: Optional[str] = None,
+                      bbox: Optional[Tuple[float, float, float, float]] = None,
+                      near: Optional[Tuple[float, float, float]] = None,
+                      after: Optional[Tuple[str, int]] = None) -> Tuple[str, List]:
+        """
+        SELECT по crimes с фильтрами в порядке (day, id) по убыванию, без LIMIT.
+        after = (date, id) - ключ последней строки предыдущей страницы.
+        """
+        if near:
+            lat, lon, radius_km = near
+            bbox = self.radius_to_bbox(lat, lon, radius_km)
+        
+        join, query, params = self._spatial_filter(bbox, force_index=True)
+        distance = ", distance_km(c.latitude, c.longitude, ?, ?)" if near else ""
+        query = f"SELECT {CRIME_SELECT_SQL}{distance} FROM crimes c {join} {CRIME_JOINS_SQL} WHERE 1=1" + query
+        if near:
+            params = [lat, lon] + params
+            query += " AND distance_km(c.latitude, c.longitude, ?, ?) <= ?"
+            params += [lat, lon, radius_km]
+        
+        if start_date:
+            query += f" AND c.day >= {DAY_PARAM}"
+            params.append(start_date)
+        if end_date:
+            query += f" AND c.day <= {DAY_PARAM}"
+            params.append(end_date)
+        if region:
+            query += f" AND c.region_id = {REGION_PARAM}"
+            params.append(region)
+        if crime_type:
+            query += f" AND c.crime_type_id = {CRIME_TYPE_PARAM}"
+            params.append(crime_type)
+        if after:
+            # day <= ? задаёт диапазон по индексу, id различает записи одного дня
+            query += f" AND c.day <= {DAY_PARAM} AND (c.day < {DAY_PARAM} OR c.id < ?)"
+            params += [after[0], after[0], after[1]]
+        
+        query += " ORDER BY c.day DESC, c.id DESC"
+        return query, params
+    
+    @staticmethod
+    def _row_to_crime(row, near: bool = False) -> Dict:
+        crime = dict(zip(CRIME_COLUMNS, row))
+        if near:
+            crime["distance_km"] = round(row[len(CRIME_COLUMNS)], 3)
+        return crime
+    
     def get_crimes(self, start_date: Optional[str] = None,
                    end_date: Optional[str] = None,
                    region: Optional[str] = None,
                    crime_type: Optional[str] = None,
-                   limit: int = 1000) -> List[Dict]:
-        """Получить список преступлений"""
-        conn = get_db_connection()
-        cursor = conn.cursor()
+                   limit: int = 1000,
+                   bbox: Optional[Tuple[float, float, float, float]] = None,
+                   near: Optional[Tuple[float, float, float]] = None,
+                   after: Optional[Tuple[str, int]] = None) -> List[Dict]:
+        """
+        Получить список преступлений.
+        bbox = (min_lat, min_lon, max_lat, max_lon) - прямоугольная область,
+        near = (lat, lon, radius_km) - круг радиусом radius_km вокруг точки,
+        after = (date, id) - продолжить после этой записи (постраничный вывод).
+        """
+        query, params = self._crimes_query(start_date, end_date, region, crime_type, bbox, near, after)
+        query += " LIMIT ?"
+        params.append(limit)
+        
+        with db_reader() as conn:
+            rows = conn.execute(query, params).fetchall()
+        
+        return [self._row_to_crime(row, near is not None) for row in rows]
+    
+    def get_crimes_page(self, start_date: Optional[str] = None,
+                        end_date: Optional[str] = None,
+                        region: Optional[str] = None,
+                        crime_type: Optional[str] = None,
+                        limit: int = 1000,
+                        bbox: Optional[Tuple[float, float, float, float]] = None,
+                        near: Optional[Tuple[float, float, float]] = None,
+                        cursor: Optional[str] = None) -> Dict:
+        """
+        Страница преступлений и курсор следующей страницы (keyset по date, id):
+        глубокие страницы читаются так же быстро, как первая.
+        """
+        after = self.decode_cursor(cursor) if cursor else None
+        limit = min(limit, MAX_PAGE_SIZE)
+        crimes = self.get_crimes(start_date, end_date, region, crime_type, limit + 1, bbox, near, after)
+        next_cursor = None
+        if len(crimes) > limit:
+            crimes = crimes[:limit]
+            next_cursor = self.encode_cursor(crimes[-1]["date"], crimes[-1]["id"])
+        return {"crimes": crimes, "next_cursor": next_cursor}
+    
+    @staticmethod
+    def encode_cursor(date: str, crime_id: int) -> str:
+        """Непрозрачный курсор страницы из ключа (date, id) последней записи"""
+        return base64.urlsafe_b64encode(f"{date}|{crime_id}".encode()).decode().rstrip("=")
+    
+    @staticmethod
+    def decode_cursor(cursor: str) -> Tuple[str, int]:
+        """Ключ (date, id) из курсора; ValueError для неверного курсора"""
+        try:
+            raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)).decode()
+            date, crime_id = raw.rsplit("|", 1)
+            return date, int(crime_id)
+        except (ValueError, UnicodeDecodeError, binascii.Error):
+            raise ValueError("Неверный курсор страницы")
+    
+    def export_crimes(self, format: str = "ndjson",
+                      start_date: Optional[str] = None,
+                      end_date: Optional[str] = None,
+                      region: Optional[str] = None,
+                      crime_type: Optional[str] = None,
+                      bbox: Optional[Tuple[float, float, float, float]] = None,
+                      near: Optional[Tuple[float, float, float]] = None) -> Iterator[str]:
+        """
+        Выгрузка всех отфильтрованных преступлений в NDJSON или CSV.
+        Строки читаются из курсора SQLite пачками и сразу отдаются частями ответа,
+        поэтому расход памяти не зависит от объёма выгрузки.
+        Соединение занято, пока генератор не дочитан или не закрыт (close()),
+        поэтому при обрыве выгрузки генератор нужно закрыть.
+        """
+        query, params = self._crimes_query(start_date, end_date, region, crime_type, bbox, near)
+        columns = CRIME_COLUMNS + (("distance_km",) if near else ())
+        
+        with db_reader() as conn:
+            cursor = conn.execute(query, params)
+            try:
+                batches = iter(lambda: cursor.fetchmany(EXPORT_BATCH_SIZE), [])
+                if format == "csv":
+                    buffer = io.StringIO()
+                    writer = csv.writer(buffer)
+                    writer.writerow(columns)
+                    yield buffer.getvalue()
+                    for rows in batches:
+                        buffer.seek(0)
+                        buffer.truncate()
+                        writer.writerows(rows)
+                        yield buffer.getvalue()
+                else:
+                    for rows in batches:
+                        yield "".join(
+                            json.dumps(self._row_to_crime(row, near is not None), ensure_ascii=False) + "\n"
+                            for row in rows
+                        )
+            finally:
+                # Незавершённый SELECT не должен остаться на соединении, возвращаемом в пул
+                cursor.close()
+    
+    @staticmethod
+    def radius_to_bbox(lat: float, lon: float, radius_km: float) -> Tuple[float, float, float, float]:
+        """Прямоугольник, описанный вокруг круга радиусом radius_km"""
+        dlat = radius_km / KM_PER_DEGREE
+        dlon = radius_km / (KM_PER_DEGREE * max(math.cos(math.radians(lat)), 1e-6))
+        return (lat - dlat, lon - dlon, lat + dlat, lon + dlon)
+    
+    def _spatial_filter(self, bbox: Optional[Tuple[float, float, float, float]],
+                        force_index: bool = False) -> Tuple[str, str, List]:
+        """
+        JOIN, условия WHERE и параметры для отбора по области (таблица crimes - c).
+        Небольшие области читаются через R*Tree, большие - проверкой координат.
+        """
+        if not bbox:
+            return "", "", []
+        min_lat, min_lon, max_lat, max_lon = bbox
+        # Унарный + - проверка координат без поиска по индексу: иначе по статистике
+        # ANALYZE планировщик выбирает skip-scan idx_crimes_day по широте вместо
+        # индекса региона или типа
+        where = " AND +c.latitude BETWEEN ? AND ? AND +c.longitude BETWEEN ? AND ?"
+        params = [min_lat, max_lat, min_lon, max_lon]
+        
+        area = (max_lat - min_lat) * (max_lon - min_lon)
+        if has_spatial_index() and (force_index or area <= SPATIAL_INDEX_MAX_AREA):
+            # R*Tree хранит float32 с округлением наружу, поэтому точная
+            # проверка координат по crimes остаётся
+            join = """
+                JOIN crimes_rtree r ON r.id = c.id
+                    AND r.max_lat >= ? AND r.min_lat <= ? AND r.max_lon >= ? AND r.min_lon <= ?
+            """
+            return join, where, params + params
+        return "", where, params
+    
+    def get_heatmap_cells(self, cell_size: float,
+                          bounds: Tuple[float, float, float, float],
+                          start_date: Optional[str] = None,
+                          end_date: Optional[str] = None,
+                          region: Optional[str] = None,
+                          crime_type: Optional[str] = None) -> List[Tuple]:
+        """
+        Агрегация преступлений по ячейкам сетки cell_size x cell_size градусов
+        в пределах bounds = (min_lat, min_lon, max_lat, max_lon).
+        Возвращает (средняя широта, средняя долгота, число, сумма весов тяжести).
+        Карта всей страны считается по недельным агрегатам crime_cells, другие
+        большие области - по колоночному снимку, небольшие - в SQL через R*Tree.
+        """
+        result = self._from_memory("heatmap_cells", cell_size, bounds, start_date, end_date,
+                                   region, crime_type)
+        if result is not None:
+            return result
+        
+        rollup = self._cells_from_rollup(cell_size, bounds, start_date, end_date, region, crime_type)
+        if rollup is not None:
+            return [(lat_sum / count, lon_sum / count, count, weight_sum)
+                    for _, _, count, weight_sum, lat_sum, lon_sum in rollup]
+        
+        min_lat, min_lon, max_lat, max_lon = bounds
+        join, where, params = self._spatial_filter(bounds)
+        if not join:
+            # Без R*Tree SQL проверял бы координаты каждой отфильтрованной строки crimes
+            result = self._cells_from_snapshot(cell_size, bounds, start_date, end_date, region, crime_type)
+            if result is not None:
+                return result
+        query = f"""
+            SELECT AVG(latitude), AVG(longitude), COUNT(*), SUM({CELL_WEIGHT_SQL})
+            FROM crimes c {join}
+            WHERE 1=1 {where}
+        """
+        
+        if start_date:
+            query += f" AND day >= {DAY_PARAM}"
+            params.append(start_date)
+        if end_date:
+            query += f" AND day <= {DAY_PARAM}"
+            params.append(end_date)
+        if region:
+            query += f" AND region_id = {REGION_PARAM}"
+            params.append(region)
+        if crime_type:
+            query += f" AND crime_type_id = {CRIME_TYPE_PARAM}"
+            params.append(crime_type)
         
-        query = "SELECT * FROM crimes WHERE 1=1"
+        query += """
+            GROUP BY CAST((latitude - ?) / ? AS INTEGER), CAST((longitude - ?) / ? AS INTEGER)
+        """
+        params += [min_lat, cell_size, min_lon, cell_size]
+        
+        with db_reader() as conn:
+            return [tuple(r) for r in conn.execute(query, params).fetchall()]
+
+    def get_cell_week_counts(self, cell_size: float,
+                             bounds: Tuple[float, float, float, float],
+                             start_date: Optional[str] = None,
+                             end_date: Optional[str] = None,
+                             region: Optional[str] = None,
+                             crime_type: Optional[str] = None) -> List[Tuple]:
+        """
+        Число преступлений по ячейкам сетки (как в get_heatmap_cells) и неделям.
+        Неделя - номер недели с понедельника от 1970-01-01 ((day + 3) / 7:
+        день 0 - четверг). Возвращает (строка ячейки, столбец ячейки, неделя,
+        число, сумма широт, сумма долгот).
+        """
+        result = self._from_memory("cell_week_counts", cell_size, bounds, start_date, end_date,
+                                   region, crime_type)
+        if result is not None:
+            return result
+
+        rollup = self._cells_from_rollup(cell_size, bounds, start_date, end_date, region, crime_type,
+                                         by_week=True)
+        if rollup is not None:
+            return [(row, col, week, count, lat_sum, lon_sum)
+                    for row, col, week, count, _, lat_sum, lon_sum in rollup]
+
+        min_lat, min_lon, max_lat, max_lon = bounds
+        join, where, params = self._spatial_filter(bounds)
+        params = [min_lat, cell_size, min_lon, cell_size] + params
+        query = f"""
+            SELECT CAST((latitude - ?) / ? AS INTEGER) AS cell_row,
+                   CAST((longitude - ?) / ? AS INTEGER) AS cell_col,
+                   (day + 3) / 7 AS week, COUNT(*), SUM(latitude), SUM(longitude)
+            FROM crimes c {join}
+            WHERE 1=1 {where}
+        """
+
+        if start_date:
+            query += f" AND day >= {DAY_PARAM}"
+            params.append(start_date)
+        if end_date:
+            query += f" AND day <= {DAY_PARAM}"
+            params.append(end_date)
+        if region:
+            query += f" AND region_id = {REGION_PARAM}"
+            params.append(region)
+        if crime_type:
+            query += f" AND crime_type_id = {CRIME_TYPE_PARAM}"
+            params.append(crime_type)
+
+        query += " GROUP BY cell_row, cell_col, week"
+
+        with db_reader() as conn:
+            return [tuple(r) for r in conn.execute(query, params).fetchall()]
+
+    def _cells_from_snapshot(self, cell_size: float,
+                             bounds: Tuple[float, float, float, float],
+                             start_date: Optional[str],
+                             end_date: Optional[str],
+                             region: Optional[str],
+                             crime_type: Optional[str]) -> Optional[List[Tuple]]:
+        """
+        Ячейки сетки по столбцам колоночного снимка (NumPy) - как get_heatmap_cells.
+        None, если снимок отстаёт от данных или дата не в формате YYYY-MM-DD.
+        """
+        if not snapshot.is_current():
+            return None
+        try:
+            data = snapshot.columns(("latitude", "longitude", "severity"),
+                                    start_date, end_date, region, crime_type)
+        except ValueError:
+            return None
+        return grid_cells(data["latitude"], data["longitude"], data["severity"], cell_size, bounds)
+
+    def _cells_from_rollup(self, cell_size: float,
+                           bounds: Tuple[float, float, float, float],
+                           start_date: Optional[str],
+                           end_date: Optional[str],
+                           region: Optional[str],
+                           crime_type: Optional[str],
+                           by_week: bool = False) -> Optional[List[Tuple]]:
+        """
+        Ячейки сетки по недельным агрегатам crime_cells. Подходит для области
+        KZ_BOUNDS и ячейки CELL_ROLLUP_SIZE * 2^k (тепловая карта всей страны):
+        ячейка - это 2^k x 2^k ячеек агрегата. Полные недели периода читаются
+        из crime_cells, неполные недели на краях - из crimes по индексу дней.
+        Возвращает (строка, столбец, [неделя,] число, сумма весов, сумма широт,
+        сумма долгот) или None, если сетка или даты агрегатам не подходят.
+        """
+        shift = round(math.log2(cell_size / CELL_ROLLUP_SIZE)) if cell_size >= CELL_ROLLUP_SIZE else -1
+        if tuple(bounds) != KZ_BOUNDS or shift < 0 or CELL_ROLLUP_SIZE * 2 ** shift != cell_size:
+            return None
+        try:
+            first_day = _day_number(start_date) if start_date else None
+            last_day = _day_number(end_date) if end_date else None
+        except ValueError:
+            return None
+
+        # Неделя w (w >= 1) - дни 7w - 3 .. 7w + 3
+        first_week = max(1, -(-(first_day + 3) // 7)) if first_day is not None else 1
+        last_week = (last_day - 3) // 7 if last_day is not None else None
+        if last_week is not None and last_week < first_week:
+            # Период короче недели: хватает индекса дней по crimes
+            return None
+
+        min_lat, min_lon, max_lat, max_lon = bounds
+        week = "week, " if by_week else ""
+        conditions, filters = "", []
+        if region:
+            conditions += f" AND region_id = {REGION_PARAM}"
+            filters.append(region)
+        if crime_type:
+            conditions += f" AND crime_type_id = {CRIME_TYPE_PARAM}"
+            filters.append(crime_type)
+
+        parts = ["""
+            SELECT cell_row >> ? AS cell_row, cell_col >> ? AS cell_col, week,
+                   count, weight_sum, lat_sum, lon_sum
+            FROM crime_cells WHERE week >= ?
+        """ + (" AND week <= ?" if last_week is not None else "") + conditions]
+        params = [shift, shift, first_week] + ([last_week] if last_week is not None else []) + filters
+
+        # Дни вне полных недель: до первой и после последней
+        edges = [(first_day, 7 * first_week - 4)]
+        if last_week is not None:
+            edges.append((7 * last_week + 4, last_day))
+        join, where, spatial = self._spatial_filter(bounds)
+        for edge_start, edge_end in edges:
+            if edge_start is not None and edge_start > edge_end:
+                continue
+            parts.append(f"""
+                SELECT CAST((latitude - ?) / ? AS INTEGER), CAST((longitude - ?) / ? AS INTEGER),
+                       (day + 3) / 7, 1, {CELL_WEIGHT_SQL}, latitude, longitude
+                FROM crimes c {join}
+                WHERE 1=1 {where} AND day <= ?
+            """ + (" AND day >= ?" if edge_start is not None else "") + conditions)
+            params += [min_lat, cell_size, min_lon, cell_size] + spatial + [edge_end]
+            params += ([edge_start] if edge_start is not None else []) + filters
+
+        query = f"""
+            SELECT cell_row, cell_col, {week}SUM(count), SUM(weight_sum), SUM(lat_sum), SUM(lon_sum)
+            FROM ({" UNION ALL ".join(parts)})
+            GROUP BY cell_row, cell_col{", week" if by_week else ""}
+        """
+        with db_reader() as conn:
+            return [tuple(r) for r in conn.execute(query, params).fetchall()]
+
+    def get_count_series(self, region: Optional[str] = None,
+                         crime_type: Optional[str] = None,
+                         start_date: Optional[str] = None,
+                         end_date: Optional[str] = None,
+                         freq: str = "day") -> pd.Series:
+        """
+        Число преступлений по дням (freq="day"), неделям ("week") или месяцам ("month")
+        за всю историю. Агрегация выполняется в SQL по crime_daily, дни без
+        преступлений заполняются нулями. Индекс - начало периода.
+        """
+        query = "SELECT day, SUM(count) FROM crime_daily WHERE 1=1"
         params = []
         
         if start_date:
-            query += " AND date >= ?"
+            query += f" AND day >= {DAY_PARAM}"
             params.append(start_date)
         if end_date:
-            query += " AND date <= ?"
+            query += f" AND day <= {DAY_PARAM}"
             params.append(end_date)
         if region:
-            query += " AND region = ?"
+            query += f" AND region_id = {REGION_PARAM}"
             params.append(region)
         if crime_type:
-            query += " AND crime_type = ?"
+            query += f" AND crime_type_id = {CRIME_TYPE_PARAM}"
             params.append(crime_type)
         
-        query += " ORDER BY date DESC LIMIT ?"
-        params.append(limit)
+        query += " GROUP BY day ORDER BY day"
+        
+        with db_reader() as conn:
+            rows = conn.execute(query, params).fetchall()
+        
+        if not rows:
+            return pd.Series(dtype="int64", name="count")
+        
+        days, counts = zip(*rows)
+        series = pd.Series(counts, index=pd.to_datetime(days, unit="D"), name="count", dtype="int64")
+        series = series.groupby(level=0).sum()
+        series = series.reindex(pd.date_range(series.index.min(), series.index.max(), freq="D"), fill_value=0)
         
-        cursor.execute(query, params)
-        rows = cursor.fetchall()
-        
-        crimes = []
-        for row in rows:
-            crimes.append({
-                "id": row[0],
-                "date": row[1],
-                "region": row[2],
-                "city": row[3],
-                "crime_type": row[4],
-                "latitude": row[5],
-                "longitude": row[6],
-                "severity": row[7]
-            })
-        
-        conn.close()
-        return crimes
+        if freq == "week":
+            series = series.resample("W-MON", label="left", closed="left").sum()
+        elif freq == "month":
+            series = series.resample("MS").sum()
+        return series
     
+    def get_count_matrix(self, columns: Tuple[str, ...] = ("region", "crime_type"),
+                         regions: Optional[List[str]] = None,
+                         crime_types: Optional[List[str]] = None,
+                         start_date: Optional[str] = None,
+                         end_date: Optional[str] = None) -> pd.DataFrame:
+        """
+        Дневные ряды сразу для всех групп одним GROUP BY по crime_daily.
+        Строки - все дни периода (пропуски заполнены нулями),
+        столбцы - значения columns (например, пары регион x тип преступления).
+        """
+        # Названия значений столбцов берутся из словарей
+        names = ", ".join(f"{name}_ref.name" for name in columns)
+        joins = " ".join(f"JOIN {LOOKUP_TABLES[name]} {name}_ref ON {name}_ref.id = d.{name}_id"
+                         for name in columns)
+        group = ", ".join(f"d.{name}_id" for name in columns)
+        query = f"SELECT d.day, {names}, SUM(d.count) as count FROM crime_daily d {joins} WHERE 1=1"
+        params = []
+        
+        if start_date:
+            query += f" AND d.day >= {DAY_PARAM}"
+            params.append(start_date)
+        if end_date:
+            query += f" AND d.day <= {DAY_PARAM}"
+            params.append(end_date)
+        if regions:
+            query += f" AND d.region_id IN (SELECT id FROM regions WHERE name IN ({', '.join('?' * len(regions))}))"
+            params.extend(regions)
+        if crime_types:
+            query += (f" AND d.crime_type_id IN "
+                      f"(SELECT id FROM crime_types WHERE name IN ({', '.join('?' * len(crime_types))}))")
+            params.extend(crime_types)
+        
+        query += f" GROUP BY d.day, {group}"
+        
+        with db_reader() as conn:
+            rows = conn.execute(query, params).fetchall()
+        
+        df = pd.DataFrame([tuple(r) for r in rows], columns=["date", *columns, "count"])
+        df["date"] = pd.to_datetime(df["date"], unit="D")
+        matrix = df.pivot_table(index="date", columns=list(columns), values="count",
+                                aggfunc="sum", fill_value=0)
+        if not matrix.empty:
+            matrix = matrix.reindex(pd.date_range(matrix.index.min(), matrix.index.max(), freq="D"),
+                                    fill_value=0)
+        return matrix
+
+    def get_region_daily_arrays(self, start_date: str, end_date: str) -> Dict:
+        """
+        Дневные числа преступлений и суммы тяжести по всем регионам за период
+        одним GROUP BY по crime_daily. Массивы [регион, день] - все регионы каталога
+        по алфавиту (без преступлений за период - строки нулей), все дни периода.
+        """
+        query = f"""
+            SELECT reg.name, d.day, d.count, d.severity_sum, d.severity_count
+            FROM (
+                SELECT region_id, day, SUM(count) as count,
+                       SUM(severity_sum) as severity_sum, SUM(severity_count) as severity_count
+                FROM crime_daily
+                WHERE day >= {DAY_PARAM} AND day <= {DAY_PARAM}
+                GROUP BY region_id, day
+            ) d
+            JOIN regions reg ON reg.id = d.region_id
+        """
+        with db_reader() as conn:
+            rows = conn.execute(query, (start_date, end_date)).fetchall()
+
+        regions = sorted(set(catalog.names("region")) | {r[0] for r in rows})
+        first = int(np.datetime64(start_date, "D").astype(np.int64))
+        n_days = max(int(np.datetime64(end_date, "D").astype(np.int64)) - first + 1, 0)
+        shape = (len(regions), n_days)
+        arrays = {name: np.zeros(shape, dtype=np.int64)
+                  for name in ("counts", "severity_sums", "severity_counts")}
+        if rows:
+            index = {name: i for i, name in enumerate(regions)}
+            region_idx = np.array([index[r[0]] for r in rows])
+            day_idx = np.array([r[1] for r in rows]) - first
+            for i, name in enumerate(("counts", "severity_sums", "severity_counts"), start=2):
+                arrays[name][region_idx, day_idx] = [r[i] for r in rows]
+        return {"regions": regions, **arrays}
+
     def get_timeline(self, start_date: Optional[str] = None,
                     end_date: Optional[str] = None,
                     region: Optional[str] = None,
                     group_by: str = "month") -> Dict:
         """Получить динамику по времени"""
-        conn = get_db_connection()
-        cursor = conn.cursor()
+        result = self._from_memory("timeline", start_date, end_date, region, group_by)
+        if result is not None:
+            return result
         
         if group_by == "month":
-            date_format = "strftime('%Y-%m', date)"
+            date_format = "strftime('%Y-%m', day * 86400, 'unixepoch')"
         elif group_by == "week":
-            date_format = "strftime('%Y-W%W', date)"
+            date_format = "strftime('%Y-W%W', day * 86400, 'unixepoch')"
         else:
-            date_format = "date"
+            date_format = DATE_FROM_DAY_SQL.format("day")
         
-        query = f"""
-            SELECT {date_format} as period, COUNT(*) as count, AVG(severity) as avg_severity
-            FROM crimes WHERE 1=1
-        """
+        conditions = ""
         params = []
         
         if start_date:
-            query += " AND date >= ?"
+            conditions += f" AND day >= {DAY_PARAM}"
             params.append(start_date)
         if end_date:
-            query += " AND date <= ?"
+            conditions += f" AND day <= {DAY_PARAM}"
             params.append(end_date)
         if region:
-            query += " AND region = ?"
+            conditions += f" AND region_id = {REGION_PARAM}"
             params.append(region)
         
-        query += f" GROUP BY {date_format} ORDER BY period"
+        # Сначала суммы по дням, затем перевод дня в период - по строке на день
+        query = f"""
+            SELECT {date_format} as period, SUM(count) as count, {AVG_SEVERITY_SQL} as avg_severity
+            FROM (
+                SELECT day, SUM(count) as count, SUM(severity_sum) as severity_sum,
+                       SUM(severity_count) as severity_count
+                FROM crime_daily WHERE 1=1 {conditions}
+                GROUP BY day
+            )
+            GROUP BY period ORDER BY period
+        """
         
-        cursor.execute(query, params)
-        rows = cursor.fetchall()
+        with db_reader() as conn:
+            rows = conn.execute(query, params).fetchall()
         
         timeline = {
             "periods": [r[0] for r in rows],
@@ -192,32 +766,32 @@ class DataService:
             "avg_severity": [round(r[2] or 0, 2) for r in rows]
         }
         
-        conn.close()
         return timeline
     
     def get_regions_comparison(self, start_date: Optional[str] = None,
                               end_date: Optional[str] = None) -> Dict:
         """Сравнение регионов"""
-        conn = get_db_connection()
-        cursor = conn.cursor()
+        result = self._from_memory("regions_comparison", start_date, end_date)
+        if result is not None:
+            return result
         
-        query = """
-            SELECT region, COUNT(*) as count, AVG(severity) as avg_severity
-            FROM crimes WHERE 1=1
+        query = f"""
+            SELECT reg.name, SUM(d.count) as count, {AVG_SEVERITY_SQL} as avg_severity
+            FROM crime_daily d JOIN regions reg ON reg.id = d.region_id WHERE 1=1
         """
         params = []
         
         if start_date:
-            query += " AND date >= ?"
+            query += f" AND d.day >= {DAY_PARAM}"
             params.append(start_date)
         if end_date:
-            query += " AND date <= ?"
+            query += f" AND d.day <= {DAY_PARAM}"
             params.append(end_date)
         
-        query += " GROUP BY region ORDER BY count DESC"
+        query += " GROUP BY d.region_id ORDER BY count DESC, reg.name"
         
-        cursor.execute(query, params)
-        rows = cursor.fetchall()
+        with db_reader() as conn:
+            rows = conn.execute(query, params).fetchall()
         
         comparison = {
             "regions": [r[0] for r in rows],
@@ -225,24 +799,30 @@ class DataService:
             "avg_severity": [round(r[2] or 0, 2) for r in rows]
         }
         
-        conn.close()
         return comparison
     
     def get_regions_list(self) -> List[str]:
-        """Список регионов"""
-        conn = get_db_connection()
-        cursor = conn.cursor()
-        cursor.execute("SELECT DISTINCT region FROM crimes ORDER BY region")
-        regions = [r[0] for r in cursor.fetchall()]
-        conn.close()
+        """Список регионов (из каталога в памяти)"""
+        regions = catalog.names("region")
         return regions if regions else list(REGIONS_KZ.keys())
     
     def get_crime_types(self) -> List[str]:
-        """Список типов преступлений"""
-        conn = get_db_connection()
-        cursor = conn.cursor()
-        cursor.execute("SELECT DISTINCT crime_type FROM crimes ORDER BY crime_type")
-        types = [r[0] for r in cursor.fetchall()]
-        conn.close()
-        return types if types else ["Кража", "Грабёж", "Разбой", "Убийство", "Другое"]
+        """Список типов преступлений (из каталога в памяти)"""
+        types = catalog.names("crime_type")
+        return types if types else list(DEFAULT_CRIME_TYPES)
+    
+    def get_meta(self) -> Dict:
+        """
+        Метаданные фильтров одним ответом: регионы и типы преступлений
+        с числом записей и датами первой/последней записи, общий диапазон дат
+        """
+        regions = catalog.entries("region")
+        crime_types = catalog.entries("crime_type")
+        empty = {"count": 0, "first_date": None, "last_date": None}
+        return {
+            "regions": regions or [{"name": name, **empty} for name in REGIONS_KZ],
+            "crime_types": crime_types or [{"name": name, **empty} for name in DEFAULT_CRIME_TYPES],
+            "date_range": catalog.date_range(),
+            "total": sum(entry["count"] for entry in regions),
+        }
 
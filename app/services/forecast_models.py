@@ -0,0 +1,236 @@
+"""
+Модели прогнозирования временных рядов на NumPy
+
+Модели работают с агрегированными рядами (обычно по месяцам): y имеет форму
+(T, S) - T периодов для S рядов сразу, прогноз - форму (horizon, S).
+Так все регионы и типы преступлений обучаются одним проходом.
+"""
+import time
+from typing import Callable, Dict, List, Optional
+import numpy as np
+
+# Длина сезона для месячных рядов
+SEASON_LENGTH = 12
+
+
+class ForecastModel:
+    """Базовый класс модели прогноза"""
+
+    name = "base"
+
+    def __init__(self, season_length: int = SEASON_LENGTH):
+        self.season_length = season_length
+
+    def fit(self, y: np.ndarray) -> "ForecastModel":
+        raise NotImplementedError
+
+    def predict(self, horizon: int) -> np.ndarray:
+        raise NotImplementedError
+
+
+def _lstsq_design(design: np.ndarray, y: np.ndarray) -> np.ndarray:
+    """Коэффициенты МНК для всех рядов сразу"""
+    coef, *_ = np.linalg.lstsq(design, y, rcond=None)
+    return coef
+
+
+class LinearTrend(ForecastModel):
+    """Линейный тренд: y = a + b*t"""
+
+    name = "linear"
+
+    def fit(self, y: np.ndarray) -> "LinearTrend":
+        self.n = len(y)
+        t = np.arange(self.n, dtype=float)
+        self.coef = _lstsq_design(np.column_stack([np.ones(self.n), t]), y)
+        return self
+
+    def predict(self, horizon: int) -> np.ndarray:
+        t = np.arange(self.n, self.n + horizon, dtype=float)
+        return np.column_stack([np.ones(horizon), t]) @ self.coef
+
+
+class SeasonalNaive(ForecastModel):
+    """Сезонный наивный прогноз: значение того же периода год назад"""
+
+    name = "seasonal_naive"
+
+    def fit(self, y: np.ndarray) -> "SeasonalNaive":
+        self.y = np.asarray(y, dtype=float)
+        return self
+
+    def predict(self, horizon: int) -> np.ndarray:
+        n, m = len(self.y), self.season_length
+        if n < m:
+            # Меньше одного сезона истории - повторяем последнее значение
+            return np.repeat(self.y[-1:], horizon, axis=0)
+        steps = np.arange(horizon)
+        return self.y[n - m + steps % m]
+
+
+class HarmonicRegression(ForecastModel):
+    """Тренд + гармоники сезона: y = a + b*t + sum(c_k*sin + d_k*cos)"""
+
+    name = "harmonic"
+
+    def __init__(self, season_length: int = SEASON_LENGTH, harmonics: int = 2):
+        super().__init__(season_length)
+        self.harmonics = harmonics
+
+    def _design(self, t: np.ndarray) -> np.ndarray:
+        columns = [np.ones(len(t)), t]
+        for k in range(1, self.k + 1):
+            angle = 2 * np.pi * k * t / self.season_length
+            columns += [np.sin(angle), np.cos(angle)]
+        return np.column_stack(columns)
+
+    def fit(self, y: np.ndarray) -> "HarmonicRegression":
+        self.n = len(y)
+        # Параметров должно быть меньше, чем наблюдений
+        self.k = max(0, min(self.harmonics, (self.n - 3) // 2))
+        t = np.arange(self.n, dtype=float)
+        self.coef = _lstsq_design(self._design(t), y)
+        return self
+
+    def predict(self, horizon: int) -> np.ndarray:
+        t = np.arange(self.n, self.n + horizon, dtype=float)
+        return self._design(t) @ self.coef
+
+
+class HoltWinters(ForecastModel):
+    """
+    Аддитивная модель Хольта-Винтерса. Параметры сглаживания подбираются
+    по сетке отдельно для каждого ряда (минимум ошибки прогноза на шаг вперёд).
+    При истории короче двух сезонов сезонная компонента не используется.
+    """
+
+    name = "holt_winters"
+
+    ALPHAS = (0.2, 0.5, 0.8)
+    BETAS = (0.05, 0.2)
+    GAMMAS = (0.1, 0.3, 0.6)
+
+    def fit(self, y: np.ndarray) -> "HoltWinters":
+        y = np.asarray(y, dtype=float)
+        if y.ndim == 1:
+            y = y[:, None]
+        self.n = n = len(y)
+        m = self.season_length
+        seasonal = n >= 2 * m
+
+        # Начальные уровень, тренд и сезонные поправки
+        if seasonal:
+            first, second = y[:m].mean(axis=0), y[m:2 * m].mean(axis=0)
+            level0, trend0 = first, (second - first) / m
+            season0 = y[:m] - first
+            start = m
+        else:
+            level0 = y[0]
+            trend0 = y[1] - y[0] if n > 1 else np.zeros(y.shape[1])
+            season0 = np.zeros((m, y.shape[1]))
+            start = 1
+        gammas = self.GAMMAS if seasonal else (0.0,)
+
+        best_sse = np.full(y.shape[1], np.inf)
+        best = None
+        for alpha in self.ALPHAS:
+            for beta in self.BETAS:
+                for gamma in gammas:
+                    level, trend, season = level0.copy(), trend0.copy(), season0.copy()
+                    sse = np.zeros(y.shape[1])
+                    for t in range(start, n):
+                        s = season[t % m]
+                        error = y[t] - (level + trend + s)
+                        sse += error ** 2
+                        new_level = alpha * (y[t] - s) + (1 - alpha) * (level + trend)
+                        trend = beta * (new_level - level) + (1 - beta) * trend
+                        season[t % m] = gamma * (y[t] - new_level) + (1 - gamma) * s
+                        level = new_level
+
+                    better = sse < best_sse
+                    best_sse = np.where(better, sse, best_sse)
+                    if best is None:
+                        best = (level, trend, season)
+                    else:
+                        best = (np.where(better, level, best[0]),
+                                np.where(better, trend, best[1]),
+                                np.where(better, season, best[2]))
+
+        self.level, self.trend, self.season = best
+        return self
+
+    def predict(self, horizon: int) -> np.ndarray:
+        steps = np.arange(1, horizon + 1)
+        season_index = (self.n - 1 + steps) % self.season_length
+        return self.level + steps[:, None] * self.trend + self.season[season_index]
+
+
+FORECAST_MODELS = {
+    model.name: model
+    for model in (LinearTrend, SeasonalNaive, HarmonicRegression, HoltWinters)
+}
+
+
+def fit_model(name: str, y: np.ndarray) -> ForecastModel:
+    """Обучить модель по имени из FORECAST_MODELS"""
+    if name not in FORECAST_MODELS:
+        raise ValueError(f"Неизвестная модель прогноза: {name}")
+    return FORECAST_MODELS[name]().fit(y)
+
+
+def backtest(y: np.ndarray, models: Optional[List[str]] = None,
+             horizon: int = 3, folds: int = 6,
+             forecasters: Optional[Dict[str, Callable[[int, int], np.ndarray]]] = None) -> Dict:
+    """
+    Проверка моделей на истории со скользящей точкой прогноза: для каждой из
+    последних folds точек модель обучается на данных до неё и прогнозирует
+    horizon периодов вперёд. Возвращает MAE, RMSE, sMAPE и время обучения.
+    forecasters - модели со своим обучением вместо одноимённых из FORECAST_MODELS:
+    имя -> f(origin, horizon), прогноз формы (horizon, S) по данным до периода origin.
+    """
+    if horizon < 1 or folds < 1:
+        raise ValueError("horizon и folds должны быть не меньше 1")
+    forecasters = forecasters or {}
+    y = np.asarray(y, dtype=float)
+    if y.ndim == 1:
+        y = y[:, None]
+    models = models or list(FORECAST_MODELS)
+    origins = [o for o in range(len(y) - horizon - folds + 1, len(y) - horizon + 1) if o >= 2]
+
+    results = {}
+    for name in models:
+        errors, actuals, forecasts, fit_times = [], [], [], []
+        for origin in origins:
+            start = time.perf_counter()
+            if name in forecasters:
+                predicted = forecasters[name](origin, horizon)
+            else:
+                predicted = fit_model(name, y[:origin]).predict(horizon)
+            fit_times.append((time.perf_counter() - start) * 1000)
+            actual = y[origin:origin + horizon]
+            errors.append(predicted - actual)
+            actuals.append(actual)
+            forecasts.append(predicted)
+
+        if not origins:
+            results[name] = {"mae": None, "rmse": None, "smape": None, "fit_time_ms": None}
+            continue
+
+        errors, actuals, forecasts = np.stack(errors), np.stack(actuals), np.stack(forecasts)
+        denom = np.abs(actuals) + np.abs(forecasts)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            smape = np.where(denom > 0, 2 * np.abs(errors) / denom, 0.0)
+        results[name] = {
+            "mae": round(float(np.abs(errors).mean()), 4),
+            "rmse": round(float(np.sqrt((errors ** 2).mean())), 4),
+            "smape": round(float(smape.mean()) * 100, 2),
+            "fit_time_ms": round(float(np.mean(fit_times)), 3),
+        }
+
+    return {
+        "horizon": horizon,
+        "folds": len(origins),
+        "series": y.shape[1],
+        "periods": len(y),
+        "models": results
+    }
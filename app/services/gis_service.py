@@ -2,11 +2,56 @@
 GIS сервис для работы с картами и геоданными
 """
 import folium
-from folium.plugins import HeatMap
-from typing import Optional, List, Dict
-from app.services.data_service import DataService
+import numpy as np
+from scipy.sparse import coo_matrix
+from scipy.sparse.csgraph import connected_components
+from urllib.parse import urlencode
+from typing import Optional, List, Dict, Tuple
+from app.database import KZ_BOUNDS
+from app.services.data_service import DataService, KM_PER_DEGREE
+from app.services.ml_service import MLService
+from app.services.snapshot_service import snapshot
 
 data_service = DataService()
+ml_service = MLService()
+
+# Размер ячейки сетки на zoom=0 (градусы); на каждом следующем уровне - вдвое меньше
+BASE_CELL_SIZE = 22.5
+MAX_ZOOM = 18
+# Ограничение числа ячеек в ответе
+MAX_CELLS = 20000
+# Число последних преступлений в режиме точек
+MAX_POINTS = 5000
+
+# Очаги (DBSCAN по сетке): радиус соседства, км, и минимум преступлений в нём
+HOTSPOT_EPS_KM = 1.0
+HOTSPOT_MIN_INCIDENTS = 50
+# Ячейка сетки - половина радиуса: точки ячейки считаются в её центре тяжести
+HOTSPOT_CELLS_PER_EPS = 2
+# Наибольшее число очагов в ответе (самые крупные)
+MAX_HOTSPOTS = 500
+
+
+def convex_hull(points: np.ndarray) -> List[List[float]]:
+    """Выпуклая оболочка точек [lat, lon] (монотонная цепочка), замкнутый контур"""
+    points = np.unique(points, axis=0)
+    if len(points) < 3:
+        return points.tolist()
+
+    def cross(o, a, b):
+        return (a[0] - o[0]) * (b[1] - o[1]) - (a[1] - o[1]) * (b[0] - o[0])
+
+    lower, upper = [], []
+    for point in points.tolist():
+        while len(lower) >= 2 and cross(lower[-2], lower[-1], point) <= 0:
+            lower.pop()
+        lower.append(point)
+    for point in reversed(points.tolist()):
+        while len(upper) >= 2 and cross(upper[-2], upper[-1], point) <= 0:
+            upper.pop()
+        upper.append(point)
+    hull = lower[:-1] + upper[:-1]
+    return hull + hull[:1]
 
 
 class GISService:
@@ -19,11 +64,14 @@ class GISService:
                         end_date: Optional[str] = None,
                         region: Optional[str] = None) -> Dict:
         """Получить данные для тепловой карты"""
+        if snapshot.is_current():
+            return self._heatmap_points_from_snapshot(start_date, end_date, region)
+        
         crimes = data_service.get_crimes(
             start_date=start_date,
             end_date=end_date,
             region=region,
-            limit=5000
+            limit=MAX_POINTS
         )
         
         # Формируем список точек [lat, lon, weight]
@@ -59,10 +107,283 @@ class GISService:
             "count": len(heatmap_points)
         }
     
+    def _heatmap_points_from_snapshot(self, start_date: Optional[str],
+                                      end_date: Optional[str],
+                                      region: Optional[str]) -> Dict:
+        """Те же точки, что и get_heatmap_data, по колоночному снимку без построчных словарей"""
+        # Последние MAX_POINTS записей по (date, id), новые первыми - как в выдаче get_crimes
+        data = snapshot.latest(("latitude", "longitude", "severity"), MAX_POINTS, start_date, end_date, region)
+        lat, lon, weight = data["latitude"], data["longitude"], data["severity"]
+        
+        valid = (lat >= KZ_BOUNDS[0]) & (lat <= KZ_BOUNDS[2]) & (lon >= KZ_BOUNDS[1]) & (lon <= KZ_BOUNDS[3])
+        points = np.column_stack([lat[valid], lon[valid], np.clip(weight[valid], 0.5, 5.0)])
+        heatmap_points = points.tolist()
+        
+        return {
+            "points": heatmap_points,
+            "center": self.KAZAKHSTAN_CENTER,
+            "count": len(heatmap_points)
+        }
+    
+    def get_heatmap_grid(self, start_date: Optional[str] = None,
+                         end_date: Optional[str] = None,
+                         region: Optional[str] = None,
+                         zoom: int = 6,
+                         bbox: Optional[Tuple[float, float, float, float]] = None,
+                         crime_type: Optional[str] = None) -> Dict:
+        """
+        Тепловая карта по ячейкам сетки: все отфильтрованные преступления
+        агрегируются в SQL, размер ячейки зависит от масштаба карты.
+        Точки: [lat, lon, вес 0.5-5, число преступлений в ячейке].
+        """
+        bounds = self._clip_bounds(bbox)
+        cell_size, zoom = self._grid_cell_size(bounds, zoom)
+        
+        cells = data_service.get_heatmap_cells(
+            cell_size, bounds, start_date, end_date, region, crime_type
+        )
+        max_weight = max((c[3] for c in cells), default=0) or 1
+        
+        # Вес нормируется к шкале 0.5-5, как у отдельных точек
+        heatmap_points = [
+            [round(lat, 5), round(lon, 5),
+             round(max(0.5, 5.0 * weight / max_weight), 3), count]
+            for lat, lon, count, weight in cells
+        ]
+        
+        return {
+            "points": heatmap_points,
+            "center": self.KAZAKHSTAN_CENTER,
+            "count": sum(c[2] for c in cells),
+            "cells": len(cells),
+            "cell_size": cell_size,
+            "zoom": zoom,
+            "mode": "grid"
+        }
+    
+    def get_heatmap_forecast(self, end_date: Optional[str] = None,
+                             region: Optional[str] = None,
+                             zoom: int = 6,
+                             bbox: Optional[Tuple[float, float, float, float]] = None,
+                             crime_type: Optional[str] = None,
+                             weeks: int = 1) -> Dict:
+        """
+        Прогнозная тепловая карта: та же сетка, что в get_heatmap_grid, но
+        число в ячейке - прогноз MLService.get_cell_forecast на weeks недель
+        после end_date. Точки: [lat, lon, вес 0.5-5, прогноз числа преступлений].
+        """
+        bounds = self._clip_bounds(bbox)
+        cell_size, zoom = self._grid_cell_size(bounds, zoom)
+        forecast = ml_service.get_cell_forecast(cell_size, bounds, end_date, region, crime_type, weeks)
+        
+        cells = [c for c in forecast.pop("cells") if round(c[2], 2) > 0]
+        max_weight = max((c[2] for c in cells), default=0) or 1
+        heatmap_points = [
+            [round(lat, 5), round(lon, 5), round(max(0.5, 5.0 * value / max_weight), 3), round(value, 2)]
+            for lat, lon, value in cells
+        ]
+        
+        return {
+            "points": heatmap_points,
+            "center": self.KAZAKHSTAN_CENTER,
+            "count": round(sum(c[2] for c in cells), 1),
+            "cells": len(cells),
+            "cell_size": cell_size,
+            "zoom": zoom,
+            "mode": "forecast",
+            **forecast
+        }
+    
+    def get_hotspots(self, start_date: Optional[str] = None,
+                     end_date: Optional[str] = None,
+                     region: Optional[str] = None,
+                     crime_type: Optional[str] = None,
+                     bbox: Optional[Tuple[float, float, float, float]] = None,
+                     eps_km: float = HOTSPOT_EPS_KM,
+                     min_incidents: int = HOTSPOT_MIN_INCIDENTS) -> Dict:
+        """
+        Очаги преступности - DBSCAN по сетке. Отфильтрованные преступления
+        агрегируются по ячейкам со стороной eps_km / HOTSPOT_CELLS_PER_EPS
+        (в SQL или in-memory движком), дальше кластеризуются ячейки с весом
+        "число преступлений", поэтому объём работы зависит от числа занятых
+        ячеек, а не преступлений. Соседи ячейки ищутся среди соседних ячеек
+        сетки (поиск по отсортированным ключам) с расстоянием между центрами
+        не больше eps_km. Ядро - ячейка, у которой в радиусе eps_km не меньше
+        min_incidents преступлений; очаг - связная группа ядер вместе с
+        граничными ячейками.
+        """
+        bounds = self._clip_bounds(bbox)
+        cell_size = eps_km / KM_PER_DEGREE / HOTSPOT_CELLS_PER_EPS
+        cells = data_service.get_heatmap_cells(cell_size, bounds, start_date, end_date, region, crime_type)
+        result = {
+            "hotspots": [],
+            "total": 0,
+            "clustered": 0,
+            "cells": len(cells),
+            "eps_km": eps_km,
+            "min_incidents": min_incidents,
+        }
+        if not cells:
+            return result
+        
+        data = np.array(cells, dtype=float)
+        row = np.floor((data[:, 0] - bounds[0]) / cell_size).astype(np.int64)
+        col = np.floor((data[:, 1] - bounds[1]) / cell_size).astype(np.int64)
+        n_cols = int(col.max()) + 1
+        # Ячейки упорядочены по ключу сетки: сдвинутые ключи соседей тоже
+        # отсортированы, и searchsorted идёт по массиву последовательно
+        keys = row * n_cols + col
+        order = np.argsort(keys)
+        keys, col = keys[order], col[order]
+        lat, lon, count, weight = data[order].T
+        result["total"] = int(count.sum())
+        
+        # Соседние ячейки: по долготе градус короче, поэтому смотрим дальше
+        cos_lat = np.cos(np.radians(max(abs(bounds[0]), abs(bounds[2]))))
+        reach_row = HOTSPOT_CELLS_PER_EPS
+        reach_col = int(np.ceil(HOTSPOT_CELLS_PER_EPS / max(cos_lat, 1e-6)))
+        index = np.arange(len(cells))
+        # Ячейка - сама себе сосед; остальные пары симметричны, поэтому
+        # просматривается половина смещений, а пара добавляется в обе стороны
+        sources, targets = [index], [index]
+        for d_row in range(0, reach_row + 1):
+            for d_col in range(-reach_col if d_row else 1, reach_col + 1):
+                neighbor_col = col + d_col
+                neighbor = keys + d_row * n_cols + d_col
+                pos = np.minimum(np.searchsorted(keys, neighbor), len(cells) - 1)
+                found = (keys[pos] == neighbor) & (neighbor_col >= 0) & (neighbor_col < n_cols)
+                a, b = index[found], pos[found]
+                dy = (lat[a] - lat[b]) * KM_PER_DEGREE
+                dx = (lon[a] - lon[b]) * KM_PER_DEGREE * np.cos(np.radians((lat[a] + lat[b]) / 2))
+                close = dx * dx + dy * dy <= eps_km * eps_km
+                sources += [a[close], b[close]]
+                targets += [b[close], a[close]]
+        sources, targets = np.concatenate(sources), np.concatenate(targets)
+        
+        density = np.bincount(sources, weights=count[targets], minlength=len(cells))
+        core = density >= min_incidents
+        if not core.any():
+            return result
+        
+        # Связные группы ядер; граничная ячейка присоединяется к очагу соседнего ядра
+        linked = core[sources] & core[targets]
+        graph = coo_matrix((np.ones(linked.sum()), (sources[linked], targets[linked])),
+                           shape=(len(cells), len(cells)))
+        _, components = connected_components(graph, directed=False)
+        labels = np.where(core, components, -1)
+        border = ~core[sources] & core[targets]
+        labels[sources[border]] = components[targets[border]]
+        
+        clustered = labels >= 0
+        _, labels = np.unique(labels[clustered], return_inverse=True)
+        lat, lon, count, weight = lat[clustered], lon[clustered], count[clustered], weight[clustered]
+        totals = np.bincount(labels, weights=count)
+        weights = np.bincount(labels, weights=weight)
+        centroid_lat = np.bincount(labels, weights=lat * count) / totals
+        centroid_lon = np.bincount(labels, weights=lon * count) / totals
+        cell_counts = np.bincount(labels)
+        
+        # Контур очага - выпуклая оболочка углов его ячеек
+        corner_lat = bounds[0] + (np.floor((lat - bounds[0]) / cell_size)[:, None] + [0, 0, 1, 1]) * cell_size
+        corner_lon = bounds[1] + (np.floor((lon - bounds[1]) / cell_size)[:, None] + [0, 1, 0, 1]) * cell_size
+        members = np.argsort(labels, kind="stable")
+        starts = np.concatenate([[0], np.cumsum(cell_counts)])
+        
+        hotspots = []
+        for rank, k in enumerate(np.argsort(-totals, kind="stable")[:MAX_HOTSPOTS].tolist(), start=1):
+            cluster = members[starts[k]:starts[k + 1]]
+            corners = np.column_stack([corner_lat[cluster].ravel(), corner_lon[cluster].ravel()])
+            hotspots.append({
+                "rank": rank,
+                "count": int(totals[k]),
+                "avg_severity": round(float(weights[k] / totals[k]), 2),
+                "centroid": [round(float(centroid_lat[k]), 5), round(float(centroid_lon[k]), 5)],
+                "cells": int(cell_counts[k]),
+                "polygon": [[round(a, 5), round(b, 5)] for a, b in convex_hull(corners)],
+            })
+        
+        result["hotspots"] = hotspots
+        result["clustered"] = int(totals.sum())
+        return result
+    
+    def hotspots_geojson(self, hotspots: Dict) -> Dict:
+        """Очаги в формате GeoJSON: контуры-полигоны со свойствами очага"""
+        features = [
+            {
+                "type": "Feature",
+                "geometry": {"type": "Polygon",
+                             "coordinates": [[[lon, lat] for lat, lon in hotspot["polygon"]]]},
+                "properties": {k: v for k, v in hotspot.items() if k != "polygon"}
+            }
+            for hotspot in hotspots["hotspots"]
+            if len(hotspot["polygon"]) >= 4
+        ]
+        return {"type": "FeatureCollection", "features": features}
+    
+    def get_crimes_geojson(self, start_date: Optional[str] = None,
+                           end_date: Optional[str] = None,
+                           region: Optional[str] = None,
+                           crime_type: Optional[str] = None,
+                           limit: int = 1000,
+                           bbox: Optional[Tuple[float, float, float, float]] = None,
+                           near: Optional[Tuple[float, float, float]] = None) -> Dict:
+        """
+        Преступления в области (bbox) или радиусе (near = lat, lon, radius_km)
+        в формате GeoJSON FeatureCollection. Отбор идёт через пространственный индекс.
+        """
+        crimes = data_service.get_crimes(
+            start_date=start_date,
+            end_date=end_date,
+            region=region,
+            crime_type=crime_type,
+            limit=limit,
+            bbox=bbox,
+            near=near
+        )
+        features = [
+            {
+                "type": "Feature",
+                "geometry": {"type": "Point", "coordinates": [crime["longitude"], crime["latitude"]]},
+                "properties": {k: v for k, v in crime.items() if k not in ("latitude", "longitude")}
+            }
+            for crime in crimes
+            if crime["latitude"] is not None and crime["longitude"] is not None
+        ]
+        return {"type": "FeatureCollection", "features": features}
+    
+    def _grid_cell_size(self, bounds: Tuple, zoom: int) -> Tuple[float, int]:
+        """
+        Размер ячейки сетки по масштабу карты: если ячеек слишком много
+        (крупный масштаб на большой области) - сетка укрупняется.
+        Возвращает (размер ячейки, итоговый zoom).
+        """
+        zoom = max(0, min(MAX_ZOOM, zoom))
+        while True:
+            cell_size = BASE_CELL_SIZE / (2 ** zoom)
+            cells_lat = max(bounds[2] - bounds[0], 0) / cell_size
+            cells_lon = max(bounds[3] - bounds[1], 0) / cell_size
+            if cells_lat * cells_lon <= MAX_CELLS or zoom == 0:
+                return cell_size, zoom
+            zoom -= 1
+    
+    def _clip_bounds(self, bbox: Optional[Tuple[float, float, float, float]]) -> Tuple:
+        """Пересечение области запроса с границами Казахстана"""
+        if not bbox:
+            return KZ_BOUNDS
+        min_lat, min_lon, max_lat, max_lon = bbox
+        return (
+            max(min_lat, KZ_BOUNDS[0]), max(min_lon, KZ_BOUNDS[1]),
+            min(max_lat, KZ_BOUNDS[2]), min(max_lon, KZ_BOUNDS[3])
+        )
+    
     def generate_map(self, start_date: Optional[str] = None,
                     end_date: Optional[str] = None,
                     region: Optional[str] = None) -> str:
-        """Генерация HTML карты с тепловым слоем"""
+        """
+        Генерация HTML карты с тепловым слоем.
+        Данные в HTML не встраиваются: слой подгружается тайлами /api/tiles,
+        поэтому документ зависит только от фильтров.
+        """
         # Создаём карту
         m = folium.Map(
             location=self.KAZAKHSTAN_CENTER,
@@ -70,19 +391,17 @@ class GISService:
             tiles='OpenStreetMap'
         )
         
-        # Получаем данные для тепловой карты
-        heatmap_data = self.get_heatmap_data(start_date, end_date, region)
-        
-        if heatmap_data['points']:
-            # Добавляем тепловой слой
-            HeatMap(
-                heatmap_data['points'],
-                min_opacity=0.2,
-                max_zoom=18,
-                radius=25,
-                blur=15,
-                gradient={0.2: 'blue', 0.4: 'cyan', 0.6: 'lime', 0.8: 'yellow', 1: 'red'}
-            ).add_to(m)
+        # Тепловой слой из тайлов с теми же фильтрами
+        filters = {k: v for k, v in
+                   {"start_date": start_date, "end_date": end_date, "region": region}.items() if v}
+        query = f"?{urlencode(filters)}" if filters else ""
+        folium.TileLayer(
+            tiles=f"/api/tiles/{{z}}/{{x}}/{{y}}{query}",
+            attr="CrimeVision.kz",
+            name="Тепловая карта",
+            overlay=True,
+            max_zoom=18
+        ).add_to(m)
         
         # Добавляем маркеры для крупных городов
         cities = [
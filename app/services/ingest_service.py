@@ -0,0 +1,274 @@
+"""
+Сервис массовой загрузки данных о преступлениях
+"""
+from datetime import datetime
+from typing import Callable, Dict, Optional, Tuple
+import numpy as np
+import pandas as pd
+from app.database import (
+    CATALOG_TABLES, CELL_ROLLUP_SIZE, KZ_BOUNDS, LOOKUP_TABLES, SEVERITY_HISTOGRAM_COLUMNS,
+    SEVERITY_LEVELS, bulk_spatial_index, db_writer
+)
+
+DEFAULT_REGION = "Алматы"
+DEFAULT_CRIME_TYPE = "Другое"
+DEFAULT_SEVERITY = 1
+SEVERITY_MIN, SEVERITY_MAX = 1, 5
+
+# Размер пачки для executemany
+BATCH_SIZE = 50000
+# Сколько отклонённых строк возвращать с указанием причины
+MAX_REJECT_DETAILS = 100
+
+INSERT_SQL = """
+    INSERT INTO crimes (day, region_id, city_id, crime_type_id, latitude, longitude, severity)
+    VALUES (?, ?, ?, ?, ?, ?, ?)
+"""
+
+UPSERT_DAILY_SQL = f"""
+    INSERT INTO crime_daily (day, region_id, crime_type_id, count, severity_sum, severity_count,
+                             {", ".join(SEVERITY_HISTOGRAM_COLUMNS)})
+    VALUES (?, ?, ?, ?, ?, ?, {", ".join("?" * len(SEVERITY_HISTOGRAM_COLUMNS))})
+    ON CONFLICT (day, region_id, crime_type_id) DO UPDATE SET
+        count = count + excluded.count,
+        severity_sum = severity_sum + excluded.severity_sum,
+        severity_count = severity_count + excluded.severity_count,
+        {", ".join(f"{name} = {name} + excluded.{name}" for name in SEVERITY_HISTOGRAM_COLUMNS)}
+"""
+
+UPSERT_CELLS_SQL = """
+    INSERT INTO crime_cells (week, region_id, crime_type_id, cell_row, cell_col,
+                             count, weight_sum, lat_sum, lon_sum)
+    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+    ON CONFLICT (week, region_id, crime_type_id, cell_row, cell_col) DO UPDATE SET
+        count = count + excluded.count,
+        weight_sum = weight_sum + excluded.weight_sum,
+        lat_sum = lat_sum + excluded.lat_sum,
+        lon_sum = lon_sum + excluded.lon_sum
+"""
+
+UPDATE_CATALOG_SQL = """
+    UPDATE {table} SET
+        incidents = incidents + :incidents,
+        first_day = MIN(COALESCE(first_day, :first_day), :first_day),
+        last_day = MAX(COALESCE(last_day, :last_day), :last_day)
+    WHERE id = :id
+"""
+
+
+def _is_blank(series: pd.Series) -> pd.Series:
+    """Пустые значения: NaN/None и пустые строки"""
+    blank = series.isna()
+    if series.dtype == object or pd.api.types.is_string_dtype(series):
+        blank |= series.astype("string").str.strip().eq("").fillna(True)
+    return blank
+
+
+def _text_column(df: pd.DataFrame, name: str, default: str) -> pd.Series:
+    """Текстовый столбец с подстановкой значения по умолчанию"""
+    if name not in df.columns:
+        return pd.Series(default, index=df.index, dtype=object)
+    values = df[name].astype("string").str.strip()
+    return values.mask(_is_blank(df[name]), default).astype(object)
+
+
+def _numeric_column(df: pd.DataFrame, name: str) -> Tuple[pd.Series, pd.Series]:
+    """Числовой столбец: (значения, маска нераспознанных значений)"""
+    if name not in df.columns:
+        return pd.Series(np.nan, index=df.index), pd.Series(False, index=df.index)
+    raw = df[name]
+    values = pd.to_numeric(raw, errors="coerce")
+    invalid = values.isna() & ~_is_blank(raw)
+    return values, invalid
+
+
+def _date_column(df: pd.DataFrame) -> Tuple[pd.Series, pd.Series]:
+    """Столбец дат в формате YYYY-MM-DD: (значения, маска нераспознанных дат)"""
+    today = datetime.now().strftime("%Y-%m-%d")
+    if "date" not in df.columns:
+        return pd.Series(today, index=df.index, dtype=object), pd.Series(False, index=df.index)
+
+    raw = df["date"]
+    blank = _is_blank(raw)
+    parsed = pd.to_datetime(raw.where(~blank), errors="coerce", format="ISO8601")
+
+    # Даты не в ISO формате (например, 15.01.2024) разбираем отдельно
+    retry = parsed.isna() & ~blank
+    if retry.any():
+        parsed[retry] = pd.to_datetime(raw[retry], errors="coerce", dayfirst=True, format="mixed")
+
+    invalid = parsed.isna() & ~blank
+    dates = parsed.dt.strftime("%Y-%m-%d").astype(object)
+    dates[blank] = today
+    return dates, invalid
+
+
+class IngestService:
+    """Векторизованная загрузка DataFrame в таблицу crimes"""
+
+    def __init__(self, regions: Dict[str, Dict[str, float]], batch_size: int = BATCH_SIZE):
+        self.regions = regions
+        self.batch_size = batch_size
+
+    def prepare(self, df: pd.DataFrame, row_offset: int = 0) -> Tuple[pd.DataFrame, pd.DataFrame]:
+        """
+        Проверка и приведение типов целыми столбцами.
+        Возвращает очищенный DataFrame и DataFrame отклонённых строк (row, reason).
+        """
+        df = df.reset_index(drop=True)
+
+        dates, bad_date = _date_column(df)
+        region = _text_column(df, "region", DEFAULT_REGION)
+        city = _text_column(df, "city", "")
+        crime_type = _text_column(df, "crime_type", DEFAULT_CRIME_TYPE)
+
+        # Координаты региона по умолчанию (неизвестный регион -> Алматы)
+        fallback = self.regions.get(DEFAULT_REGION, {"lat": None, "lon": None})
+        region_lat = region.map({name: c["lat"] for name, c in self.regions.items()}).fillna(fallback["lat"])
+        region_lon = region.map({name: c["lon"] for name, c in self.regions.items()}).fillna(fallback["lon"])
+
+        latitude, bad_lat = _numeric_column(df, "latitude")
+        longitude, bad_lon = _numeric_column(df, "longitude")
+        bad_lat |= latitude.abs() > 90
+        bad_lon |= longitude.abs() > 180
+        latitude = latitude.fillna(region_lat)
+        longitude = longitude.fillna(region_lon)
+
+        severity, bad_severity = _numeric_column(df, "severity")
+        severity = severity.fillna(DEFAULT_SEVERITY)
+        bad_severity |= (severity < SEVERITY_MIN) | (severity > SEVERITY_MAX) | (severity % 1 != 0)
+
+        # Первая найденная причина отклонения для каждой строки
+        checks = [
+            (bad_date.to_numpy(), "некорректная дата"),
+            (bad_lat.to_numpy(), "некорректная широта"),
+            (bad_lon.to_numpy(), "некорректная долгота"),
+            (bad_severity.to_numpy(), f"тяжесть должна быть целым числом от {SEVERITY_MIN} до {SEVERITY_MAX}"),
+        ]
+        reasons = np.select([mask for mask, _ in checks], [reason for _, reason in checks], default="")
+        rejected = reasons != ""
+
+        clean = pd.DataFrame({
+            "date": dates,
+            "region": region,
+            "city": city,
+            "crime_type": crime_type,
+            "latitude": latitude.astype(float),
+            "longitude": longitude.astype(float),
+            "severity": severity.where(~rejected, DEFAULT_SEVERITY).astype(np.int64),
+        })[~rejected]
+
+        rejects = pd.DataFrame({
+            "row": np.flatnonzero(rejected) + row_offset + 1,
+            "reason": reasons[rejected],
+        })
+        return clean, rejects
+
+    def ingest(self, df: pd.DataFrame, row_offset: int = 0,
+               on_daily: Optional[Callable[[pd.DataFrame], None]] = None) -> Dict:
+        """
+        Сохранить DataFrame в БД пачками executemany в одной транзакции.
+        row_offset - номер первой строки df во входном файле (для отчёта об ошибках).
+        on_daily получает дневные суммы пачки (day, region_id, crime_type_id, count)
+        после фиксации транзакции.
+        """
+        clean, rejects = self.prepare(df, row_offset)
+
+        if not clean.empty:
+            # Писатель из пула уже настроен (WAL, synchronous=NORMAL)
+            # и фиксирует всю пачку вместе с агрегатами одной транзакцией
+            with db_writer() as conn:
+                encoded = self._encode(conn, clean)
+                self._insert(conn, encoded)
+                daily = self._update_rollup(conn, encoded)
+                self._update_cells(conn, encoded)
+                self._update_catalog(conn, encoded)
+            if on_daily is not None:
+                on_daily(daily[["day", "region_id", "crime_type_id", "count"]])
+
+        return {
+            "count": len(clean),
+            "rejected": len(rejects),
+            "rejects": rejects.head(MAX_REJECT_DETAILS).to_dict("records")
+        }
+
+    def _encode(self, conn, clean: pd.DataFrame) -> pd.DataFrame:
+        """
+        Столбцы в формате хранения: номер дня от 1970-01-01 и ключи словарей.
+        Новые значения добавляются в словари в той же транзакции.
+        """
+        encoded = pd.DataFrame({
+            "day": pd.to_datetime(clean["date"], format="%Y-%m-%d").to_numpy()
+                     .astype("datetime64[D]").astype(np.int64),
+        }, index=clean.index)
+        for name, table in LOOKUP_TABLES.items():
+            values = [(value,) for value in clean[name].unique().tolist()]
+            conn.executemany(f"INSERT OR IGNORE INTO {table} (name) VALUES (?)", values)
+            # Словари невелики (сотни значений) - читаются целиком
+            ids = dict(conn.execute(f"SELECT name, id FROM {table}").fetchall())
+            encoded[f"{name}_id"] = clean[name].map(ids)
+        for name in ("latitude", "longitude", "severity"):
+            encoded[name] = clean[name]
+        return encoded
+
+    def _insert(self, conn, clean: pd.DataFrame):
+        """
+        Вставка пачками по batch_size строк. R*Tree заполняется одним запросом
+        после вставки, а не построчным триггером
+        """
+        columns = [clean[name].tolist() for name in
+                   ("day", "region_id", "city_id", "crime_type_id", "latitude", "longitude", "severity")]
+        rows = list(zip(*columns))
+        with bulk_spatial_index(conn):
+            for start in range(0, len(rows), self.batch_size):
+                conn.executemany(INSERT_SQL, rows[start:start + self.batch_size])
+
+    def _update_rollup(self, conn, clean: pd.DataFrame) -> pd.DataFrame:
+        """Инкрементально добавить вставленные строки в дневные агрегаты; возвращает суммы пачки"""
+        histogram = {name: (clean["severity"] == level).astype(np.int64)
+                     for name, level in zip(SEVERITY_HISTOGRAM_COLUMNS, SEVERITY_LEVELS)}
+        daily = clean.assign(**histogram).groupby(["day", "region_id", "crime_type_id"], sort=False).agg(
+            count=("severity", "size"),
+            severity_sum=("severity", "sum"),
+            severity_count=("severity", "count"),
+            **{name: (name, "sum") for name in SEVERITY_HISTOGRAM_COLUMNS},
+        ).reset_index()
+        rows = list(zip(*(daily[name].tolist() for name in (
+            "day", "region_id", "crime_type_id", "count", "severity_sum", "severity_count",
+            *SEVERITY_HISTOGRAM_COLUMNS,
+        ))))
+        conn.executemany(UPSERT_DAILY_SQL, rows)
+        return daily
+
+    def _update_cells(self, conn, clean: pd.DataFrame):
+        """Инкрементально добавить вставленные строки в недельные агрегаты по ячейкам crime_cells"""
+        min_lat, min_lon, max_lat, max_lon = KZ_BOUNDS
+        lat, lon = clean["latitude"], clean["longitude"]
+        inside = clean[lat.between(min_lat, max_lat) & lon.between(min_lon, max_lon)]
+        # Ячейка и неделя - как CAST(... AS INTEGER) и (day + 3) / 7 в rebuild_cells
+        cells = inside.assign(
+            week=(inside["day"] + 3) // 7,
+            cell_row=((inside["latitude"] - min_lat) / CELL_ROLLUP_SIZE).astype(np.int64),
+            cell_col=((inside["longitude"] - min_lon) / CELL_ROLLUP_SIZE).astype(np.int64),
+            weight=inside["severity"].clip(0.5, 5.0).astype(float),
+        ).groupby(["week", "region_id", "crime_type_id", "cell_row", "cell_col"], sort=False).agg(
+            count=("weight", "size"),
+            weight_sum=("weight", "sum"),
+            lat_sum=("latitude", "sum"),
+            lon_sum=("longitude", "sum"),
+        ).reset_index()
+        rows = list(zip(*(cells[name].tolist() for name in (
+            "week", "region_id", "crime_type_id", "cell_row", "cell_col",
+            "count", "weight_sum", "lat_sum", "lon_sum",
+        ))))
+        conn.executemany(UPSERT_CELLS_SQL, rows)
+
+    def _update_catalog(self, conn, clean: pd.DataFrame):
+        """Число записей и диапазон дней по регионам и типам в каталоге словарей"""
+        for name, table in CATALOG_TABLES.items():
+            stats = clean.groupby(f"{name}_id", sort=False)["day"].agg(["size", "min", "max"])
+            rows = [
+                {"id": int(key), "incidents": int(size), "first_day": int(first), "last_day": int(last)}
+                for key, size, first, last in stats.itertuples()
+            ]
+            conn.executemany(UPDATE_CATALOG_SQL.format(table=table), rows)
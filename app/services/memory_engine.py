@@ -0,0 +1,469 @@
+"""
+In-memory колоночный движок агрегаций (включается CRIMEVISION_MEMORY_ENGINE=1)
+
+Таблица crimes держится в памяти компактными столбцами: дата - номер дня int32,
+регион и тип преступления - коды словарей uint8, тяжесть - int8, координаты - float64.
+Строки упорядочены по дню, поэтому фильтр по датам - это срез (searchsorted).
+Новые строки после загрузки попадают в небольшой неупорядоченный хвост (delta),
+который периодически сливается с основной частью.
+
+Для сводок дополнительно поддерживается плотный куб [день, регион, тип] с числом
+преступлений и суммой тяжести и гистограмма тяжести [день, регион, уровень]:
+summary, timeline и сравнение регионов считаются суммированием среза куба
+и не зависят от числа строк.
+
+Состояние неизменяемо и подменяется целиком, поэтому запросы читают его без блокировок.
+Пока движок не догнал текущую версию данных, DataService отвечает из SQLite.
+"""
+import os
+import threading
+import time
+from datetime import date
+from typing import Dict, List, Optional, Tuple
+import numpy as np
+from app.cache import get_data_version
+from app.database import SEVERITY_LEVELS
+from app.workers import CoalescingJob
+from app.services.snapshot_service import (
+    DICTIONARY_COLUMNS, day_to_date, read_rows_after, snapshot
+)
+
+MEMORY_ENGINE_ENABLED = os.getenv("CRIMEVISION_MEMORY_ENGINE", "0") == "1"
+
+# Не больше 256 регионов и типов преступлений (коды uint8)
+MAX_CODES = np.iinfo(np.uint8).max + 1
+# Ограничение размера куба дни x регионы x типы
+CUBE_MAX_CELLS = 20_000_000
+# Хвост сливается с основной частью, когда превышает эту долю
+DELTA_MERGE_RATIO = 0.05
+DELTA_MERGE_MIN = 100_000
+# Тепловая карта: плотная сетка для bincount, если ячеек не больше этого числа
+DENSE_GRID_MAX_CELLS = 4_000_000
+
+ROW_COLUMNS = {
+    "day": np.int32,
+    "region": np.uint8,
+    "crime_type": np.uint8,
+    "severity": np.int8,
+    "latitude": np.float64,
+    "longitude": np.float64,
+}
+DICTIONARIES = ("region", "crime_type")
+
+
+def grid_cells(lat: np.ndarray, lon: np.ndarray, severity: np.ndarray, cell_size: float,
+               bounds: Tuple[float, float, float, float]) -> List[Tuple]:
+    """
+    Точки в пределах bounds по ячейкам сетки, как GROUP BY в DataService.get_heatmap_cells:
+    (средняя широта, средняя долгота, число, сумма весов тяжести)
+    """
+    min_lat, min_lon, max_lat, max_lon = bounds
+    inside = (lat >= min_lat) & (lat <= max_lat) & (lon >= min_lon) & (lon <= max_lon)
+    lat, lon = lat[inside], lon[inside]
+    if not len(lat):
+        return []
+    weight = np.clip(severity[inside], 0.5, 5.0)
+
+    # Номер ячейки как CAST(... AS INTEGER) в SQL
+    n_cols = int((max_lon - min_lon) / cell_size) + 1
+    n_rows = int((max_lat - min_lat) / cell_size) + 1
+    cell = ((lat - min_lat) / cell_size).astype(np.int64) * n_cols \
+        + ((lon - min_lon) / cell_size).astype(np.int64)
+    if n_rows * n_cols <= DENSE_GRID_MAX_CELLS:
+        count = np.bincount(cell, minlength=n_rows * n_cols)
+        cells = np.flatnonzero(count)
+        group, size = cell, n_rows * n_cols
+        count = count[cells]
+    else:
+        cells, group = np.unique(cell, return_inverse=True)
+        size = len(cells)
+        count = np.bincount(group)
+        cells = np.arange(size)
+
+    def total(values: np.ndarray) -> np.ndarray:
+        return np.bincount(group, weights=values, minlength=size)[cells]
+
+    return list(zip(
+        (total(lat) / count).tolist(),
+        (total(lon) / count).tolist(),
+        count.tolist(),
+        total(weight.astype(np.float64)).tolist()
+    ))
+
+
+class EngineState:
+    """
+    Неизменяемое состояние движка. По кубу заранее считаются накопленные
+    суммы по дням: сумма за любой период - разность двух срезов.
+    """
+
+    def __init__(self, main: Dict[str, np.ndarray], delta: Dict[str, np.ndarray],
+                 dictionaries: Dict[str, List[str]], day0: int,
+                 counts: np.ndarray, severity_sums: np.ndarray, severity_hist: np.ndarray, max_id: int):
+        self.main = main
+        self.delta = delta
+        self.dictionaries = dictionaries
+        self.day0 = day0
+        self.counts = counts
+        self.severity_sums = severity_sums
+        self.severity_hist = severity_hist
+        self.max_id = max_id
+
+        zero = np.zeros((1,) + counts.shape[1:], dtype=np.int64)
+        self.cum_counts = np.concatenate([zero, counts.cumsum(axis=0)])
+        self.cum_sums = np.concatenate([zero, severity_sums.cumsum(axis=0)])
+        self.cum_hist = np.concatenate([np.zeros((1,) + severity_hist.shape[1:], dtype=np.int64),
+                                        severity_hist.cumsum(axis=0)])
+        self.daily_counts = counts.sum(axis=(1, 2))
+        self.daily_sums = severity_sums.sum(axis=(1, 2))
+        # group_by -> (подписи периодов, номер периода для каждого дня куба)
+        self.periods: Dict[str, Tuple[np.ndarray, np.ndarray]] = {}
+
+    @property
+    def rows(self) -> int:
+        return len(self.main["day"]) + len(self.delta["day"])
+
+    def period_index(self, group_by: str) -> Tuple[np.ndarray, np.ndarray]:
+        """Подписи периодов как в SQL (strftime) и номер периода для каждого дня"""
+        if group_by not in self.periods:
+            dates = day_to_date(self.day0 + np.arange(self.counts.shape[0]))
+            if group_by == "month":
+                labels = np.datetime_as_string(dates.astype("datetime64[M]"))
+            elif group_by == "week":
+                # strftime('%Y-W%W'): неделя года, первая неделя начинается с понедельника
+                year_start = dates.astype("datetime64[Y]").astype("datetime64[D]")
+                yday = (dates - year_start).astype(np.int64)
+                weekday = (dates.astype(np.int64) + 3) % 7  # 1970-01-01 - четверг, понедельник = 0
+                week = (yday + 7 - weekday) // 7
+                labels = np.char.add(np.char.add(np.datetime_as_string(dates.astype("datetime64[Y]")), "-W"),
+                                     np.char.zfill(week.astype(str), 2))
+            else:
+                labels = np.datetime_as_string(dates)
+            self.periods[group_by] = np.unique(labels, return_inverse=True)
+        return self.periods[group_by]
+
+
+def _empty_rows() -> Dict[str, np.ndarray]:
+    return {name: np.empty(0, dtype=dtype) for name, dtype in ROW_COLUMNS.items()}
+
+
+def _parse_day(value: Optional[str]) -> Optional[int]:
+    """YYYY-MM-DD -> номер дня; ValueError для других форматов"""
+    if not value:
+        return None
+    return int(np.datetime64(date.fromisoformat(value), "D").astype(np.int64))
+
+
+class MemoryEngine:
+    """Агрегации DataService по столбцам в памяти"""
+
+    def __init__(self, enabled: bool = MEMORY_ENGINE_ENABLED):
+        self.enabled = enabled
+        self._state: Optional[EngineState] = None
+        self._lock = threading.Lock()
+        self.synced_version = -1
+        self.error: Optional[str] = None
+
+    def ready(self) -> bool:
+        """Движок включён и содержит все загруженные данные"""
+        return self.enabled and self._state is not None and self.synced_version == get_data_version()
+
+    # --- загрузка ---
+
+    def _build_cube(self, state_rows: List[Dict[str, np.ndarray]], n_regions: int, n_types: int,
+                    day0: int, n_days: int) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        shape = (n_days, n_regions, n_types)
+        if n_days * n_regions * n_types > CUBE_MAX_CELLS:
+            raise ValueError(f"Куб агрегатов слишком велик: {shape}")
+        n_levels = len(SEVERITY_LEVELS)
+        counts = np.zeros(n_days * n_regions * n_types, dtype=np.int64)
+        severity_sums = np.zeros_like(counts)
+        severity_hist = np.zeros(n_days * n_regions * n_levels, dtype=np.int64)
+        for rows in state_rows:
+            day_region = (rows["day"].astype(np.int64) - day0) * n_regions + rows["region"]
+            index = day_region * n_types + rows["crime_type"]
+            counts += np.bincount(index, minlength=counts.size)
+            severity_sums += np.bincount(index, weights=rows["severity"], minlength=counts.size).astype(np.int64)
+            # Уровни тяжести вне SEVERITY_LEVELS в гистограмму не попадают, как и в crime_daily
+            level = rows["severity"].astype(np.int64) - SEVERITY_LEVELS[0]
+            valid = (level >= 0) & (level < n_levels)
+            severity_hist += np.bincount(day_region[valid] * n_levels + level[valid],
+                                         minlength=severity_hist.size)
+        return (counts.reshape(shape), severity_sums.reshape(shape),
+                severity_hist.reshape(n_days, n_regions, n_levels))
+
+    def load_columns(self, columns: Dict[str, np.ndarray], dictionaries: Dict[str, List[str]], max_id: int):
+        """
+        Заменить состояние строками columns (region/crime_type - коды dictionaries).
+        Используется при запуске и в бенчмарке.
+        """
+        for name in DICTIONARIES:
+            if len(dictionaries[name]) > MAX_CODES:
+                raise ValueError(f"Больше {MAX_CODES} значений в столбце {name}")
+        order = np.argsort(columns["day"], kind="stable")
+        main = {name: np.ascontiguousarray(columns[name][order], dtype=dtype)
+                for name, dtype in ROW_COLUMNS.items()}
+        if len(main["day"]):
+            day0, n_days = int(main["day"][0]), int(main["day"][-1] - main["day"][0]) + 1
+        else:
+            day0, n_days = 0, 0
+        counts, severity_sums, severity_hist = self._build_cube(
+            [main], len(dictionaries["region"]), len(dictionaries["crime_type"]), day0, n_days
+        )
+        self._state = EngineState(main, _empty_rows(), {k: list(dictionaries[k]) for k in DICTIONARIES},
+                                  day0, counts, severity_sums, severity_hist, max_id)
+
+    def _load_from_snapshot(self):
+        """Начальная загрузка из колоночного снимка (без построчного чтения SQLite)"""
+        snapshot.refresh()
+        columns, meta = snapshot.read_all(tuple(ROW_COLUMNS))
+        self.load_columns(columns, {name: meta["dictionaries"][name] for name in DICTIONARIES},
+                          meta["max_id"])
+
+    def _append(self, new: Dict[str, np.ndarray], dictionaries: Dict[str, List[str]], max_id: int):
+        """Добавить новые строки: хвост + приращение куба"""
+        state = self._state
+        for name in DICTIONARIES:
+            if len(dictionaries[name]) > MAX_CODES:
+                raise ValueError(f"Больше {MAX_CODES} значений в столбце {name}")
+        new = {name: new[name].astype(dtype) for name, dtype in ROW_COLUMNS.items()}
+        delta = {name: np.concatenate([state.delta[name], new[name]]) for name in ROW_COLUMNS}
+
+        # Куб расширяется по дням и словарям, если появились новые значения
+        n_regions, n_types = len(dictionaries["region"]), len(dictionaries["crime_type"])
+        old_days = state.counts.shape[0]
+        first = min(int(new["day"].min()), state.day0) if old_days else int(new["day"].min())
+        last = max(int(new["day"].max()), state.day0 + old_days - 1) if old_days else int(new["day"].max())
+        counts, severity_sums, severity_hist = self._build_cube([new], n_regions, n_types,
+                                                                first, last - first + 1)
+        if old_days:
+            offset = state.day0 - first
+            r, t = state.counts.shape[1:]
+            counts[offset:offset + old_days, :r, :t] += state.counts
+            severity_sums[offset:offset + old_days, :r, :t] += state.severity_sums
+            severity_hist[offset:offset + old_days, :r] += state.severity_hist
+
+        main = state.main
+        if len(delta["day"]) > max(DELTA_MERGE_MIN, DELTA_MERGE_RATIO * len(main["day"])):
+            merged = {name: np.concatenate([main[name], delta[name]]) for name in ROW_COLUMNS}
+            order = np.argsort(merged["day"], kind="stable")
+            main = {name: values[order] for name, values in merged.items()}
+            delta = _empty_rows()
+
+        self._state = EngineState(main, delta, {k: list(dictionaries[k]) for k in DICTIONARIES},
+                                  first, counts, severity_sums, severity_hist, max_id)
+
+    def refresh(self) -> Dict:
+        """Догнать базу данных: первая загрузка из снимка, далее - только новые строки"""
+        started = time.perf_counter()
+        version = get_data_version()
+        with self._lock:
+            if self._state is None:
+                self._load_from_snapshot()
+            state = self._state
+            dictionaries = {name: list(state.dictionaries.get(name, [])) for name in DICTIONARY_COLUMNS}
+            new = read_rows_after(state.max_id, dictionaries)
+            if new:
+                self._append(new, dictionaries, int(new["id"].max()))
+            self.synced_version = version
+        return {"added": int(len(new["id"])) if new else 0,
+                "time_ms": round((time.perf_counter() - started) * 1000, 1)}
+
+    # --- запросы ---
+
+    def _code(self, state: EngineState, name: str, value: Optional[str]) -> Optional[int]:
+        """Код значения словаря; -1 - значения нет в данных"""
+        if value is None:
+            return None
+        try:
+            return state.dictionaries[name].index(value)
+        except ValueError:
+            return -1
+
+    def _day_range(self, state: EngineState, start_date: Optional[str],
+                   end_date: Optional[str]) -> Tuple[int, int]:
+        """Границы [lo, hi) периода в индексах дней куба"""
+        start, end = _parse_day(start_date), _parse_day(end_date)
+        n_days = state.counts.shape[0]
+        lo = 0 if start is None else min(max(start - state.day0, 0), n_days)
+        hi = n_days if end is None else min(max(end - state.day0 + 1, lo), n_days)
+        return lo, hi
+
+    def _totals(self, state: EngineState, start_date: Optional[str],
+                end_date: Optional[str]) -> Tuple[np.ndarray, np.ndarray]:
+        """Число и сумма тяжести за период по парам (регион, тип) - разность накопленных сумм"""
+        lo, hi = self._day_range(state, start_date, end_date)
+        return state.cum_counts[hi] - state.cum_counts[lo], state.cum_sums[hi] - state.cum_sums[lo]
+
+    def summary_groups(self, start_date: Optional[str] = None, end_date: Optional[str] = None,
+                       region: Optional[str] = None) -> Tuple[List[Tuple], List[int]]:
+        """Суммы по парам (регион, тип) и гистограмма тяжести, как DataService._summary_groups"""
+        state = self._state
+        counts, sums = self._totals(state, start_date, end_date)
+        lo, hi = self._day_range(state, start_date, end_date)
+        hist = state.cum_hist[hi] - state.cum_hist[lo]
+        code = self._code(state, "region", region)
+        if code == -1:
+            return [], [0] * len(SEVERITY_LEVELS)
+        regions = np.arange(counts.shape[0])
+        if code is not None:
+            counts, sums, hist, regions = counts[code:code + 1], sums[code:code + 1], hist[code:code + 1], [code]
+        r, t = np.nonzero(counts)
+        names, types = state.dictionaries["region"], state.dictionaries["crime_type"]
+        # Пустых значений тяжести в движке нет: число с тяжестью равно числу записей
+        groups = [(names[regions[i]], types[j], count, total, count)
+                  for i, j, count, total in zip(r.tolist(), t.tolist(),
+                                                counts[r, t].tolist(), sums[r, t].tolist())]
+        return groups, hist.sum(axis=0).tolist()
+
+    def timeline(self, start_date: Optional[str] = None, end_date: Optional[str] = None,
+                 region: Optional[str] = None, group_by: str = "month") -> Dict:
+        state = self._state
+        empty = {"periods": [], "counts": [], "avg_severity": []}
+        lo, hi = self._day_range(state, start_date, end_date)
+        code = self._code(state, "region", region)
+        if code == -1 or lo >= hi:
+            return empty
+        if code is None:
+            daily_counts, daily_sums = state.daily_counts[lo:hi], state.daily_sums[lo:hi]
+        else:
+            daily_counts = state.counts[lo:hi, code].sum(axis=1)
+            daily_sums = state.severity_sums[lo:hi, code].sum(axis=1)
+
+        labels, period_of_day = state.period_index(group_by)
+        group = period_of_day[lo:hi]
+        period_counts = np.bincount(group, weights=daily_counts, minlength=len(labels))
+        period_sums = np.bincount(group, weights=daily_sums, minlength=len(labels))
+        present = np.flatnonzero(period_counts)
+        return {
+            "periods": labels[present].tolist(),
+            "counts": period_counts[present].astype(np.int64).tolist(),
+            "avg_severity": [round(v, 2) for v in (period_sums[present] / period_counts[present]).tolist()]
+        }
+
+    def regions_comparison(self, start_date: Optional[str] = None,
+                           end_date: Optional[str] = None) -> Dict:
+        state = self._state
+        counts, sums = self._totals(state, start_date, end_date)
+        by_region, sums_by_region = counts.sum(axis=1), sums.sum(axis=1)
+        present = np.flatnonzero(by_region)
+        order = present[np.argsort(-by_region[present], kind="stable")]
+        names = state.dictionaries["region"]
+        return {
+            "regions": [names[i] for i in order],
+            "counts": by_region[order].tolist(),
+            "avg_severity": [round(v, 2) for v in (sums_by_region[order] / by_region[order]).tolist()]
+        }
+
+    def _rows(self, state: EngineState, start_date: Optional[str], end_date: Optional[str],
+              region: Optional[str], crime_type: Optional[str],
+              columns: Tuple[str, ...]) -> Dict[str, np.ndarray]:
+        """Отфильтрованные строки: срез основной части по датам + маска хвоста"""
+        start, end = _parse_day(start_date), _parse_day(end_date)
+        codes = [(name, self._code(state, name, value))
+                 for name, value in (("region", region), ("crime_type", crime_type)) if value is not None]
+        if any(code == -1 for _, code in codes):
+            return {name: np.empty(0, dtype=ROW_COLUMNS[name]) for name in columns}
+
+        day = state.main["day"]
+        # Граница того же типа, что и столбец: иначе searchsorted копирует массив
+        lo = 0 if start is None else np.searchsorted(day, np.int32(start), side="left")
+        hi = len(day) if end is None else np.searchsorted(day, np.int32(end), side="right")
+        parts = []
+        for rows, sliced in ((state.main, slice(lo, hi)), (state.delta, slice(None))):
+            mask = None
+            conditions = [(rows[name][sliced], code) for name, code in codes]
+            if rows is state.delta:
+                if start is not None:
+                    mask = rows["day"] >= start
+                if end is not None:
+                    mask = rows["day"] <= end if mask is None else mask & (rows["day"] <= end)
+            for values, code in conditions:
+                mask = values == code if mask is None else mask & (values == code)
+            # Без фильтров срез основной части отдаётся без копирования
+            parts.append({name: rows[name][sliced] if mask is None else rows[name][sliced][mask]
+                          for name in columns})
+        if not len(parts[1][columns[0]]):
+            return parts[0]
+        return {name: np.concatenate([p[name] for p in parts]) for name in columns}
+
+    def heatmap_cells(self, cell_size: float, bounds: Tuple[float, float, float, float],
+                      start_date: Optional[str] = None, end_date: Optional[str] = None,
+                      region: Optional[str] = None, crime_type: Optional[str] = None) -> List[Tuple]:
+        """То же, что DataService.get_heatmap_cells, масками и bincount"""
+        state = self._state
+        rows = self._rows(state, start_date, end_date, region, crime_type,
+                          ("latitude", "longitude", "severity"))
+        return grid_cells(rows["latitude"], rows["longitude"], rows["severity"], cell_size, bounds)
+
+    def cell_week_counts(self, cell_size: float, bounds: Tuple[float, float, float, float],
+                         start_date: Optional[str] = None, end_date: Optional[str] = None,
+                         region: Optional[str] = None, crime_type: Optional[str] = None) -> List[Tuple]:
+        """То же, что DataService.get_cell_week_counts: группы по (ячейка, неделя) через unique"""
+        state = self._state
+        rows = self._rows(state, start_date, end_date, region, crime_type,
+                          ("day", "latitude", "longitude"))
+        min_lat, min_lon, max_lat, max_lon = bounds
+        lat, lon = rows["latitude"], rows["longitude"]
+        inside = (lat >= min_lat) & (lat <= max_lat) & (lon >= min_lon) & (lon <= max_lon)
+        lat, lon = lat[inside], lon[inside]
+        if not len(lat):
+            return []
+
+        # Ключ группы - одно число: (ячейка, неделя от первой недели)
+        n_cols = int((max_lon - min_lon) / cell_size) + 1
+        week = (rows["day"][inside].astype(np.int64) + 3) // 7
+        first_week = int(week.min())
+        n_weeks = int(week.max()) - first_week + 1
+        cell = ((lat - min_lat) / cell_size).astype(np.int64) * n_cols \
+            + ((lon - min_lon) / cell_size).astype(np.int64)
+        keys, group = np.unique(cell * n_weeks + (week - first_week), return_inverse=True)
+        cell, week = np.divmod(keys, n_weeks)
+        return list(zip(
+            (cell // n_cols).tolist(), (cell % n_cols).tolist(), (week + first_week).tolist(),
+            np.bincount(group).tolist(),
+            np.bincount(group, weights=lat).tolist(),
+            np.bincount(group, weights=lon).tolist()
+        ))
+
+    def stats(self) -> Dict:
+        """Размер и состояние движка"""
+        state = self._state
+        if state is None:
+            return {"enabled": self.enabled, "loaded": False, "error": self.error}
+        arrays = (list(state.main.values()) + list(state.delta.values())
+                  + [state.counts, state.severity_sums, state.severity_hist])
+        return {
+            "enabled": self.enabled,
+            "loaded": True,
+            "ready": self.ready(),
+            "rows": state.rows,
+            "delta_rows": len(state.delta["day"]),
+            "max_id": state.max_id,
+            "cube_shape": list(state.counts.shape),
+            "memory_mb": round(sum(a.nbytes for a in arrays) / 2 ** 20, 1),
+            "dictionaries": {name: len(values) for name, values in state.dictionaries.items()},
+            "error": self.error,
+        }
+
+
+memory_engine = MemoryEngine()
+
+
+def _run_refresh():
+    try:
+        memory_engine.refresh()
+        memory_engine.error = None
+    except Exception as e:
+        memory_engine.error = str(e)
+        raise
+
+
+# Обновление движка после загрузки данных; серия загрузок объединяется
+refresh_job = CoalescingJob("memory-engine", _run_refresh, "Ошибка обновления in-memory движка")
+
+
+def schedule_refresh(version: Optional[int] = None):
+    """Поставить обновление движка в фоновую очередь (если движок включён)"""
+    if memory_engine.enabled:
+        refresh_job.schedule()
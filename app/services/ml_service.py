@@ -1,16 +1,253 @@
 """
 ML сервис для прогнозирования и оценки рисков
 """
+import os
+import threading
+import time
+from collections import OrderedDict
 import pandas as pd
 import numpy as np
 from datetime import datetime, timedelta
-from typing import Optional, Dict, List
+from typing import Optional, Dict, List, Tuple
 from sklearn.linear_model import LinearRegression
 from sklearn.preprocessing import StandardScaler
-from app.services.data_service import DataService
+from app.cache import get_data_version
+from app.services.catalog_service import catalog
+from app.services.data_service import DataService, REGIONS_KZ
+from app.services.forecast_models import FORECAST_MODELS, fit_model, backtest
+from app.workers import CoalescingJob
 
 data_service = DataService()
 
+# Оценка риска: окно в днях, веса z-оценок в индексе риска и пороги уровней по индексу
+RISK_WINDOW_DAYS = 90
+RISK_WEIGHTS = {"rate": 0.5, "severity": 0.25, "trend": 0.25}
+RISK_LEVELS = ((0.5, "high"), (-0.5, "medium"), (float("-inf"), "low"))
+RISK_LABELS = {"low": "Низкий", "medium": "Средний", "high": "Высокий",
+               "insufficient_data": "Нет данных"}
+
+# Наибольшее число моделей в реестре: давно не запрошенные вытесняются
+# и после загрузки данных не переобучаются
+MODEL_REGISTRY_SIZE = int(os.getenv("CRIMEVISION_MODEL_REGISTRY_SIZE", "256"))
+
+# Наибольший горизонт прогноза /api/forecast, месяцев
+MAX_FORECAST_MONTHS = 24
+
+# Пределы backtest: горизонт прогноза (месяцев) и число точек прогноза на истории
+MAX_BACKTEST_HORIZON = 12
+MAX_BACKTEST_FOLDS = 24
+
+# Что именно проверяет backtest для каждой модели (в ответе /api/forecast/backtest)
+BACKTEST_MODEL_NOTES = {
+    "linear": "дневная линейная регрессия, как /api/forecast?model=linear; "
+              "прогноз на месяц - среднее по его дням",
+    "seasonal_naive": "месячная модель, как /api/forecast?model=seasonal_naive",
+    "harmonic": "месячная модель, как /api/forecast?model=harmonic",
+    "holt_winters": "месячная модель, как /api/forecast?model=holt_winters",
+}
+
+# Прогноз по ячейкам сетки (недели): число лагов, окно скользящего среднего,
+# сезонный лаг (та же неделя год назад) и число недель-целей для обучения
+# (история читается на CELL_SEASON недель длиннее - для признаков)
+CELL_LAGS = 4
+CELL_WINDOW = 12
+CELL_SEASON = 52
+CELL_HISTORY_WEEKS = 104
+# Последние недели истории, на которых оценивается точность (MAE) перед обучением на всей истории
+CELL_HOLDOUT_WEEKS = 4
+# Наибольший горизонт прогноза, недель
+CELL_MAX_WEEKS = 8
+
+
+class ModelRegistry:
+    """
+    Обученные модели прогноза по ключу (регион, тип преступления, модель), LRU.
+    Модель действительна только для версии данных, на которой обучена.
+    """
+
+    def __init__(self, max_entries: int = MODEL_REGISTRY_SIZE):
+        self.max_entries = max_entries
+        self._models: "OrderedDict[Tuple, Dict]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._evictions = 0
+
+    def get(self, key: Tuple) -> Optional[Dict]:
+        with self._lock:
+            entry = self._models.get(key)
+            if entry is not None:
+                self._models.move_to_end(key)
+        if entry is not None and entry["version"] == get_data_version():
+            return entry
+        return None
+
+    def put(self, key: Tuple, entry: Dict):
+        with self._lock:
+            self._models[key] = entry
+            self._models.move_to_end(key)
+            while len(self._models) > self.max_entries:
+                self._models.popitem(last=False)
+                self._evictions += 1
+
+    def keys(self) -> List[Tuple]:
+        with self._lock:
+            return list(self._models)
+
+    def stats(self) -> Dict:
+        version = get_data_version()
+        with self._lock:
+            fresh = sum(1 for entry in self._models.values() if entry["version"] == version)
+            return {"models": len(self._models), "fresh": fresh, "max_models": self.max_entries,
+                    "evictions": self._evictions, "data_version": version}
+
+
+model_registry = ModelRegistry()
+
+
+def fit_linear_trends(counts: np.ndarray) -> Dict[str, np.ndarray]:
+    """
+    МНК-прямая для каждого столбца counts (дни x ряды) одним проходом NumPy.
+    Каждый ряд учитывается с первого до последнего дня с преступлениями -
+    так же, как при обучении отдельной модели по одному ряду.
+    """
+    days, _ = counts.shape
+    t = np.arange(days, dtype=float)[:, None]
+    nonzero = counts > 0
+    present = nonzero.any(axis=0)
+    first = np.where(present, nonzero.argmax(axis=0), 0)
+    last = np.where(present, days - 1 - nonzero[::-1].argmax(axis=0), -1)
+    mask = (t >= first) & (t <= last)
+    
+    n = mask.sum(axis=0)
+    y = counts * mask
+    sx = (t * mask).sum(axis=0)
+    sy = y.sum(axis=0)
+    sxx = (t * t * mask).sum(axis=0)
+    sxy = (t * y).sum(axis=0)
+    
+    denom = n * sxx - sx ** 2
+    valid = (n >= 2) & (denom > 0)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        slope = np.where(valid, (n * sxy - sx * sy) / denom, np.nan)
+        intercept = np.where(valid, (sy - slope * sx) / n, np.nan)
+        mean = np.where(n > 0, sy / n, np.nan)
+    return {"slope": slope, "intercept": intercept, "mean": mean, "valid": valid}
+
+
+def check_months(months: int):
+    """ValueError, если горизонт прогноза вне 1..MAX_FORECAST_MONTHS месяцев"""
+    if not 1 <= months <= MAX_FORECAST_MONTHS:
+        raise ValueError(f"months должен быть от 1 до {MAX_FORECAST_MONTHS}")
+
+
+def daily_trend_forecaster(matrix: pd.DataFrame, months: pd.DatetimeIndex):
+    """
+    Модель /api/forecast (model=linear) для backtest по месяцам: МНК-прямая по дневному
+    ряду (fit_linear_trends) на днях до начала месяца origin. Прогноз на месяц -
+    среднее прямой по его дням (значение в середине), сравнимое с месячным средним.
+    """
+    counts = matrix.to_numpy(dtype=float)
+    month_of_day = np.searchsorted(months.to_numpy(), matrix.index.to_numpy(), side="right") - 1
+    centers = np.bincount(month_of_day, weights=np.arange(len(counts), dtype=float)) / np.bincount(month_of_day)
+    starts = np.searchsorted(month_of_day, np.arange(len(months)))
+
+    def forecast(origin: int, horizon: int) -> np.ndarray:
+        fit = fit_linear_trends(counts[:starts[origin]])
+        t = centers[origin:origin + horizon, None]
+        # Ряд без тренда (меньше двух дней) - среднее, без данных - ноль
+        predicted = np.where(fit["valid"], fit["intercept"] + fit["slope"] * t, fit["mean"])
+        return np.maximum(np.nan_to_num(predicted), 0)
+
+    return forecast
+
+
+def risk_window(end_date: Optional[str] = None, days: int = RISK_WINDOW_DAYS) -> Tuple[str, str]:
+    """
+    Окно оценки риска (начало, конец): days дней по end_date включительно.
+    По умолчанию окно заканчивается последней датой в данных, но не позже сегодняшней.
+    Общее для assess_risk и assess_risk_all. ValueError - end_date не YYYY-MM-DD.
+    """
+    if end_date is None:
+        today = datetime.now().strftime('%Y-%m-%d')
+        last = catalog.date_range()["end"]
+        end_date = min(last, today) if last else today
+    try:
+        end = datetime.strptime(end_date, '%Y-%m-%d')
+    except ValueError:
+        raise ValueError("end_date: дата в формате YYYY-MM-DD")
+    return (end - timedelta(days=days - 1)).strftime('%Y-%m-%d'), end_date
+
+
+def zscores(values: np.ndarray) -> np.ndarray:
+    """z-оценки относительно всех значений; при нулевом разбросе - нули"""
+    std = values.std() if values.size > 1 else 0.0
+    if not std > 0:
+        return np.zeros_like(values, dtype=float)
+    return (values - values.mean()) / std
+
+
+def week_start(week: int, offset: int = 0) -> str:
+    """Дата понедельника недели week (номер как в get_cell_week_counts), сдвинутая на offset дней"""
+    return str(np.datetime64(int(week) * 7 - 3 + offset, "D"))
+
+
+def cell_feature_names(seasonal: bool) -> List[str]:
+    """Названия признаков cell_features в порядке столбцов"""
+    names = [f"lag_{k}" for k in range(1, CELL_LAGS + 1)] + [f"mean_{CELL_WINDOW}"]
+    return names + [f"lag_{CELL_SEASON}"] if seasonal else names
+
+
+def cell_features(counts: np.ndarray, week: int, seasonal: bool) -> np.ndarray:
+    """
+    Признаки недели week для всех ячеек (counts - ячейки x недели): число
+    преступлений 1..CELL_LAGS недель назад, среднее за CELL_WINDOW недель и,
+    если seasonal, число CELL_SEASON недель назад. Используются только
+    недели до week, поэтому week может быть следующей после последней.
+    """
+    lags = counts[:, week - CELL_LAGS:week][:, ::-1]
+    mean = counts[:, week - CELL_WINDOW:week].mean(axis=1, keepdims=True)
+    columns = [lags, mean]
+    if seasonal:
+        columns.append(counts[:, week - CELL_SEASON, None])
+    return np.hstack(columns)
+
+
+def first_cell_target(weeks: int) -> Tuple[int, bool]:
+    """Первая неделя, для которой хватает истории на признаки, и есть ли сезонный лаг"""
+    seasonal = weeks - CELL_SEASON >= CELL_HOLDOUT_WEEKS + CELL_WINDOW
+    return (CELL_SEASON if seasonal else max(CELL_LAGS, CELL_WINDOW)), seasonal
+
+
+def fit_cell_model(counts: np.ndarray, first: int, last: int, seasonal: bool) -> np.ndarray:
+    """
+    Одна линейная модель для всех ячеек: МНК по всем парам (ячейка, неделя)
+    с неделями first..last-1. Матрица X^T X и вектор X^T y накапливаются по
+    неделям, поэтому память не зависит от длины истории. Возвращает
+    коэффициенты [свободный член, признаки...].
+    """
+    features = len(cell_feature_names(seasonal)) + 1
+    xtx = np.zeros((features, features))
+    xty = np.zeros(features)
+    ones = np.ones((len(counts), 1))
+    for week in range(first, last):
+        x = np.hstack([ones, cell_features(counts, week, seasonal)])
+        xtx += x.T @ x
+        xty += x.T @ counts[:, week]
+    return np.linalg.lstsq(xtx, xty, rcond=None)[0]
+
+
+def predict_cells(counts: np.ndarray, coef: np.ndarray, weeks: int, seasonal: bool) -> np.ndarray:
+    """Прогноз на weeks недель вперёд (ячейки x недели): каждый прогноз - лаг для следующей недели"""
+    history = counts.shape[1]
+    extended = np.hstack([counts, np.zeros((len(counts), weeks))])
+    for week in range(history, history + weeks):
+        extended[:, week] = np.maximum(coef[0] + cell_features(extended, week, seasonal) @ coef[1:], 0)
+    return extended[:, history:]
+
+
+def _to_json_list(values: np.ndarray) -> List:
+    """ndarray -> вложенные списки, NaN -> null"""
+    return np.where(np.isnan(values), None, np.round(values, 2)).tolist()
+
 
 class MLService:
     """Сервис машинного обучения"""
@@ -36,67 +273,311 @@ class MLService:
     
     def get_forecast(self, region: Optional[str] = None,
                     crime_type: Optional[str] = None,
-                    months: int = 3) -> Dict:
-        """Получить прогноз преступности"""
-        try:
-            # Получаем исторические данные
-            crimes = data_service.get_crimes(region=region, limit=10000)
-            
-            if not crimes:
-                # Если данных нет, возвращаем прогноз на основе средних значений
-                return self._get_default_forecast(months)
-            
-            df = pd.DataFrame(crimes)
-            if df.empty:
-                return self._get_default_forecast(months)
-            
-            # Агрегируем по датам
-            df['date'] = pd.to_datetime(df['date'])
-            df_daily = df.groupby('date').size().reset_index(name='count')
-            df_daily = df_daily.sort_values('date')
-            
-            # Подготовка данных для прогноза
-            df_daily['day_number'] = (df_daily['date'] - df_daily['date'].min()).dt.days
-            
-            # Простая линейная регрессия для прогноза
-            X = df_daily[['day_number']].values
-            y = df_daily['count'].values
-            
-            if len(X) < 2:
-                return self._get_default_forecast(months)
-            
-            model = LinearRegression()
-            model.fit(X, y)
-            
-            # Генерируем прогноз
-            last_date = df_daily['date'].max()
-            forecast_dates = []
-            forecast_values = []
-            
-            for i in range(1, months + 1):
-                future_date = last_date + timedelta(days=30 * i)
-                days_ahead = (future_date - df_daily['date'].min()).days
-                predicted = model.predict([[days_ahead]])[0]
-                
-                # Не даём отрицательные значения
-                predicted = max(0, predicted)
-                
-                forecast_dates.append(future_date.strftime('%Y-%m-%d'))
-                forecast_values.append(round(float(predicted), 2))
-            
+                    months: int = 3,
+                    model: str = "linear") -> Dict:
+        """
+        Получить прогноз преступности.
+        model="linear" - линейный тренд по дням; остальные модели из
+        FORECAST_MODELS (seasonal_naive, harmonic, holt_winters) работают по месяцам.
+        Прогноз по средним значениям - только если данных для модели нет;
+        остальные ошибки не подменяются им, а передаются вызывающему.
+        """
+        if model not in FORECAST_MODELS:
+            raise ValueError(f"Неизвестная модель прогноза: {model}")
+        check_months(months)
+        entry = self._get_model(region, crime_type, model)
+        if entry["model"] is None:
+            # Если данных нет, возвращаем прогноз на основе средних значений
+            return self._get_default_forecast(months)
+        
+        if model != "linear":
+            return self._seasonal_forecast(entry, region, crime_type, months, model)
+        
+        # Прогноз на все горизонты одним вызовом predict
+        steps = np.arange(1, months + 1)
+        days_ahead = entry["last_day_number"] + 30 * steps
+        predicted = entry["model"].predict(days_ahead.reshape(-1, 1))
+        
+        # Не даём отрицательные значения
+        predicted = np.maximum(predicted, 0)
+        
+        forecast_dates = [
+            (entry["last_date"] + timedelta(days=30 * int(i))).strftime('%Y-%m-%d')
+            for i in steps
+        ]
+        
+        return {
+            "status": "success",
+            "forecast": {
+                "dates": forecast_dates,
+                "values": [round(float(v), 2) for v in predicted],
+                "region": region or "Все регионы",
+                "crime_type": crime_type or "Все типы"
+            },
+            "historical_avg": entry["historical_avg"]
+        }
+    
+    def get_batch_forecast(self, regions: Optional[List[str]] = None,
+                           crime_types: Optional[List[str]] = None,
+                           months: int = 3,
+                           model: str = "linear") -> Dict:
+        """
+        Прогноз для всего перекрёстного произведения регионов и типов преступлений:
+        один GROUP BY по дневным агрегатам и векторное обучение всех рядов сразу.
+        values[i][j] - прогноз для regions[i] и crime_types[j] на каждую дату из dates;
+        null - недостаточно данных для ряда.
+        """
+        if model not in FORECAST_MODELS:
+            raise ValueError(f"Неизвестная модель прогноза: {model}")
+        check_months(months)
+        matrix = data_service.get_count_matrix(regions=regions, crime_types=crime_types)
+        
+        region_list = regions or sorted(set(matrix.columns.get_level_values("region")))
+        type_list = crime_types or sorted(set(matrix.columns.get_level_values("crime_type")))
+        shape = (len(region_list), len(type_list))
+        
+        if matrix.empty or not region_list or not type_list:
+            empty = np.full(shape + (months,), np.nan)
             return {
                 "status": "success",
-                "forecast": {
-                    "dates": forecast_dates,
-                    "values": forecast_values,
-                    "region": region or "Все регионы",
-                    "crime_type": crime_type or "Все типы"
-                },
-                "historical_avg": round(float(df_daily['count'].mean()), 2)
+                "regions": region_list,
+                "crime_types": type_list,
+                "dates": [],
+                "values": _to_json_list(empty),
+                "historical_avg": _to_json_list(np.full(shape, np.nan)),
+                "note": "Недостаточно данных для прогноза"
             }
-        except Exception as e:
-            print(f"Ошибка прогнозирования: {e}")
-            return self._get_default_forecast(months)
+        
+        columns = pd.MultiIndex.from_product([region_list, type_list], names=["region", "crime_type"])
+        matrix = matrix.reindex(columns=columns, fill_value=0)
+        
+        if model != "linear":
+            # Месячные модели: среднее число преступлений в день по месяцам
+            monthly = matrix.resample("MS").mean()
+            fitted = fit_model(model, monthly.to_numpy(dtype=float))
+            predicted = np.maximum(fitted.predict(months), 0)
+            predicted[:, ~(matrix.to_numpy() > 0).any(axis=0)] = np.nan
+            last_period = monthly.index.max()
+            return {
+                "status": "success",
+                "model": model,
+                "regions": region_list,
+                "crime_types": type_list,
+                "dates": [(last_period + pd.DateOffset(months=int(i))).strftime('%Y-%m-%d')
+                          for i in range(1, months + 1)],
+                "values": _to_json_list(predicted.T.reshape(shape + (months,))),
+                "historical_avg": _to_json_list(matrix.mean().to_numpy().reshape(shape))
+            }
+        
+        counts = matrix.to_numpy(dtype=float)
+        fit = fit_linear_trends(counts)
+        
+        # Общий горизонт для всех рядов: от последней даты в данных
+        steps = np.arange(1, months + 1)
+        last_date = matrix.index.max()
+        future = (len(matrix.index) - 1) + 30 * steps
+        predicted = fit["intercept"][None, :] + fit["slope"][None, :] * future[:, None]
+        predicted = np.maximum(predicted, 0)
+        
+        return {
+            "status": "success",
+            "model": model,
+            "regions": region_list,
+            "crime_types": type_list,
+            "dates": [(last_date + timedelta(days=30 * int(i))).strftime('%Y-%m-%d') for i in steps],
+            "values": _to_json_list(predicted.T.reshape(shape + (months,))),
+            "historical_avg": _to_json_list(fit["mean"].reshape(shape))
+        }
+    
+    def backtest_models(self, horizon: int = 3, folds: int = 6,
+                        models: Optional[List[str]] = None, by: str = "region") -> Dict:
+        """
+        Сравнение моделей на истории: месячные ряды по каждому региону
+        (by="region") или типу преступления (by="crime_type").
+        linear - та же дневная модель, что отдаёт /api/forecast, остальные - месячные.
+        """
+        if by not in ("region", "crime_type"):
+            raise ValueError("Параметр by: region или crime_type")
+        matrix = data_service.get_count_matrix(columns=(by,))
+        if matrix.empty:
+            return {"status": "error", "error": "Недостаточно данных"}
+        monthly = matrix.resample("MS").mean()
+        result = backtest(monthly.to_numpy(dtype=float), models, horizon, folds,
+                          forecasters={"linear": daily_trend_forecaster(matrix, monthly.index)})
+        return {"status": "success", "by": by, **result,
+                "model_notes": {name: BACKTEST_MODEL_NOTES.get(name) for name in result["models"]}}
+    
+    def get_cell_forecast(self, cell_size: float,
+                          bounds: Tuple[float, float, float, float],
+                          end_date: Optional[str] = None,
+                          region: Optional[str] = None,
+                          crime_type: Optional[str] = None,
+                          weeks: int = 1) -> Dict:
+        """
+        Прогноз числа преступлений в каждой ячейке сетки на weeks недель после
+        последней полной недели до end_date (по умолчанию - до последней даты в данных).
+        Недельные числа по ячейкам читаются одним GROUP BY, одна линейная модель
+        по лаговым признакам (cell_features) обучается сразу на всех ячейках.
+        Точность - MAE одношагового прогноза на последних CELL_HOLDOUT_WEEKS
+        неделях против наивного прогноза "как на прошлой неделе".
+        cells - [средняя широта, средняя долгота, прогноз за все недели].
+        """
+        end_date = end_date or catalog.date_range()["end"]
+        if not end_date:
+            return {"status": "error", "error": "Недостаточно данных", "cells": []}
+        # Даты позже сегодняшней (ошибочные записи) не сдвигают прогноз в будущее
+        end = min(np.datetime64(end_date, "D"), np.datetime64(datetime.now().date(), "D")).astype(np.int64)
+        # Последняя полная неделя заканчивается воскресеньем не позже end_date
+        last_week = (end + 3 + 1) // 7 - 1
+        first_week = last_week - CELL_HISTORY_WEEKS - CELL_SEASON + 1
+        rows = data_service.get_cell_week_counts(
+            cell_size, bounds, week_start(first_week), week_start(last_week + 1, -1), region, crime_type
+        )
+        if not rows:
+            return {"status": "error", "error": "Недостаточно данных", "cells": []}
+        cell_rows, cell_cols, week, count, lat_sum, lon_sum = (np.array(column) for column in zip(*rows))
+        cell_keys, cell = np.unique(cell_rows * (int(cell_cols.max()) + 1) + cell_cols, return_inverse=True)
+        cell = cell.ravel()
+        first_week = int(week.min())
+        n_weeks = int(last_week) - first_week + 1
+        counts = np.zeros((len(cell_keys), n_weeks))
+        np.add.at(counts, (cell, week - first_week), count)
+
+        first, seasonal = first_cell_target(n_weeks)
+        if n_weeks - first <= CELL_HOLDOUT_WEEKS:
+            return {"status": "error", "error": "Недостаточно истории для прогноза", "cells": []}
+
+        started = time.perf_counter()
+        holdout = n_weeks - CELL_HOLDOUT_WEEKS
+        coef = fit_cell_model(counts, first, holdout, seasonal)
+        errors, naive_errors = [], []
+        for target in range(holdout, n_weeks):
+            x = cell_features(counts, target, seasonal)
+            errors.append(np.abs(np.maximum(coef[0] + x @ coef[1:], 0) - counts[:, target]))
+            naive_errors.append(np.abs(counts[:, target - 1] - counts[:, target]))
+        coef = fit_cell_model(counts, first, n_weeks, seasonal)
+        predicted = predict_cells(counts, coef, weeks, seasonal)
+        fit_ms = (time.perf_counter() - started) * 1000
+
+        totals = np.bincount(cell, weights=count)
+        latitude = np.bincount(cell, weights=lat_sum) / totals
+        longitude = np.bincount(cell, weights=lon_sum) / totals
+        forecast = predicted.sum(axis=1)
+        return {
+            "status": "success",
+            "weeks": [week_start(last_week + i) for i in range(1, weeks + 1)],
+            "history": {"start": week_start(first_week), "end": week_start(last_week + 1, -1),
+                        "weeks": n_weeks},
+            "cells": np.column_stack([latitude, longitude, forecast]).tolist(),
+            "model": {
+                "features": ["intercept"] + cell_feature_names(seasonal),
+                "coefficients": np.round(coef, 4).tolist(),
+                "samples": int(len(counts) * (n_weeks - first)),
+                "mae": round(float(np.mean(errors)), 4),
+                "naive_mae": round(float(np.mean(naive_errors)), 4),
+                "fit_ms": round(fit_ms, 1),
+            },
+        }
+
+    def _seasonal_forecast(self, entry: Dict, region: Optional[str], crime_type: Optional[str],
+                           months: int, model: str) -> Dict:
+        """Прогноз месячной моделью: среднее число преступлений в день по месяцам"""
+        predicted = np.maximum(entry["model"].predict(months)[:, 0], 0)
+        forecast_dates = [
+            (entry["last_period"] + pd.DateOffset(months=int(i))).strftime('%Y-%m-%d')
+            for i in range(1, months + 1)
+        ]
+        return {
+            "status": "success",
+            "forecast": {
+                "dates": forecast_dates,
+                "values": [round(float(v), 2) for v in predicted],
+                "region": region or "Все регионы",
+                "crime_type": crime_type or "Все типы",
+                "model": model
+            },
+            "historical_avg": entry["historical_avg"]
+        }
+    
+    def _get_model(self, region: Optional[str], crime_type: Optional[str],
+                   model: str = "linear") -> Dict:
+        """
+        Модель из реестра; если её нет для текущей версии данных - обучить.
+        Для региона или типа, которых нет в каталоге, модель не обучается
+        и в реестр не попадает (иначе каждая опечатка в запросе переобучалась бы
+        после каждой загрузки).
+        """
+        if not (region is None or region in catalog.names("region")) or \
+                not (crime_type is None or crime_type in catalog.names("crime_type")):
+            return {"version": get_data_version(), "model": None}
+        key = (region, crime_type, model)
+        entry = model_registry.get(key)
+        if entry is None:
+            if model == "linear":
+                entry = self._fit(region, crime_type)
+            else:
+                entry = self._fit_seasonal(region, crime_type, model)
+            model_registry.put(key, entry)
+        return entry
+    
+    def _fit_seasonal(self, region: Optional[str], crime_type: Optional[str], model: str) -> Dict:
+        """Обучить месячную модель на средних дневных значениях по месяцам"""
+        entry = {"version": get_data_version(), "model": None}
+        
+        daily = data_service.get_count_series(region=region, crime_type=crime_type)
+        monthly = daily.resample("MS").mean()
+        if len(monthly) < 2:
+            return entry
+        
+        entry.update({
+            "model": fit_model(model, monthly.to_numpy(dtype=float)[:, None]),
+            "last_period": monthly.index.max(),
+            "historical_avg": round(float(daily.mean()), 2)
+        })
+        return entry
+    
+    def _fit(self, region: Optional[str], crime_type: Optional[str]) -> Dict:
+        """Обучить линейную модель дневного числа преступлений"""
+        version = get_data_version()
+        entry = {"version": version, "model": None}
+        
+        # Дневные ряды за всю историю (с нулями в днях без преступлений)
+        daily = data_service.get_count_series(region=region, crime_type=crime_type)
+        if len(daily) < 2:
+            return entry
+        
+        # Подготовка данных для прогноза
+        first_date = daily.index.min()
+        day_number = (daily.index - first_date).days
+        
+        # Простая линейная регрессия для прогноза
+        X = np.asarray(day_number).reshape(-1, 1)
+        y = daily.to_numpy()
+        
+        model = LinearRegression()
+        model.fit(X, y)
+        
+        last_date = daily.index.max()
+        entry.update({
+            "model": model,
+            "last_date": last_date,
+            "last_day_number": (last_date - first_date).days,
+            "historical_avg": round(float(y.mean()), 2)
+        })
+        return entry
+    
+    def train(self, keys: Optional[List[Tuple]] = None):
+        """Обучить модели для ключей (по умолчанию - все известные и базовые)"""
+        if keys is None:
+            keys = set(model_registry.keys())
+            keys.add((None, None, "linear"))
+            keys.update((region, None, "linear") for region in REGIONS_KZ)
+        for region, crime_type, model in keys:
+            self._get_model(region, crime_type, model)
+    
+    def warm_up(self):
+        """Фоновое обучение базовых моделей при запуске приложения"""
+        schedule_training()
     
     def _get_default_forecast(self, months: int) -> Dict:
         """Прогноз по умолчанию (если недостаточно данных)"""
@@ -124,11 +605,9 @@ class MLService:
         }
     
     def assess_risk(self, region: Optional[str] = None) -> Dict:
-        """Оценка уровня риска"""
+        """Оценка уровня риска за окно RISK_WINDOW_DAYS дней (то же окно, что в assess_risk_all)"""
         try:
-            # Получаем статистику за последние 3 месяца
-            end_date = datetime.now().strftime('%Y-%m-%d')
-            start_date = (datetime.now() - timedelta(days=90)).strftime('%Y-%m-%d')
+            start_date, end_date = risk_window()
             
             stats = data_service.get_summary_stats(
                 start_date=start_date,
@@ -161,17 +640,11 @@ class MLService:
                 elif risk_level == "medium":
                     risk_level = "high"
             
-            risk_labels = {
-                "low": "Низкий",
-                "medium": "Средний",
-                "high": "Высокий"
-            }
-            
             return {
                 "status": "success",
                 "region": region or "Все регионы",
                 "risk_level": risk_level,
-                "risk_label": risk_labels.get(risk_level, "Неизвестно"),
+                "risk_label": RISK_LABELS.get(risk_level, "Неизвестно"),
                 "risk_score": min(risk_score, 5),
                 "total_crimes": total_crimes,
                 "avg_severity": avg_severity,
@@ -187,3 +660,77 @@ class MLService:
                 "error": str(e)
             }
 
+    
+    def assess_risk_all(self, end_date: Optional[str] = None, days: int = RISK_WINDOW_DAYS) -> Dict:
+        """
+        Рейтинг риска всех регионов каталога за последние days дней
+        (окно risk_window - как в assess_risk). Дневные ряды всех регионов читаются одним
+        запросом, показатели считаются NumPy сразу по всем регионам:
+        - rate - преступлений в день, severity - средняя тяжесть,
+          trend - наклон МНК-прямой дневного числа (преступлений в день за день);
+        - каждый показатель переводится в z-оценку относительно регионов с преступлениями
+          за период, индекс риска - взвешенная сумма z-оценок (RISK_WEIGHTS);
+        - регионы без преступлений за период в z-оценки не входят: они идут в конце
+          таблицы с уровнем insufficient_data, нулевыми показателями и без ранга.
+        """
+        start_date, end_date = risk_window(end_date, days)
+        
+        data = data_service.get_region_daily_arrays(start_date, end_date)
+        counts = data["counts"].astype(float)
+        totals = counts.sum(axis=1)
+        severity_counts = data["severity_counts"].sum(axis=1)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            severity = np.where(severity_counts > 0, data["severity_sums"].sum(axis=1) / severity_counts, 0.0)
+        
+        t = np.arange(days, dtype=float)
+        t -= t.mean()
+        trend = counts @ t / (t @ t) if days > 1 else np.zeros(len(totals))
+        
+        metrics = {"rate": totals / days, "severity": severity, "trend": trend}
+        active = totals > 0
+        z = {name: np.zeros(len(totals)) for name in metrics}
+        for name, values in metrics.items():
+            z[name][active] = zscores(values[active])
+        index = sum(weight * z[name] for name, weight in RISK_WEIGHTS.items())
+        
+        regions = []
+        ranked = np.flatnonzero(active)[np.argsort(-index[active], kind="stable")].tolist()
+        for i in ranked + np.flatnonzero(~active).tolist():
+            if active[i]:
+                level = next(level for threshold, level in RISK_LEVELS if index[i] >= threshold)
+            else:
+                level = "insufficient_data"
+            regions.append({
+                "rank": len(regions) + 1 if active[i] else None,
+                "region": data["regions"][i],
+                "risk_level": level,
+                "risk_label": RISK_LABELS[level],
+                "risk_index": round(float(index[i]), 2) if active[i] else None,
+                "total_crimes": int(totals[i]),
+                "crimes_per_day": round(float(metrics["rate"][i]), 2),
+                "avg_severity": round(float(severity[i]), 2),
+                "trend": round(float(trend[i]), 4),
+                "z_scores": {name: round(float(z[name][i]), 2) for name in RISK_WEIGHTS} if active[i] else None,
+            })
+        
+        return {
+            "status": "success",
+            "period": f"{start_date} - {end_date}",
+            "days": days,
+            "weights": RISK_WEIGHTS,
+            "regions": regions
+        }
+
+
+def _run_training():
+    MLService().train()
+
+
+# Фоновое переобучение после загрузки данных: серия загрузок подряд
+# (например, потоковая по частям) объединяется в одно обучение
+training_job = CoalescingJob("ml-train", _run_training, "Ошибка фонового обучения моделей")
+
+
+def schedule_training(version: Optional[int] = None):
+    """Поставить переобучение моделей в фоновую очередь"""
+    training_job.schedule()
@@ -0,0 +1,403 @@
+"""
+Колоночный снимок таблицы crimes (NumPy, memory-mapped)
+
+Снимок разбит на партиции по месяцам: data/snapshot/<YYYY-MM>/<столбец>.npy,
+строки внутри партиции упорядочены по id (порядку загрузки). Текстовые столбцы хранятся
+кодами словарей (meta.json), дата - номером дня от 1970-01-01.
+Файлы открываются через np.load(mmap_mode="r"): чтение не копирует данные,
+страницы подгружаются ОС по мере обращения.
+
+После загрузки данных снимок обновляется в фоне и инкрементально: из crimes
+читаются только новые строки (id больше последнего в снимке) и дописываются
+в конец файлов затронутых месяцев, уже записанные строки не перезаписываются.
+"""
+import io
+import json
+import os
+import shutil
+import threading
+import time
+import zipfile
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+import numpy as np
+import pandas as pd
+from app.cache import get_data_version
+from app.database import db_reader
+from app.workers import CoalescingJob
+
+SNAPSHOT_DIR = Path(os.getenv("CRIMEVISION_SNAPSHOT_DIR", "data/snapshot"))
+
+# Столбцы снимка и их типы; коды словарей - uint16
+COLUMNS = {
+    "id": np.int64,
+    "day": np.int32,
+    "region": np.uint16,
+    "city": np.uint16,
+    "crime_type": np.uint16,
+    "latitude": np.float64,
+    "longitude": np.float64,
+    "severity": np.int8,
+}
+DICTIONARY_COLUMNS = ("region", "city", "crime_type")
+MAX_CODE = np.iinfo(np.uint16).max
+
+# Строк за одно чтение из crimes при построении снимка
+READ_CHUNK_SIZE = 500000
+
+SELECT_NEW_ROWS = """
+    SELECT c.id, c.day, reg.name, cty.name, typ.name, c.latitude, c.longitude, c.severity
+    FROM crimes c
+    JOIN regions reg ON reg.id = c.region_id
+    LEFT JOIN cities cty ON cty.id = c.city_id
+    JOIN crime_types typ ON typ.id = c.crime_type_id
+    WHERE c.id > ? ORDER BY c.id
+"""
+
+
+def date_to_day(dates: pd.Series) -> np.ndarray:
+    """YYYY-MM-DD -> номер дня от 1970-01-01 (int32)"""
+    return pd.to_datetime(dates, format="%Y-%m-%d").to_numpy().astype("datetime64[D]").astype(np.int32)
+
+
+def day_to_date(days: np.ndarray) -> np.ndarray:
+    """Номер дня -> datetime64[D]"""
+    return np.asarray(days).astype("datetime64[D]")
+
+
+def encode_values(values: pd.Series, dictionary: List) -> np.ndarray:
+    """Коды значений по словарю (словарь только дополняется, коды не меняются)"""
+    factor, uniques = pd.factorize(values, use_na_sentinel=False)
+    index = {value: code for code, value in enumerate(dictionary)}
+    lookup = np.empty(len(uniques), dtype=np.int64)
+    for i, value in enumerate(uniques):
+        value = None if pd.isna(value) else value
+        if value not in index:
+            index[value] = len(dictionary)
+            dictionary.append(value)
+        lookup[i] = index[value]
+    if len(dictionary) > MAX_CODE:
+        raise ValueError("Слишком много различных значений для словаря снимка")
+    return lookup[factor].astype(np.uint16)
+
+
+def append_npy(path: Path, values: np.ndarray, rows: int):
+    """
+    Дописать values в одномерный .npy после первых rows значений и обновить
+    длину в заголовке. Данные пишутся до заголовка, поэтому прерванная запись
+    не портит файл: повтор с тем же rows перезапишет недописанный хвост.
+    Если новый заголовок длиннее старого, файл переписывается целиком.
+    """
+    with open(path, "r+b") as f:
+        version = np.lib.format.read_magic(f)
+        read_header = np.lib.format.read_array_header_2_0 if version == (2, 0) \
+            else np.lib.format.read_array_header_1_0
+        _, _, dtype = read_header(f)
+        offset = f.tell()
+        header = io.BytesIO()
+        np.lib.format.write_array_header_1_0(header, {
+            "descr": np.lib.format.dtype_to_descr(dtype),
+            "fortran_order": False,
+            "shape": (rows + len(values),),
+        })
+        if len(header.getvalue()) == offset:
+            f.seek(offset + rows * dtype.itemsize)
+            f.write(np.ascontiguousarray(values, dtype=dtype).tobytes())
+            f.truncate()
+            f.flush()
+            f.seek(0)
+            f.write(header.getvalue())
+            return
+    existing = np.load(path, mmap_mode="r")[:rows]
+    np.save(path, np.concatenate([existing, values.astype(dtype)]))
+
+
+def read_rows_after(after_id: int, dictionaries: Dict[str, List]) -> Dict[str, np.ndarray]:
+    """
+    Строки crimes с id > after_id в виде столбцов COLUMNS (пусто - {}).
+    Словари дополняются новыми значениями.
+    """
+    chunks = []
+    with db_reader() as conn:
+        cursor = conn.execute(SELECT_NEW_ROWS, (after_id,))
+        while True:
+            rows = cursor.fetchmany(READ_CHUNK_SIZE)
+            if not rows:
+                break
+            df = pd.DataFrame([tuple(r) for r in rows],
+                              columns=["id", "day", "region", "city", "crime_type",
+                                       "latitude", "longitude", "severity"])
+            chunk = {
+                "id": df["id"].to_numpy(np.int64),
+                "day": df["day"].to_numpy(np.int32),
+                "latitude": pd.to_numeric(df["latitude"]).to_numpy(np.float64, na_value=np.nan),
+                "longitude": pd.to_numeric(df["longitude"]).to_numpy(np.float64, na_value=np.nan),
+                "severity": df["severity"].fillna(1).to_numpy(np.int8),
+            }
+            for name in DICTIONARY_COLUMNS:
+                chunk[name] = encode_values(df[name], dictionaries[name])
+            chunks.append(chunk)
+    if not chunks:
+        return {}
+    return {name: np.concatenate([c[name] for c in chunks]) for name in COLUMNS}
+
+
+class ColumnSnapshot:
+    """Партиционированный по месяцам колоночный снимок crimes"""
+
+    def __init__(self, path: Path = SNAPSHOT_DIR):
+        self.path = path
+        self._lock = threading.RLock()
+        self._meta: Optional[Dict] = None
+        self._mapped: Dict[str, Dict[str, np.ndarray]] = {}
+        # Версия данных, до которой снимок обновлён в этом процессе
+        self.synced_version = -1
+
+    # --- метаданные ---
+
+    def _meta_path(self) -> Path:
+        return self.path / "meta.json"
+
+    def meta(self) -> Dict:
+        """Метаданные: словари, партиции (месяц -> число строк), последний id"""
+        with self._lock:
+            if self._meta is None:
+                try:
+                    self._meta = json.loads(self._meta_path().read_text(encoding="utf-8"))
+                except (FileNotFoundError, ValueError):
+                    self._meta = {
+                        "max_id": 0, "rows": 0, "partitions": {},
+                        "dictionaries": {name: [] for name in DICTIONARY_COLUMNS},
+                        "columns": {name: np.dtype(dtype).name for name, dtype in COLUMNS.items()},
+                    }
+            return self._meta
+
+    def _write_meta(self, meta: Dict):
+        tmp = self._meta_path().with_suffix(".tmp")
+        tmp.write_text(json.dumps(meta, ensure_ascii=False), encoding="utf-8")
+        os.replace(tmp, self._meta_path())
+        self._meta = meta
+
+    def is_current(self) -> bool:
+        """Снимок содержит все загруженные в этом процессе данные"""
+        return self.synced_version == get_data_version()
+
+    # --- чтение ---
+
+    def partitions(self, start_date: Optional[str] = None, end_date: Optional[str] = None) -> List[str]:
+        """Месяцы (YYYY-MM), пересекающиеся с периодом, по возрастанию"""
+        months = sorted(self.meta()["partitions"])
+        start, end = (start_date or "")[:7], (end_date or "9999-12")[:7]
+        return [m for m in months if start <= m <= end]
+
+    def load_partition(self, month: str) -> Dict[str, np.ndarray]:
+        """Столбцы партиции как memory-mapped массивы (только чтение)"""
+        with self._lock:
+            mapped = self._mapped.get(month)
+            if mapped is None:
+                directory = self.path / month
+                mapped = {name: np.load(directory / f"{name}.npy", mmap_mode="r") for name in COLUMNS}
+                self._mapped[month] = mapped
+            return mapped
+
+    def _selected(self, names: Tuple[str, ...], start_date: Optional[str], end_date: Optional[str],
+                  region: Optional[str], crime_type: Optional[str], newest_first: bool = False):
+        """Отфильтрованные столбцы по партициям (месяцам) по порядку или с последнего месяца"""
+        meta = self.meta()
+        codes = {}
+        for name, value in (("region", region), ("crime_type", crime_type)):
+            if value is not None:
+                dictionary = meta["dictionaries"][name]
+                if value not in dictionary:
+                    return
+                codes[name] = dictionary.index(value)
+        start = date_to_day(pd.Series([start_date]))[0] if start_date else None
+        end = date_to_day(pd.Series([end_date]))[0] if end_date else None
+
+        months = self.partitions(start_date, end_date)
+        for month in (reversed(months) if newest_first else months):
+            part = self.load_partition(month)
+            mask = None
+            for name, code in codes.items():
+                mask = (part[name] == code) if mask is None else mask & (part[name] == code)
+            if start is not None or end is not None:
+                day = part["day"]
+                in_range = (day >= (start if start is not None else np.iinfo(np.int32).min)) & \
+                           (day <= (end if end is not None else np.iinfo(np.int32).max))
+                mask = in_range if mask is None else mask & in_range
+            yield {n: part[n] if mask is None else part[n][mask] for n in names}
+
+    def columns(self, names: Tuple[str, ...] = tuple(COLUMNS),
+                start_date: Optional[str] = None,
+                end_date: Optional[str] = None,
+                region: Optional[str] = None,
+                crime_type: Optional[str] = None) -> Dict[str, np.ndarray]:
+        """
+        Столбцы отфильтрованных строк (по месяцам, внутри месяца - по id).
+        Одна партиция без фильтров отдаётся без копирования (memory-mapped);
+        иначе результат собирается из партиций масками NumPy.
+        """
+        selected = list(self._selected(names, start_date, end_date, region, crime_type))
+        if len(selected) == 1:
+            return selected[0]
+        if not selected:
+            return {n: np.empty(0, dtype=COLUMNS[n]) for n in names}
+        return {n: np.concatenate([s[n] for s in selected]) for n in names}
+
+    def latest(self, names: Tuple[str, ...], limit: int,
+               start_date: Optional[str] = None,
+               end_date: Optional[str] = None,
+               region: Optional[str] = None,
+               crime_type: Optional[str] = None) -> Dict[str, np.ndarray]:
+        """
+        Последние limit отфильтрованных строк по (date, id), новые первыми -
+        как ORDER BY day DESC, id DESC LIMIT limit. Читаются только последние месяцы,
+        пока не набрано limit строк.
+        """
+        columns = tuple(dict.fromkeys(("day", "id") + tuple(names)))
+        selected, rows = [], 0
+        for part in self._selected(columns, start_date, end_date, region, crime_type, newest_first=True):
+            selected.append(part)
+            rows += len(part["id"])
+            if rows >= limit:
+                break
+        if not selected:
+            return {n: np.empty(0, dtype=COLUMNS[n]) for n in names}
+        data = {n: np.concatenate([s[n] for s in selected]) for n in columns}
+        order = np.lexsort((data["id"], data["day"]))[::-1][:limit]
+        return {n: data[n][order] for n in names}
+
+    def read_all(self, names: Tuple[str, ...] = tuple(COLUMNS)) -> Tuple[Dict[str, np.ndarray], Dict]:
+        """Все строки снимка (копия в памяти) и согласованные с ними метаданные"""
+        with self._lock:
+            meta = json.loads(json.dumps(self.meta()))
+            parts = [self.load_partition(month) for month in self.partitions()]
+            columns = {
+                name: np.concatenate([part[name] for part in parts]) if parts
+                else np.empty(0, dtype=COLUMNS[name])
+                for name in names
+            }
+        return columns, meta
+
+    def manifest(self) -> Dict:
+        """Описание снимка для API"""
+        meta = self.meta()
+        return {
+            "rows": meta["rows"],
+            "max_id": meta["max_id"],
+            "built_at": meta.get("built_at"),
+            "current": self.is_current(),
+            "columns": meta["columns"],
+            "dictionaries": {name: len(values) for name, values in meta["dictionaries"].items()},
+            "partitions": [{"month": m, "rows": n} for m, n in sorted(meta["partitions"].items())],
+        }
+
+    def partition_archive(self, month: str) -> Optional[bytes]:
+        """
+        Партиция в формате .npz: файлы .npy столбцов как есть (без сжатия)
+        и словари кодов. Читается через np.load(...).
+        """
+        with self._lock:
+            meta = self.meta()
+            if month not in meta["partitions"]:
+                return None
+            buffer = io.BytesIO()
+            with zipfile.ZipFile(buffer, "w", zipfile.ZIP_STORED) as archive:
+                for name in COLUMNS:
+                    archive.write(self.path / month / f"{name}.npy", f"{name}.npy")
+                archive.writestr("dictionaries.json", json.dumps(meta["dictionaries"], ensure_ascii=False))
+        return buffer.getvalue()
+
+    # --- обновление ---
+
+    def _write_partition(self, month: str, data: Dict[str, np.ndarray]):
+        """Записать партицию рядом и подменить старую переименованием"""
+        tmp = self.path / f"{month}.tmp"
+        old = self.path / f"{month}.old"
+        shutil.rmtree(tmp, ignore_errors=True)
+        tmp.mkdir(parents=True)
+        for name in COLUMNS:
+            np.save(tmp / f"{name}.npy", np.ascontiguousarray(data[name], dtype=COLUMNS[name]))
+        target = self.path / month
+        shutil.rmtree(old, ignore_errors=True)
+        if target.exists():
+            target.rename(old)
+        tmp.rename(target)
+        # Уже открытые отображения старых файлов остаются действительными
+        shutil.rmtree(old, ignore_errors=True)
+        self._mapped.pop(month, None)
+
+    def _append_partition(self, month: str, data: Dict[str, np.ndarray], rows: int):
+        """
+        Дописать строки в конец партиции из rows строк (число из meta.json).
+        Уже открытые отображения видят прежние rows строк и остаются действительными.
+        """
+        for name in COLUMNS:
+            append_npy(self.path / month / f"{name}.npy", data[name], rows)
+        self._mapped.pop(month, None)
+
+    def refresh(self, full: bool = False) -> Dict:
+        """
+        Добавить в снимок новые строки crimes. full=True - построить заново.
+        Возвращает число добавленных строк и затронутые партиции.
+        """
+        started = time.perf_counter()
+        version = get_data_version()
+        with self._lock:
+            meta = self.meta()
+            with db_reader() as conn:
+                max_id, total = conn.execute("SELECT COALESCE(MAX(id), 0), COUNT(*) FROM crimes").fetchone()
+            # Строки удалены или снимок от другой БД - строим заново
+            if full or max_id < meta["max_id"] or total < meta["rows"]:
+                shutil.rmtree(self.path, ignore_errors=True)
+                self._meta = None
+                self._mapped.clear()
+                meta = self.meta()
+            self.path.mkdir(parents=True, exist_ok=True)
+
+            meta = json.loads(json.dumps(meta))
+            new = read_rows_after(meta["max_id"], meta["dictionaries"])
+            months = []
+            if new:
+                month_of_row = day_to_date(new["day"]).astype("datetime64[M]").astype(str)
+                for month in map(str, np.unique(month_of_row)):
+                    selected = month_of_row == month
+                    part = {name: new[name][selected] for name in COLUMNS}
+                    rows = meta["partitions"].get(month, 0)
+                    if rows:
+                        self._append_partition(month, part, rows)
+                    else:
+                        self._write_partition(month, part)
+                    meta["partitions"][month] = rows + int(len(part["id"]))
+                    months.append(month)
+                meta["max_id"] = int(new["id"].max())
+                meta["rows"] = int(sum(meta["partitions"].values()))
+                meta["built_at"] = time.strftime("%Y-%m-%dT%H:%M:%S")
+                self._write_meta(meta)
+            self.synced_version = version
+
+        return {
+            "added": int(len(new["id"])) if new else 0,
+            "partitions": months,
+            "rows": meta["rows"],
+            "time_ms": round((time.perf_counter() - started) * 1000, 1),
+        }
+
+
+snapshot = ColumnSnapshot()
+
+
+def _run_refresh():
+    result = snapshot.refresh()
+    if result["added"]:
+        print(f"[OK] Снимок crimes обновлён: +{result['added']} строк, "
+              f"партиций {len(result['partitions'])}, {result['time_ms']} мс")
+
+
+# Фоновое обновление после загрузки данных; серия загрузок объединяется в одно обновление
+refresh_job = CoalescingJob("snapshot", _run_refresh, "Ошибка обновления колоночного снимка")
+
+
+def schedule_refresh(version: Optional[int] = None):
+    """Поставить обновление снимка в фоновую очередь"""
+    refresh_job.schedule()
@@ -0,0 +1,150 @@
+"""
+Сервис тайлов тепловой карты (Web Mercator, 256x256)
+
+Тайл строится по агрегатам из SQL (ячейки размером примерно в пиксель),
+размывается и раскрашивается на NumPy и отдаётся как PNG. Готовые тайлы
+кэшируются по фильтрам и версии данных.
+"""
+import math
+import struct
+import zlib
+from typing import Optional, Dict, Tuple
+import numpy as np
+from app.services.data_service import DataService
+
+data_service = DataService()
+
+TILE_SIZE = 256
+# Размытие точки в пикселях (сигма гауссова ядра)
+BLUR_SIGMA = 6.0
+BLUR_RADIUS = int(3 * BLUR_SIGMA)
+# Вес, при котором насыщенность пикселя достигает ~63%
+INTENSITY_SCALE = 5.0
+
+# Градиент как у тепловой карты на дашборде
+GRADIENT = (
+    (0.0, (0, 0, 255)),
+    (0.25, (0, 255, 255)),
+    (0.5, (0, 255, 0)),
+    (0.75, (255, 255, 0)),
+    (1.0, (255, 0, 0)),
+)
+
+
+def _build_palette() -> np.ndarray:
+    """Таблица цветов RGBA на 256 уровней интенсивности"""
+    levels = np.linspace(0, 1, 256)
+    stops = np.array([stop for stop, _ in GRADIENT])
+    colors = np.array([color for _, color in GRADIENT], dtype=float)
+    palette = np.zeros((256, 4), dtype=np.uint8)
+    for channel in range(3):
+        palette[:, channel] = np.interp(levels, stops, colors[:, channel])
+    palette[:, 3] = np.clip(levels * 1.5, 0, 1) * 200
+    palette[:5, 3] = 0
+    return palette
+
+
+PALETTE = _build_palette()
+
+
+def encode_png(rgba: np.ndarray) -> bytes:
+    """Минимальный PNG-кодировщик для массива (H, W, 4) uint8"""
+    height, width, _ = rgba.shape
+    raw = np.zeros((height, width * 4 + 1), dtype=np.uint8)
+    raw[:, 1:] = rgba.reshape(height, -1)
+
+    def chunk(tag: bytes, data: bytes) -> bytes:
+        return (struct.pack(">I", len(data)) + tag + data
+                + struct.pack(">I", zlib.crc32(tag + data) & 0xFFFFFFFF))
+
+    return (b"\x89PNG\r\n\x1a\n"
+            + chunk(b"IHDR", struct.pack(">IIBBBBB", width, height, 8, 6, 0, 0, 0))
+            + chunk(b"IDAT", zlib.compress(raw.tobytes(), 6))
+            + chunk(b"IEND", b""))
+
+
+EMPTY_TILE = encode_png(np.zeros((TILE_SIZE, TILE_SIZE, 4), dtype=np.uint8))
+
+
+def _pixel_to_lonlat(px: float, py: float, zoom: int) -> Tuple[float, float]:
+    """Глобальные пиксельные координаты -> (долгота, широта)"""
+    world = TILE_SIZE * 2 ** zoom
+    lon = px / world * 360.0 - 180.0
+    lat = math.degrees(math.atan(math.sinh(math.pi * (1 - 2 * py / world))))
+    return lon, lat
+
+
+def _lonlat_to_pixel(lon: np.ndarray, lat: np.ndarray, zoom: int) -> Tuple[np.ndarray, np.ndarray]:
+    """(долгота, широта) -> глобальные пиксельные координаты"""
+    world = TILE_SIZE * 2 ** zoom
+    px = (lon + 180.0) / 360.0 * world
+    lat_rad = np.radians(lat)
+    py = (1 - np.log(np.tan(lat_rad) + 1 / np.cos(lat_rad)) / np.pi) / 2 * world
+    return px, py
+
+
+def _blur(grid: np.ndarray) -> np.ndarray:
+    """Разделимое гауссово размытие; ядро нормировано на пик 1"""
+    offsets = np.arange(-BLUR_RADIUS, BLUR_RADIUS + 1)
+    kernel = np.exp(-offsets ** 2 / (2 * BLUR_SIGMA ** 2))
+    for axis in (0, 1):
+        padded = np.pad(grid, [(BLUR_RADIUS, BLUR_RADIUS) if a == axis else (0, 0) for a in (0, 1)])
+        size = grid.shape[axis]
+        grid = sum(
+            weight * (padded[i:i + size] if axis == 0 else padded[:, i:i + size])
+            for i, weight in enumerate(kernel)
+        )
+    return grid
+
+
+class TileService:
+    """Тайлы тепловой карты"""
+
+    def tile_cells(self, z: int, x: int, y: int, margin: int = 0,
+                   start_date: Optional[str] = None,
+                   end_date: Optional[str] = None,
+                   region: Optional[str] = None,
+                   crime_type: Optional[str] = None):
+        """Агрегаты по ячейкам ~1 пиксель для тайла (с запасом margin пикселей)"""
+        x0, y0 = x * TILE_SIZE - margin, y * TILE_SIZE - margin
+        x1, y1 = (x + 1) * TILE_SIZE + margin, (y + 1) * TILE_SIZE + margin
+        min_lon, max_lat = _pixel_to_lonlat(x0, y0, z)
+        max_lon, min_lat = _pixel_to_lonlat(x1, y1, z)
+        cell_size = 360.0 / (TILE_SIZE * 2 ** z)
+        return data_service.get_heatmap_cells(
+            cell_size, (min_lat, min_lon, max_lat, max_lon),
+            start_date, end_date, region, crime_type
+        )
+
+    def get_tile_data(self, z: int, x: int, y: int, **filters) -> Dict:
+        """Агрегаты тайла в JSON: [lat, lon, число, сумма весов]"""
+        cells = self.tile_cells(z, x, y, **filters)
+        return {
+            "z": z, "x": x, "y": y,
+            "cells": [[round(lat, 6), round(lon, 6), count, round(weight, 2)]
+                      for lat, lon, count, weight in cells],
+            "count": sum(c[2] for c in cells)
+        }
+
+    def render_tile(self, z: int, x: int, y: int, **filters) -> bytes:
+        """PNG тайл тепловой карты"""
+        cells = self.tile_cells(z, x, y, margin=BLUR_RADIUS, **filters)
+        if not cells:
+            return EMPTY_TILE
+
+        lat, lon, _, weight = (np.array(column, dtype=float) for column in zip(*cells))
+        px, py = _lonlat_to_pixel(lon, lat, z)
+        size = TILE_SIZE + 2 * BLUR_RADIUS
+        col = np.floor(px - x * TILE_SIZE + BLUR_RADIUS).astype(int)
+        row = np.floor(py - y * TILE_SIZE + BLUR_RADIUS).astype(int)
+        inside = (col >= 0) & (col < size) & (row >= 0) & (row < size)
+
+        grid = np.bincount(row[inside] * size + col[inside], weights=weight[inside],
+                           minlength=size * size).reshape(size, size)
+        grid = _blur(grid)[BLUR_RADIUS:-BLUR_RADIUS, BLUR_RADIUS:-BLUR_RADIUS]
+
+        intensity = 1 - np.exp(-grid / INTENSITY_SCALE)
+        levels = np.clip(intensity * 255, 0, 255).astype(np.uint8)
+        if not levels.any():
+            return EMPTY_TILE
+        return encode_png(PALETTE[levels])
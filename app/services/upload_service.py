@@ -0,0 +1,107 @@
+"""
+Сервис потоковой загрузки CSV файлов по частям
+"""
+import os
+import shutil
+import tempfile
+import threading
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from typing import Optional, Dict, BinaryIO
+import pandas as pd
+from app.cache import defer_data_change
+from app.services.data_service import DataService
+from app.services.ingest_service import MAX_REJECT_DETAILS
+
+data_service = DataService()
+
+# Сколько строк CSV разбирать и сохранять за один шаг
+CHUNK_ROWS = 100000
+# Сколько завершённых задач хранить для опроса статуса
+MAX_FINISHED_JOBS = 100
+
+
+class UploadService:
+    """Фоновая загрузка больших CSV с отслеживанием прогресса"""
+
+    def __init__(self, chunk_rows: int = CHUNK_ROWS):
+        self.chunk_rows = chunk_rows
+        self._jobs: Dict[str, Dict] = {}
+        self._lock = threading.Lock()
+        # Один поток: запись в SQLite всё равно идёт одним писателем
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="upload")
+
+    def start(self, fileobj: BinaryIO, filename: str) -> Dict:
+        """
+        Скопировать загруженный файл во временный и поставить задачу в очередь.
+        Копирование идёт блоками, файл целиком в память не читается.
+        """
+        tmp = tempfile.NamedTemporaryFile(prefix="upload_", suffix=".csv", delete=False)
+        with tmp:
+            shutil.copyfileobj(fileobj, tmp)
+
+        job_id = uuid.uuid4().hex
+        job = {
+            "job_id": job_id,
+            "filename": filename,
+            "status": "pending",
+            "rows_parsed": 0,
+            "inserted": 0,
+            "rejected": 0,
+            "rejects": [],
+            "error": None,
+            "created_at": datetime.now().isoformat(timespec="seconds"),
+            "finished_at": None,
+        }
+        with self._lock:
+            self._jobs[job_id] = job
+            self._forget_finished()
+
+        self._executor.submit(self._run, job_id, tmp.name)
+        return self.get_job(job_id)
+
+    def get_job(self, job_id: str) -> Optional[Dict]:
+        """Текущее состояние задачи загрузки"""
+        with self._lock:
+            job = self._jobs.get(job_id)
+            return dict(job, rejects=list(job["rejects"])) if job else None
+
+    def _run(self, job_id: str, path: str):
+        """
+        Разбор файла по частям и сохранение каждой части в БД.
+        Снимок и модели обновляются один раз после всего файла, а не после каждой части.
+        """
+        self._update(job_id, status="running")
+        try:
+            with defer_data_change():
+                for chunk in pd.read_csv(path, chunksize=self.chunk_rows):
+                    with self._lock:
+                        offset = self._jobs[job_id]["rows_parsed"]
+                    result = data_service.save_to_db(chunk, row_offset=offset)
+
+                    with self._lock:
+                        job = self._jobs[job_id]
+                        job["rows_parsed"] += len(chunk)
+                        job["inserted"] += result["count"]
+                        job["rejected"] += result["rejected"]
+                        room = MAX_REJECT_DETAILS - len(job["rejects"])
+                        job["rejects"].extend(result["rejects"][:max(room, 0)])
+            self._update(job_id, status="done")
+        except Exception as e:
+            self._update(job_id, status="error", error=str(e))
+        finally:
+            os.unlink(path)
+
+    def _update(self, job_id: str, **fields):
+        with self._lock:
+            job = self._jobs[job_id]
+            job.update(fields)
+            if job["status"] in ("done", "error"):
+                job["finished_at"] = datetime.now().isoformat(timespec="seconds")
+
+    def _forget_finished(self):
+        """Удалить самые старые завершённые задачи сверх лимита"""
+        finished = [jid for jid, job in self._jobs.items() if job["status"] in ("done", "error")]
+        for jid in finished[:max(len(finished) - MAX_FINISHED_JOBS, 0)]:
+            del self._jobs[jid]
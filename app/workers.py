@@ -0,0 +1,109 @@
+"""
+Пулы потоков для блокирующих вызовов сервисов (sqlite3, pandas, scikit-learn, folium)
+
+Обработчики API не должны выполнять такие вызовы прямо в event loop:
+один долгий прогноз иначе блокирует все остальные запросы воркера.
+Запросы делятся на два класса со своими лимитами параллельности:
+  - light: статистика, списки, справочники
+  - heavy: прогнозы, оценка риска, карты, загрузка данных
+
+Фоновые задачи сервисов после загрузки данных (обучение моделей, обновление
+снимка и in-memory движка, восстановление детектора аномалий) - CoalescingJob:
+свой поток на задачу, серия запросов подряд объединяется в один запуск.
+"""
+import asyncio
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from typing import Any, AsyncIterator, Callable, Dict, Iterator, List, Optional
+
+LIGHT_WORKERS = int(os.getenv("CRIMEVISION_LIGHT_WORKERS", "8"))
+HEAVY_WORKERS = int(os.getenv("CRIMEVISION_HEAVY_WORKERS", "2"))
+
+_pools: Dict[str, ThreadPoolExecutor] = {
+    "light": ThreadPoolExecutor(max_workers=LIGHT_WORKERS, thread_name_prefix="light"),
+    "heavy": ThreadPoolExecutor(max_workers=HEAVY_WORKERS, thread_name_prefix="heavy"),
+}
+
+_jobs: List["CoalescingJob"] = []
+
+
+class CoalescingJob:
+    """
+    Фоновая задача с объединением запросов: пока запуск ждёт в очереди,
+    повторные schedule() ничего не добавляют. Запрос во время выполнения
+    ставит ровно один следующий запуск, поэтому изменения не теряются.
+    """
+
+    def __init__(self, name: str, func: Callable[[], Any], error_message: str):
+        self.name = name
+        self._func = func
+        self._error_message = error_message
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix=name)
+        self._lock = threading.Lock()
+        self._pending = False
+        _jobs.append(self)
+
+    def schedule(self, version: Optional[int] = None):
+        """Поставить запуск в очередь (version - аргумент обработчика on_data_change)"""
+        with self._lock:
+            if self._pending:
+                return
+            self._pending = True
+        self._executor.submit(self._run)
+
+    def _run(self):
+        with self._lock:
+            self._pending = False
+        try:
+            self._func()
+        except Exception as e:
+            print(f"{self._error_message}: {e}")
+
+
+async def _run(pool: str, func: Callable, *args, **kwargs):
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_pools[pool], partial(func, *args, **kwargs))
+
+
+async def run_light(func: Callable, *args, **kwargs):
+    """Выполнить быстрый блокирующий вызов в пуле light"""
+    return await _run("light", func, *args, **kwargs)
+
+
+async def run_heavy(func: Callable, *args, **kwargs):
+    """Выполнить тяжёлый блокирующий вызов (ML, карты) в пуле heavy"""
+    return await _run("heavy", func, *args, **kwargs)
+
+
+async def iterate_light(iterator: Iterator) -> AsyncIterator:
+    """
+    Обход блокирующего итератора в пуле light (тело StreamingResponse).
+    Если клиент отключился и обход прерван, итератор закрывается (close()),
+    и генератор сразу освобождает ресурсы, например соединение с БД.
+    Закрытие ждёт завершения уже начатого шага: генератор нельзя закрыть во время next().
+    """
+    pending = None
+    try:
+        while True:
+            pending = _pools["light"].submit(next, iterator, None)
+            item = await asyncio.wrap_future(pending)
+            if item is None:
+                break
+            yield item
+    finally:
+        close = getattr(iterator, "close", None)
+        if close is not None:
+            if pending is None:
+                close()
+            else:
+                pending.add_done_callback(lambda _: close())
+
+
+def shutdown_workers():
+    """Остановить пулы и фоновые задачи при завершении приложения"""
+    for pool in _pools.values():
+        pool.shutdown(wait=False, cancel_futures=True)
+    for job in _jobs:
+        job._executor.shutdown(wait=False, cancel_futures=True)
@@ -0,0 +1,81 @@
+"""
+Нагрузочный бенчмарк: задержки лёгких эндпоинтов во время тяжёлых прогнозов
+
+Запуск (сервер должен быть запущен: python main.py):
+    python benchmarks/api_latency.py --url http://localhost:8000 --duration 10 --forecasts 4
+
+Сначала замеряются p50/p95/p99 для /health и /api/stats/summary без нагрузки,
+затем то же самое, пока --forecasts потоков непрерывно запрашивают /api/forecast.
+Если обработчики не блокируют event loop, p99 в обеих фазах почти одинаковый.
+"""
+import argparse
+import threading
+import time
+import urllib.request
+
+import numpy as np
+
+PROBES = ["/health", "/api/stats/summary"]
+HEAVY = "/api/forecast?months=6"
+
+
+def fetch(url: str) -> float:
+    """Время ответа в миллисекундах"""
+    start = time.perf_counter()
+    with urllib.request.urlopen(url, timeout=60) as response:
+        response.read()
+    return (time.perf_counter() - start) * 1000
+
+
+def probe(base_url: str, duration: float) -> dict:
+    """Последовательно опрашивать лёгкие эндпоинты в течение duration секунд"""
+    samples = {path: [] for path in PROBES}
+    deadline = time.time() + duration
+    while time.time() < deadline:
+        for path in PROBES:
+            samples[path].append(fetch(base_url + path))
+    return samples
+
+
+def hammer(base_url: str, stop: threading.Event, counter: list):
+    """Непрерывно запрашивать тяжёлый эндпоинт до сигнала остановки"""
+    while not stop.is_set():
+        fetch(base_url + HEAVY)
+        counter.append(1)
+
+
+def report(title: str, samples: dict):
+    print(f"\n{title}")
+    print(f"{'endpoint':<24}{'n':>6}{'p50, ms':>10}{'p95, ms':>10}{'p99, ms':>10}")
+    for path, values in samples.items():
+        p50, p95, p99 = np.percentile(values, [50, 95, 99])
+        print(f"{path:<24}{len(values):>6}{p50:>10.1f}{p95:>10.1f}{p99:>10.1f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--url", default="http://localhost:8000")
+    parser.add_argument("--duration", type=float, default=10.0, help="длительность каждой фазы, с")
+    parser.add_argument("--forecasts", type=int, default=4, help="число параллельных потоков /api/forecast")
+    args = parser.parse_args()
+
+    report("Без нагрузки", probe(args.url, args.duration))
+
+    stop = threading.Event()
+    completed = []
+    threads = [threading.Thread(target=hammer, args=(args.url, stop, completed), daemon=True)
+               for _ in range(args.forecasts)]
+    for thread in threads:
+        thread.start()
+    try:
+        loaded = probe(args.url, args.duration)
+    finally:
+        stop.set()
+        for thread in threads:
+            thread.join()
+
+    report(f"Во время прогнозов ({args.forecasts} потоков, выполнено {len(completed)} прогнозов)", loaded)
+
+
+if __name__ == "__main__":
+    main()
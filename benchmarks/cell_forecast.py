@@ -0,0 +1,96 @@
+"""
+Бенчмарк прогноза по ячейкам сетки: время обучения и прогноза от числа ячеек
+
+Запуск:
+    python benchmarks/cell_forecast.py --cells 1000 5000 20000 100000
+
+Недельные числа преступлений синтетические: у каждой ячейки своя интенсивность
+(логнормальная, большинство ячеек почти пустые), общий годовой цикл и
+медленный тренд. Одна модель (fit_cell_model) обучается сразу на всех ячейках
+так же, как в MLService.get_cell_forecast; для сравнения на первых --per-cell
+ячейках обучается отдельная LinearRegression на каждую ячейку.
+"""
+import argparse
+import sys
+import time
+from pathlib import Path
+
+import numpy as np
+from sklearn.linear_model import LinearRegression
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from app.services.ml_service import (  # noqa: E402
+    CELL_HISTORY_WEEKS, CELL_HOLDOUT_WEEKS, CELL_SEASON,
+    cell_features, first_cell_target, fit_cell_model, predict_cells
+)
+
+
+def synthetic_counts(cells: int, weeks: int, seed: int = 42) -> np.ndarray:
+    """Недельные числа преступлений: ячейки x недели"""
+    rng = np.random.default_rng(seed)
+    rate = rng.lognormal(-1.5, 1.5, cells)
+    t = np.arange(weeks)
+    season = 1 + 0.3 * np.sin(2 * np.pi * t / CELL_SEASON)
+    trend = 1 + 0.002 * (t - weeks / 2)
+    return rng.poisson(rate[:, None] * season * trend).astype(float)
+
+
+def per_cell_fit(counts: np.ndarray, first: int, last: int, seasonal: bool) -> float:
+    """Время обучения отдельной модели на каждую ячейку, мс"""
+    start = time.perf_counter()
+    for row in counts:
+        row = row[None, :]
+        x = np.vstack([cell_features(row, week, seasonal) for week in range(first, last)])
+        LinearRegression().fit(x, row[0, first:last])
+    return (time.perf_counter() - start) * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--cells", type=int, nargs="+", default=[1000, 5000, 20000, 100000])
+    parser.add_argument("--weeks", type=int, default=CELL_HISTORY_WEEKS + CELL_SEASON,
+                        help="недель истории")
+    parser.add_argument("--horizon", type=int, default=4, help="горизонт прогноза, недель")
+    parser.add_argument("--per-cell", type=int, default=500,
+                        help="ячеек для сравнения с моделью на каждую ячейку (0 - без сравнения)")
+    args = parser.parse_args()
+
+    first, seasonal = first_cell_target(args.weeks)
+    holdout = args.weeks - CELL_HOLDOUT_WEEKS
+    print(f"Недель истории: {args.weeks}, сезонный лаг: {'да' if seasonal else 'нет'}, "
+          f"горизонт: {args.horizon}")
+    print(f"{'ячеек':>8}{'примеров':>12}{'fit, мс':>10}{'predict, мс':>13}"
+          f"{'MAE':>9}{'naive MAE':>11}")
+    for cells in args.cells:
+        counts = synthetic_counts(cells, args.weeks)
+
+        start = time.perf_counter()
+        coef = fit_cell_model(counts, first, holdout, seasonal)
+        fit_ms = (time.perf_counter() - start) * 1000
+
+        start = time.perf_counter()
+        predict_cells(counts[:, :holdout], coef, args.horizon, seasonal)
+        predict_ms = (time.perf_counter() - start) * 1000
+
+        errors, naive_errors = [], []
+        for week in range(holdout, args.weeks):
+            predicted = np.maximum(coef[0] + cell_features(counts, week, seasonal) @ coef[1:], 0)
+            errors.append(np.abs(predicted - counts[:, week]).mean())
+            naive_errors.append(np.abs(counts[:, week - 1] - counts[:, week]).mean())
+
+        print(f"{cells:>8,}{cells * (holdout - first):>12,}{fit_ms:>10.1f}{predict_ms:>13.2f}"
+              f"{np.mean(errors):>9.4f}{np.mean(naive_errors):>11.4f}")
+
+    if args.per_cell:
+        counts = synthetic_counts(args.per_cell, args.weeks)
+        batched = time.perf_counter()
+        fit_cell_model(counts, first, holdout, seasonal)
+        batched = (time.perf_counter() - batched) * 1000
+        separate = per_cell_fit(counts, first, holdout, seasonal)
+        print(f"\n{args.per_cell:,} ячеек: одна модель {batched:.1f} мс, "
+              f"модель на каждую ячейку {separate:.1f} мс")
+
+
+if __name__ == "__main__":
+    main()
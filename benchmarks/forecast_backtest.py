@@ -0,0 +1,43 @@
+"""
+Сравнение моделей прогноза на истории из базы данных
+
+Запуск:
+    python benchmarks/forecast_backtest.py --horizon 3 --folds 6 --by region
+
+Для каждой модели выводятся MAE, RMSE, sMAPE (по среднему числу преступлений
+в день по месяцам) и среднее время обучения на все ряды сразу.
+"""
+import argparse
+import sys
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from app.services.ml_service import MLService  # noqa: E402
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--horizon", type=int, default=3, help="горизонт прогноза, месяцев")
+    parser.add_argument("--folds", type=int, default=6, help="число точек прогноза")
+    parser.add_argument("--by", choices=["region", "crime_type"], default="region")
+    args = parser.parse_args()
+
+    result = MLService().backtest_models(args.horizon, args.folds, by=args.by)
+    if result["status"] != "success":
+        print(f"[ERROR] {result['error']}")
+        return
+
+    print(f"Рядов: {result['series']}, месяцев истории: {result['periods']}, "
+          f"точек прогноза: {result['folds']}, горизонт: {result['horizon']}")
+    print(f"{'model':<16}{'MAE':>10}{'RMSE':>10}{'sMAPE, %':>10}{'fit, ms':>10}")
+    for name, metrics in result["models"].items():
+        if metrics["mae"] is None:
+            print(f"{name:<16}{'недостаточно истории':>40}")
+            continue
+        print(f"{name:<16}{metrics['mae']:>10.4f}{metrics['rmse']:>10.4f}"
+              f"{metrics['smape']:>10.2f}{metrics['fit_time_ms']:>10.3f}")
+
+
+if __name__ == "__main__":
+    main()
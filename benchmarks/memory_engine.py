@@ -0,0 +1,96 @@
+"""
+Бенчмарк in-memory движка агрегаций
+
+Запуск (по умолчанию 10 млн строк):
+    python benchmarks/memory_engine.py --rows 10000000
+
+Синтетические строки (4 года, регионы Казахстана, 5 типов преступлений)
+загружаются в MemoryEngine напрямую, без SQLite. Для каждой агрегации
+печатается медианное время; отдельно измеряется добавление пачки новых строк.
+"""
+import argparse
+import statistics
+import sys
+import time
+from pathlib import Path
+
+import numpy as np
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from app.services.data_service import REGIONS_KZ  # noqa: E402
+from app.services.memory_engine import MemoryEngine  # noqa: E402
+
+CRIME_TYPES = ["Грабёж", "Другое", "Кража", "Разбой", "Убийство"]
+FIRST_DAY = int(np.datetime64("2021-01-01", "D").astype(np.int64))
+DAYS = 4 * 365
+
+
+def synthetic_rows(rows: int, seed: int = 42) -> dict:
+    """Столбцы в формате MemoryEngine.load_columns"""
+    rng = np.random.default_rng(seed)
+    centers = np.array([[c["lat"], c["lon"]] for c in REGIONS_KZ.values()])
+    region = rng.integers(0, len(centers), rows).astype(np.uint8)
+    return {
+        "day": (FIRST_DAY + rng.integers(0, DAYS, rows)).astype(np.int32),
+        "region": region,
+        "crime_type": rng.integers(0, len(CRIME_TYPES), rows).astype(np.uint8),
+        "severity": rng.integers(1, 6, rows).astype(np.int8),
+        "latitude": centers[region, 0] + rng.normal(0, 0.2, rows),
+        "longitude": centers[region, 1] + rng.normal(0, 0.2, rows),
+    }
+
+
+def measure(func, repeat: int) -> float:
+    """Медианное время вызова, мс"""
+    func()
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        times.append((time.perf_counter() - start) * 1000)
+    return statistics.median(times)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Бенчмарк in-memory движка агрегаций")
+    parser.add_argument("--rows", type=int, default=10_000_000)
+    parser.add_argument("--repeat", type=int, default=20)
+    parser.add_argument("--append", type=int, default=10_000, help="строк в одной догрузке")
+    args = parser.parse_args()
+
+    dictionaries = {"region": list(REGIONS_KZ), "crime_type": CRIME_TYPES}
+    engine = MemoryEngine(enabled=True)
+    start = time.perf_counter()
+    engine.load_columns(synthetic_rows(args.rows), dictionaries, max_id=args.rows)
+    print(f"Загрузка {args.rows:,} строк: {time.perf_counter() - start:.2f} с, "
+          f"{engine.stats()['memory_mb']} МБ")
+
+    region = list(REGIONS_KZ)[0]
+    country = (40.0, 46.0, 55.0, 87.0)
+    city = (REGIONS_KZ[region]["lat"] - 0.2, REGIONS_KZ[region]["lon"] - 0.2,
+            REGIONS_KZ[region]["lat"] + 0.2, REGIONS_KZ[region]["lon"] + 0.2)
+    queries = {
+        "summary": lambda: engine.summary_groups(),
+        "summary (год, регион)": lambda: engine.summary_groups("2023-01-01", "2023-12-31", region),
+        "timeline (месяцы)": lambda: engine.timeline(),
+        "timeline (недели, регион)": lambda: engine.timeline("2022-01-01", "2023-12-31", region, "week"),
+        "сравнение регионов": lambda: engine.regions_comparison("2023-01-01", "2023-12-31"),
+        "heatmap (страна, 0.5°)": lambda: engine.heatmap_cells(0.5, country),
+        "heatmap (месяц, регион, тип)": lambda: engine.heatmap_cells(
+            0.01, city, "2023-06-01", "2023-06-30", region, "Кража"),
+    }
+    print(f"\n{'Запрос':32} {'медиана, мс':>12}")
+    for name, query in queries.items():
+        repeat = args.repeat if "heatmap (страна" not in name else max(3, args.repeat // 5)
+        print(f"{name:32} {measure(query, repeat):12.3f}")
+
+    new = synthetic_rows(args.append, seed=7)
+    new["id"] = np.arange(args.rows + 1, args.rows + args.append + 1)
+    start = time.perf_counter()
+    engine._append(new, dictionaries, max_id=int(new["id"][-1]))
+    print(f"\nДогрузка {args.append:,} строк: {(time.perf_counter() - start) * 1000:.1f} мс")
+
+
+if __name__ == "__main__":
+    main()
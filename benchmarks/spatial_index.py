@@ -0,0 +1,135 @@
+"""
+Бенчмарк пространственного индекса: R*Tree против полного сканирования
+
+Запуск (по умолчанию 1 млн строк; для целевого сценария - 10 млн):
+    python benchmarks/spatial_index.py --rows 10000000
+
+Во временной БД создаётся таблица crimes той же схемы, что и в приложении,
+и индекс crimes_rtree. Затем для случайных точек около городов сравнивается
+время запросов по прямоугольной области и по радиусу с индексом и без него.
+"""
+import argparse
+import os
+import shutil
+import sqlite3
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+import numpy as np
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from app.database import distance_km  # noqa: E402
+from app.services.data_service import DataService, REGIONS_KZ  # noqa: E402
+
+SCHEMA = """
+    CREATE TABLE crimes (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        day INTEGER NOT NULL,
+        region_id INTEGER NOT NULL,
+        city_id INTEGER,
+        crime_type_id INTEGER NOT NULL,
+        latitude REAL,
+        longitude REAL,
+        severity INTEGER DEFAULT 1,
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    );
+    CREATE VIRTUAL TABLE crimes_rtree USING rtree(id, min_lat, max_lat, min_lon, max_lon);
+"""
+
+SCAN_BBOX = """
+    SELECT COUNT(*) FROM crimes c
+    WHERE c.latitude BETWEEN ? AND ? AND c.longitude BETWEEN ? AND ?
+"""
+RTREE_BBOX = """
+    SELECT COUNT(*) FROM crimes c
+    JOIN crimes_rtree r ON r.id = c.id
+        AND r.max_lat >= ? AND r.min_lat <= ? AND r.max_lon >= ? AND r.min_lon <= ?
+    WHERE c.latitude BETWEEN ? AND ? AND c.longitude BETWEEN ? AND ?
+"""
+SCAN_RADIUS = """
+    SELECT COUNT(*) FROM crimes c
+    WHERE distance_km(c.latitude, c.longitude, ?, ?) <= ?
+"""
+RTREE_RADIUS = RTREE_BBOX + " AND distance_km(c.latitude, c.longitude, ?, ?) <= ?"
+
+
+def populate(conn: sqlite3.Connection, rows: int, seed: int = 42, batch: int = 500000):
+    """Синтетические точки вокруг центров регионов"""
+    rng = np.random.default_rng(seed)
+    centers = np.array([[c["lat"], c["lon"]] for c in REGIONS_KZ.values()])
+    for start in range(0, rows, batch):
+        n = min(batch, rows - start)
+        idx = rng.integers(0, len(centers), n)
+        lat = centers[idx, 0] + rng.normal(0, 0.15, n)
+        lon = centers[idx, 1] + rng.normal(0, 0.2, n)
+        severity = rng.integers(1, 6, n)
+        conn.executemany(
+            "INSERT INTO crimes (day, region_id, crime_type_id, latitude, longitude, severity) "
+            "VALUES (19723, ?, 1, ?, ?, ?)",
+            zip((idx + 1).tolist(), lat.tolist(), lon.tolist(), severity.tolist())
+        )
+    conn.execute("""
+        INSERT INTO crimes_rtree
+        SELECT id, latitude, latitude, longitude, longitude FROM crimes
+    """)
+    conn.commit()
+
+
+def timed(conn: sqlite3.Connection, query: str, params_list) -> float:
+    """Среднее время запроса, мс"""
+    start = time.perf_counter()
+    for params in params_list:
+        conn.execute(query, params).fetchone()
+    return (time.perf_counter() - start) * 1000 / len(params_list)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, default=1000000)
+    parser.add_argument("--queries", type=int, default=20, help="запросов каждого вида")
+    parser.add_argument("--radius", type=float, default=2.0, help="радиус поиска, км")
+    args = parser.parse_args()
+
+    path = os.path.join(tempfile.mkdtemp(prefix="crimevision_bench_"), "bench.db")
+    conn = sqlite3.connect(path)
+    conn.create_function("distance_km", 4, distance_km, deterministic=True)
+    conn.executescript(SCHEMA)
+
+    print(f"Генерация {args.rows:,} строк в {path}...")
+    start = time.perf_counter()
+    populate(conn, args.rows)
+    print(f"   готово за {time.perf_counter() - start:.1f} с")
+
+    rng = np.random.default_rng(7)
+    centers = np.array([[c["lat"], c["lon"]] for c in REGIONS_KZ.values()])
+    points = centers[rng.integers(0, len(centers), args.queries)] + rng.normal(0, 0.05, (args.queries, 2))
+
+    bbox_params, radius_scan, radius_rtree = [], [], []
+    for lat, lon in points:
+        min_lat, min_lon, max_lat, max_lon = DataService.radius_to_bbox(lat, lon, args.radius)
+        box = [min_lat, max_lat, min_lon, max_lon]
+        bbox_params.append(box + box)
+        radius_scan.append([lat, lon, args.radius])
+        radius_rtree.append(box + box + [lat, lon, args.radius])
+
+    results = [
+        ("bbox, полное сканирование", timed(conn, SCAN_BBOX, [p[4:] for p in bbox_params])),
+        ("bbox, R*Tree", timed(conn, RTREE_BBOX, bbox_params)),
+        (f"радиус {args.radius} км, полное сканирование", timed(conn, SCAN_RADIUS, radius_scan)),
+        (f"радиус {args.radius} км, R*Tree", timed(conn, RTREE_RADIUS, radius_rtree)),
+    ]
+    conn.close()
+    shutil.rmtree(os.path.dirname(path), ignore_errors=True)
+
+    print(f"\n{'запрос':<40}{'мс/запрос':>12}")
+    for name, ms in results:
+        print(f"{name:<40}{ms:>12.2f}")
+    print(f"\nУскорение bbox: x{results[0][1] / results[1][1]:.0f}, "
+          f"радиус: x{results[2][1] / results[3][1]:.0f}")
+
+
+if __name__ == "__main__":
+    main()
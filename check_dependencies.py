@@ -27,6 +27,7 @@ modules = [
     ("pandas", "pandas"),
     ("numpy", "numpy"),
     ("scikit-learn", "sklearn"),
+    ("scipy", "scipy"),
     ("folium", "folium"),
     ("plotly", "plotly"),
     ("jinja2", "jinja2"),
@@ -1,10 +1,37 @@
 """
-Генератор реалистичных данных о преступлениях для CrimeVision.kz
+Генератор синтетических данных о преступлениях для CrimeVision.kz
+
+Запуск:
+    python generate_dataset.py --rows 2000
+    python generate_dataset.py --rows 100000000 --format parquet --output data/crimes_100m.parquet
+    python generate_dataset.py --rows 10000000 --format sqlite --workers 8
+
+Записи генерируются пачками по --chunk строк векторно (NumPy) в пуле процессов.
+Пачка i получает собственный генератор из (--seed, i), поэтому при одних seed
+и размере пачки результат одинаков при любом числе процессов. Пачки
+записываются по порядку: CSV и Parquet - в один файл, SQLite - через
+DataService.save_to_db (та же загрузка, что и при импорте файла: словари,
+дневные агрегаты, каталог).
+
+Модель данных:
+- дата: интенсивность по дням с годовой сезонностью (пик летом), недельным
+  циклом (больше в пятницу и выходные) и небольшим ростом по годам;
+- регион - по весу, тип преступления - по вероятности, тяжесть - равномерно
+  в диапазоне типа;
+- координаты: в каждом регионе несколько очагов вокруг центра города
+  (раскладка зависит только от seed); часть преступлений - в очагах,
+  остальные - фоновый разброс по окрестностям города.
 """
-import pandas as pd
+import argparse
+import os
+import sys
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, Tuple
+
 import numpy as np
-from datetime import datetime, timedelta
-import random
+import pandas as pd
 
 # Регионы Казахстана с координатами
 REGIONS = {
@@ -39,97 +66,210 @@ CRIME_TYPES = {
     "Другое": {"probability": 0.01, "severity_range": (1, 3)},
 }
 
-def generate_crime_data(start_date, end_date, num_records):
-    """Генерация данных о преступлениях"""
-    data = []
-    
-    # Временной диапазон
-    start = datetime.strptime(start_date, "%Y-%m-%d")
-    end = datetime.strptime(end_date, "%Y-%m-%d")
-    delta = end - start
-    days = delta.days
-    
-    # Веса регионов для выборки
-    regions_list = list(REGIONS.keys())
-    region_weights = [REGIONS[r]["weight"] for r in regions_list]
-    
-    # Список типов преступлений с весами
-    crime_types_list = list(CRIME_TYPES.keys())
-    crime_weights = [CRIME_TYPES[ct]["probability"] for ct in crime_types_list]
-    
-    for i in range(num_records):
-        # Случайная дата в диапазоне
-        random_days = random.randint(0, days)
-        date = start + timedelta(days=random_days)
-        
-        # Выбор региона с учётом весов
-        region = random.choices(regions_list, weights=region_weights)[0]
-        region_info = REGIONS[region]
-        
-        # Добавляем небольшую случайность к координатам
-        lat = region_info["lat"] + random.uniform(-0.1, 0.1)
-        lon = region_info["lon"] + random.uniform(-0.1, 0.1)
-        
-        # Выбор типа преступления
-        crime_type = random.choices(crime_types_list, weights=crime_weights)[0]
-        severity_range = CRIME_TYPES[crime_type]["severity_range"]
-        severity = random.randint(severity_range[0], severity_range[1])
-        
-        # Сезонность: больше преступлений летом и зимой
-        month = date.month
-        if month in [6, 7, 8, 12, 1, 2]:
-            if random.random() < 0.3:  # 30% шанс добавить ещё одну запись
-                continue
-        
-        data.append({
-            "date": date.strftime("%Y-%m-%d"),
-            "region": region,
-            "city": region_info["city"],
-            "crime_type": crime_type,
-            "latitude": round(lat, 4),
-            "longitude": round(lon, 4),
-            "severity": severity
-        })
-    
-    return pd.DataFrame(data)
+# Сезонность: амплитуда годового цикла и день года с пиком (середина июля)
+SEASON_AMPLITUDE = 0.25
+SEASON_PEAK_DAY = 196
+# Множители по дням недели (понедельник - воскресенье)
+WEEKDAY_FACTORS = (1.0, 0.95, 0.95, 1.0, 1.15, 1.25, 1.1)
+# Рост числа преступлений за год
+YEARLY_TREND = 0.03
+
+# Очаги: число в регионе, разброс центров вокруг города и размер очага (градусы)
+HOTSPOTS_PER_REGION = 8
+HOTSPOT_SPREAD = 0.08
+HOTSPOT_RADIUS = 0.006
+# Доля преступлений в очагах; остальные - фон с разбросом BACKGROUND_RADIUS
+HOTSPOT_SHARE = 0.6
+BACKGROUND_RADIUS = 0.1
+
+OUTPUT_COLUMNS = ["date", "region", "city", "crime_type", "latitude", "longitude", "severity"]
+DEFAULT_OUTPUT = {"csv": "data/generated_crimes.csv", "parquet": "data/generated_crimes.parquet"}
+
+
+def day_probabilities(start_date: str, end_date: str) -> Tuple[int, np.ndarray]:
+    """Первый день (номер от 1970-01-01) и вероятности всех дней периода"""
+    days = np.arange(np.datetime64(start_date, "D"), np.datetime64(end_date, "D") + 1)
+    day_of_year = (days - days.astype("datetime64[Y]")).astype(np.int64)
+    # 1970-01-01 - четверг: (номер дня + 3) % 7 - день недели с понедельника
+    weekday = (days.astype(np.int64) + 3) % 7
+    years = np.arange(len(days)) / 365.25
+    intensity = ((1 + SEASON_AMPLITUDE * np.cos(2 * np.pi * (day_of_year - SEASON_PEAK_DAY) / 365.25))
+                 * np.array(WEEKDAY_FACTORS)[weekday]
+                 * (1 + YEARLY_TREND * years))
+    return int(days[0].astype(np.int64)), intensity / intensity.sum()
+
+
+def hotspot_layout(seed: int) -> Dict[str, np.ndarray]:
+    """Центры и веса очагов по регионам: [регион, очаг]"""
+    rng = np.random.default_rng(seed)
+    centers = np.array([[r["lat"], r["lon"]] for r in REGIONS.values()])
+    shape = (len(REGIONS), HOTSPOTS_PER_REGION)
+    return {
+        "lat": centers[:, 0, None] + rng.normal(0, HOTSPOT_SPREAD, shape),
+        "lon": centers[:, 1, None] + rng.normal(0, HOTSPOT_SPREAD, shape),
+        # Очаги неравные: несколько крупных и много мелких
+        "weight": rng.pareto(1.5, shape) + 0.1,
+    }
+
+
+def generate_chunk(index: int, rows: int, seed: int, first_day: int,
+                   probabilities: np.ndarray, fmt: str):
+    """
+    Пачка из rows записей: DataFrame (для Parquet и SQLite) или текст CSV
+    без заголовка - форматирование тоже выполняется в процессе пула
+    """
+    rng = np.random.default_rng([seed, index])
+    layout = hotspot_layout(seed)
+    centers = np.array([[r["lat"], r["lon"]] for r in REGIONS.values()])
+    region_names = list(REGIONS)
+    type_names = list(CRIME_TYPES)
+
+    day = first_day + rng.choice(len(probabilities), rows, p=probabilities)
+    region_weights = np.array([r["weight"] for r in REGIONS.values()], dtype=float)
+    region = rng.choice(len(region_names), rows, p=region_weights / region_weights.sum())
+
+    type_probabilities = np.array([t["probability"] for t in CRIME_TYPES.values()])
+    crime_type = rng.choice(len(type_names), rows, p=type_probabilities / type_probabilities.sum())
+    low, high = np.array([t["severity_range"] for t in CRIME_TYPES.values()]).T
+    severity = rng.integers(low[crime_type], high[crime_type] + 1)
+
+    # Очаг выбирается по его весу внутри региона (обратное преобразование по накопленным весам)
+    cumulative = np.cumsum(layout["weight"], axis=1)
+    cumulative /= cumulative[:, -1:]
+    hotspot = (rng.random(rows)[:, None] > cumulative[region]).sum(axis=1)
+    in_hotspot = rng.random(rows) < HOTSPOT_SHARE
+    center_lat = np.where(in_hotspot, layout["lat"][region, hotspot], centers[region, 0])
+    center_lon = np.where(in_hotspot, layout["lon"][region, hotspot], centers[region, 1])
+    radius = np.where(in_hotspot, HOTSPOT_RADIUS, BACKGROUND_RADIUS)
+
+    df = pd.DataFrame({
+        "date": np.datetime_as_string(day.astype("datetime64[D]")),
+        "region": np.array(region_names, dtype=object)[region],
+        "city": np.array([r["city"] for r in REGIONS.values()], dtype=object)[region],
+        "crime_type": np.array(type_names, dtype=object)[crime_type],
+        "latitude": np.round(center_lat + rng.normal(0, 1, rows) * radius, 5),
+        "longitude": np.round(center_lon + rng.normal(0, 1, rows) * radius, 5),
+        "severity": severity,
+    }, columns=OUTPUT_COLUMNS)
+    if fmt == "csv":
+        return df.to_csv(index=False, header=False)
+    return df
+
+
+def generate_chunks(args, workers: int):
+    """Пачки по порядку; в работе одновременно не больше 2 x workers пачек"""
+    first_day, probabilities = day_probabilities(args.start, args.end)
+    sizes = [min(args.chunk, args.rows - start) for start in range(0, args.rows, args.chunk)]
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        pending = deque()
+        for index, rows in enumerate(sizes):
+            pending.append(pool.submit(generate_chunk, index, rows, args.seed, first_day,
+                                       probabilities, args.format))
+            if len(pending) >= 2 * workers:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+
+
+class CsvWriter:
+    """Один CSV-файл (UTF-8 с BOM, как у прежнего генератора) - пачки дописываются по порядку"""
+
+    def __init__(self, path: str):
+        self.file = open(path, "w", encoding="utf-8-sig", newline="")
+        self.file.write(",".join(OUTPUT_COLUMNS) + "\n")
+
+    def write(self, chunk: str, row_offset: int):
+        self.file.write(chunk)
+
+    def close(self):
+        self.file.close()
+
+
+class ParquetWriter:
+    """Один Parquet-файл, пачка - группа строк; pyarrow нужен только для этого формата"""
+
+    def __init__(self, path: str):
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+        self.pa = pa
+        self.pq = pq
+        self.path = path
+        self.writer = None
+
+    def write(self, chunk: pd.DataFrame, row_offset: int):
+        table = self.pa.Table.from_pandas(chunk, preserve_index=False)
+        if self.writer is None:
+            self.writer = self.pq.ParquetWriter(self.path, table.schema)
+        self.writer.write_table(table)
+
+    def close(self):
+        if self.writer is not None:
+            self.writer.close()
+
+
+class SqliteWriter:
+    """БД приложения через DataService.save_to_db - каждая пачка отдельной транзакцией"""
+
+    def __init__(self):
+        from app.database import init_db
+        from app.services.data_service import DataService
+        init_db()
+        self.service = DataService()
+        self.rejected = 0
+
+    def write(self, chunk: pd.DataFrame, row_offset: int):
+        self.rejected += self.service.save_to_db(chunk, row_offset=row_offset)["rejected"]
+
+    def close(self):
+        if self.rejected:
+            print(f"[WARNING] Отклонено записей: {self.rejected}")
+
 
 def main():
-    """Основная функция"""
-    print("Генерация датасета для CrimeVision.kz")
-    print("-" * 50)
-    
-    # Параметры генерации
-    start_date = "2023-01-01"
-    end_date = "2024-12-31"
-    num_records = int(input("Сколько записей сгенерировать? (рекомендуется 1000-5000): ") or "2000")
-    
-    print(f"\nГенерация {num_records} записей с {start_date} по {end_date}...")
-    
-    df = generate_crime_data(start_date, end_date, num_records)
-    
-    # Сортируем по дате
-    df = df.sort_values("date")
-    
-    # Сохраняем в CSV
-    output_file = "data/generated_crimes.csv"
-    df.to_csv(output_file, index=False, encoding="utf-8-sig")
-    
-    print(f"\n✅ Датасет сохранён в {output_file}")
-    print(f"📊 Статистика:")
-    print(f"   - Всего записей: {len(df)}")
-    print(f"   - Период: {df['date'].min()} - {df['date'].max()}")
-    print(f"   - Регионов: {df['region'].nunique()}")
-    print(f"   - Типов преступлений: {df['crime_type'].nunique()}")
-    print(f"\n📈 Распределение по регионам (топ-5):")
-    print(df['region'].value_counts().head())
-    print(f"\n📈 Распределение по типам преступлений:")
-    print(df['crime_type'].value_counts())
-    
-    print(f"\n💡 Для загрузки в базу данных используйте веб-интерфейс или:")
-    print(f"   python load_sample_data.py  # (измените путь к файлу в скрипте)")
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, default=2000, help="число записей")
+    parser.add_argument("--start", default="2023-01-01", help="первая дата (YYYY-MM-DD)")
+    parser.add_argument("--end", default="2024-12-31", help="последняя дата (YYYY-MM-DD)")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--format", choices=["csv", "parquet", "sqlite"], default="csv")
+    parser.add_argument("--output", help="файл для csv/parquet (по умолчанию data/generated_crimes.*); "
+                                         "sqlite пишет в БД приложения")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1, help="процессов в пуле")
+    parser.add_argument("--chunk", type=int, default=500_000, help="записей в пачке")
+    args = parser.parse_args()
+    if args.rows < 1 or args.chunk < 1 or args.workers < 1:
+        parser.error("--rows, --chunk и --workers должны быть больше 0")
+    if np.datetime64(args.start, "D") > np.datetime64(args.end, "D"):
+        parser.error("--start позже --end")
 
-if __name__ == "__main__":
-    main()
+    output = args.output or DEFAULT_OUTPUT.get(args.format)
+    try:
+        if args.format == "csv":
+            writer = CsvWriter(output)
+        elif args.format == "parquet":
+            writer = ParquetWriter(output)
+        else:
+            writer = SqliteWriter()
+    except ImportError as e:
+        print(f"[ERROR] Для формата {args.format} не установлен модуль: {e.name} (pip install {e.name})")
+        sys.exit(1)
+
+    print(f"Генерация {args.rows:,} записей с {args.start} по {args.end} "
+          f"(seed={args.seed}, процессов: {args.workers}, формат: {args.format})")
+    started = time.perf_counter()
+    written = 0
+    try:
+        for chunk in generate_chunks(args, args.workers):
+            writer.write(chunk, written)
+            written += min(args.chunk, args.rows - written)
+            elapsed = time.perf_counter() - started
+            print(f"   {written:,} / {args.rows:,} ({written / elapsed:,.0f} записей/с)", flush=True)
+    finally:
+        writer.close()
 
+    target = "базу данных" if args.format == "sqlite" else output
+    print(f"[OK] {written:,} записей записано в {target} за {time.perf_counter() - started:.1f} с")
 
 
+if __name__ == "__main__":
+    main()
@@ -19,6 +19,10 @@ def load_sample_data():
     result = service.save_to_db(df)
     
     print(f"[OK] Успешно загружено {result['count']} записей в базу данных!")
+    if result['rejected']:
+        print(f"[WARNING] Отклонено записей: {result['rejected']}")
+        for reject in result['rejects']:
+            print(f"   - строка {reject['row']}: {reject['reason']}")
     print("\nТеперь можно запустить сервер: python main.py")
 
 if __name__ == "__main__":
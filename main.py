@@ -9,8 +9,14 @@ from starlette.templating import Jinja2Templates
 import uvicorn
 from pathlib import Path
 
-from app.api import router as api_router
-from app.database import init_db
+from app.api import router as api_router, ml_service
+from app.cache import on_data_change
+from app.database import init_db, pool
+from app.services.ml_service import schedule_training
+from app.services.snapshot_service import schedule_refresh
+from app.services import memory_engine
+from app.services.anomaly_service import anomaly_detector
+from app.workers import shutdown_workers
 
 app = FastAPI(
     title="CrimeVision.kz",
@@ -36,9 +42,28 @@ templates = Jinja2Templates(directory="templates")
 async def startup_event():
     """Инициализация при запуске"""
     init_db()
+    # Фоновые обновления после загрузки данных нужны только серверу:
+    # скрипты загрузки (load_sample_data.py, generate_dataset.py) их не запускают
+    on_data_change(schedule_refresh)
+    on_data_change(memory_engine.schedule_refresh)
+    on_data_change(schedule_training)
+    ml_service.warm_up()
+    # Состояние детектора всплесков восстанавливается по дневным агрегатам
+    rebuilt = anomaly_detector.rebuild()
+    print(f"[OK] Детектор аномалий: {rebuilt['days']} дней за {rebuilt['time_ms']} мс")
+    # Колоночный снимок догоняет БД в фоне (при первом запуске строится целиком)
+    schedule_refresh()
+    memory_engine.schedule_refresh()
     print("✅ CrimeVision.kz запущен!")
 
 
+@app.on_event("shutdown")
+async def shutdown_event():
+    """Остановка пулов потоков и закрытие соединений с БД"""
+    shutdown_workers()
+    pool.close()
+
+
 @app.get("/", response_class=HTMLResponse)
 async def root(request: Request):
     """Главная страница"""
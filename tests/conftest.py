@@ -0,0 +1,77 @@
+"""
+Общие фикстуры тестов
+
+База данных и колоночный снимок создаются во временном каталоге: путь
+пула соединений и CRIMEVISION_SNAPSHOT_DIR подменяются до первого
+обращения к БД. Данные - детерминированный набор по нескольким регионам
+и типам преступлений за полтора года.
+"""
+import os
+import shutil
+import sys
+import tempfile
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+import pytest
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+
+TMP_DIR = Path(tempfile.mkdtemp(prefix="crimevision-tests-"))
+os.environ["CRIMEVISION_SNAPSHOT_DIR"] = str(TMP_DIR / "snapshot")
+
+from app import database  # noqa: E402
+
+database.DB_PATH = TMP_DIR / "crime_vision.db"
+database.pool.path = database.DB_PATH
+
+REGIONS = ["Алматы", "Астана", "Шымкент", "Алматинская область"]
+CRIME_TYPES = ["Кража", "Грабёж", "Разбой"]
+FIRST_DATE, LAST_DATE = "2023-01-01", "2024-06-30"
+ROWS = 4000
+
+
+def make_crimes(rows: int = ROWS, seed: int = 7) -> pd.DataFrame:
+    """Преступления вокруг центров регионов REGIONS_KZ в формате CSV загрузки"""
+    from app.services.data_service import REGIONS_KZ
+
+    rng = np.random.default_rng(seed)
+    days = (np.datetime64(LAST_DATE) - np.datetime64(FIRST_DATE)).astype(int) + 1
+    region = rng.choice(REGIONS, rows)
+    centers = np.array([[REGIONS_KZ[name]["lat"], REGIONS_KZ[name]["lon"]] for name in region])
+    return pd.DataFrame({
+        "date": (np.datetime64(FIRST_DATE) + rng.integers(0, days, rows)).astype(str),
+        "region": region,
+        "city": "",
+        "crime_type": rng.choice(CRIME_TYPES, rows),
+        "latitude": centers[:, 0] + rng.normal(0, 0.05, rows),
+        "longitude": centers[:, 1] + rng.normal(0, 0.05, rows),
+        "severity": rng.integers(1, 6, rows),
+    })
+
+
+@pytest.fixture(scope="session")
+def dataset():
+    """Инициализированная БД с набором make_crimes и актуальный снимок"""
+    from app.services.data_service import DataService
+    from app.services.snapshot_service import snapshot
+
+    database.init_db()
+    result = DataService().save_to_db(make_crimes())
+    assert result["count"] == ROWS
+    snapshot.refresh()
+    yield result
+    database.pool.close()
+    shutil.rmtree(TMP_DIR, ignore_errors=True)
+
+
+@pytest.fixture(scope="session")
+def client(dataset):
+    """TestClient приложения; пулы потоков останавливаются один раз в конце сессии"""
+    from fastapi.testclient import TestClient
+    import main
+
+    with TestClient(main.app) as test_client:
+        yield test_client
@@ -0,0 +1,121 @@
+"""
+Проверка параметров API: значения вне допустимых пределов - ответ 400, а не 500 или пустой результат
+"""
+import numpy as np
+import pytest
+from fastapi import HTTPException
+
+from app.api import parse_date, parse_period
+from app.services.forecast_models import backtest
+from app.services.ml_service import (
+    MAX_BACKTEST_FOLDS, MAX_BACKTEST_HORIZON, MAX_FORECAST_MONTHS, MLService, check_months
+)
+
+
+@pytest.mark.parametrize("params", [
+    {"horizon": 0},
+    {"horizon": -1},
+    {"horizon": MAX_BACKTEST_HORIZON + 1},
+    {"folds": 0},
+    {"folds": MAX_BACKTEST_FOLDS + 1},
+    {"by": "city"},
+])
+def test_backtest_rejects_out_of_range_params(client, params):
+    response = client.get("/api/forecast/backtest", params=params)
+    assert response.status_code == 400
+
+
+def test_backtest_accepts_smallest_params(client):
+    response = client.get("/api/forecast/backtest", params={"horizon": 1, "folds": 1})
+    assert response.status_code == 200
+
+
+@pytest.mark.parametrize("horizon, folds", [(0, 3), (3, 0)])
+def test_backtest_function_rejects_empty_window(horizon, folds):
+    with pytest.raises(ValueError):
+        backtest(np.arange(30.0), horizon=horizon, folds=folds)
+
+
+@pytest.mark.parametrize("path", ["/api/forecast", "/api/forecast/batch"])
+@pytest.mark.parametrize("months", [0, -3, MAX_FORECAST_MONTHS + 1])
+def test_forecast_rejects_out_of_range_months(client, path, months):
+    response = client.get(path, params={"months": months})
+    assert response.status_code == 400
+
+
+@pytest.mark.parametrize("months", [1, MAX_FORECAST_MONTHS])
+def test_forecast_accepts_months_in_range(client, months):
+    response = client.get("/api/forecast", params={"months": months, "region": "Астана"})
+    assert response.status_code == 200
+    assert len(response.json()["forecast"]["values"]) == months
+
+
+def test_forecast_service_checks_months():
+    with pytest.raises(ValueError):
+        check_months(MAX_FORECAST_MONTHS + 1)
+    # Ошибка параметров не подменяется прогнозом по средним значениям
+    with pytest.raises(ValueError):
+        MLService().get_forecast(months=0)
+
+
+@pytest.mark.parametrize("value, end, expected", [
+    ("2024-02-10", False, "2024-02-10"),
+    ("2024-02", False, "2024-02-01"),
+    ("2024-02", True, "2024-02-29"),
+    ("2023", True, "2023-12-31"),
+    (" 2023-07-04 ", False, "2023-07-04"),
+    (None, False, None),
+])
+def test_parse_date_normalizes_periods(value, end, expected):
+    assert parse_date(value, "start_date", end=end) == expected
+
+
+@pytest.mark.parametrize("start_date, end_date", [
+    ("2024-13-01", None),
+    ("01.02.2024", None),
+    (None, "вчера"),
+    ("2024-03-01", "2024-02-01"),
+])
+def test_parse_period_rejects_bad_dates(start_date, end_date):
+    with pytest.raises(HTTPException) as error:
+        parse_period(start_date, end_date)
+    assert error.value.status_code == 400
+
+
+@pytest.mark.parametrize("path", [
+    "/api/stats/summary", "/api/crimes", "/api/crimes/export", "/api/heatmap",
+    "/api/hotspots", "/api/analytics/timeline", "/api/analytics/regions",
+])
+def test_endpoints_reject_bad_dates(client, path):
+    assert client.get(path, params={"start_date": "2024-02-30"}).status_code == 400
+    assert client.get(path, params={"start_date": "2024-03", "end_date": "2024-02"}).status_code == 400
+
+
+def test_month_filter_covers_whole_month(client):
+    by_month = client.get("/api/stats/summary", params={"start_date": "2023-02", "end_date": "2023-02"}).json()
+    by_days = client.get("/api/stats/summary",
+                         params={"start_date": "2023-02-01", "end_date": "2023-02-28"}).json()
+    assert by_month["total"] > 0
+    assert by_month == by_days
+
+
+@pytest.mark.parametrize("params", [
+    {"end_date": "2024-02-30"},
+    {"end_date": "конец"},
+    {"days": 1},
+    {"days": 367},
+])
+def test_risk_ranking_rejects_bad_params(client, params):
+    assert client.get("/api/risk-assessment/all", params=params).status_code == 400
+
+
+def test_risk_ranking_lists_every_region(client):
+    regions = client.get("/api/regions").json()["regions"]
+    ranking = client.get("/api/risk-assessment/all", params={"end_date": "2024-06"}).json()
+    assert ranking["period"].endswith("2024-06-30")
+    assert sorted(r["region"] for r in ranking["regions"]) == sorted(regions)
+
+    # Окно до начала данных: регионы остаются в рейтинге без ранга и z-оценок
+    empty = client.get("/api/risk-assessment/all", params={"end_date": "2022-06-30", "days": 30}).json()
+    assert sorted(r["region"] for r in empty["regions"]) == sorted(regions)
+    assert all(r["risk_level"] == "insufficient_data" and r["rank"] is None for r in empty["regions"])
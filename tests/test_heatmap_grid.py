@@ -0,0 +1,89 @@
+"""
+Тепловая карта по ячейкам: недельные агрегаты crime_cells и колоночный снимок против запроса к crimes
+"""
+import pytest
+
+from app.database import CELL_ROLLUP_SIZE, KZ_BOUNDS, db_reader, db_writer, rebuild_cells
+from app.services.data_service import DataService
+from app.services.gis_service import GISService
+
+data_service = DataService()
+gis_service = GISService()
+
+PERIODS = [
+    (None, None),
+    ("2023-03-15", "2023-11-02"),
+    ("2023-05-01", None),
+    (None, "2023-02-17"),
+    # Одна неделя целиком, часть недели и период через границу недель
+    ("2023-06-05", "2023-06-11"),
+    ("2023-06-06", "2023-06-08"),
+    ("2023-06-09", "2023-06-13"),
+]
+FILTERS = [(None, None), ("Алматы", None), (None, "Кража")]
+
+
+def rounded(cells):
+    return sorted(tuple(round(value, 6) if isinstance(value, float) else value for value in cell)
+                  for cell in cells)
+
+
+def from_crimes(monkeypatch, call):
+    """Ответ call() запросом к crimes, без агрегатов и снимка"""
+    with monkeypatch.context() as patch:
+        patch.setattr(DataService, "_cells_from_rollup", lambda self, *args, **kwargs: None)
+        patch.setattr(DataService, "_cells_from_snapshot", lambda self, *args: None)
+        return call()
+
+
+@pytest.mark.parametrize("shift", [0, 1, 3])
+@pytest.mark.parametrize("start_date, end_date", PERIODS)
+@pytest.mark.parametrize("region, crime_type", FILTERS)
+def test_rollup_matches_crimes(monkeypatch, dataset, shift, start_date, end_date, region, crime_type):
+    args = (CELL_ROLLUP_SIZE * 2 ** shift, KZ_BOUNDS, start_date, end_date, region, crime_type)
+    cells = data_service.get_heatmap_cells(*args)
+    weeks = data_service.get_cell_week_counts(*args)
+    assert rounded(cells) == rounded(from_crimes(monkeypatch, lambda: data_service.get_heatmap_cells(*args)))
+    assert rounded(weeks) == rounded(from_crimes(monkeypatch, lambda: data_service.get_cell_week_counts(*args)))
+
+
+def test_rollup_serves_only_its_grid(dataset):
+    assert data_service._cells_from_rollup(CELL_ROLLUP_SIZE * 4, KZ_BOUNDS, None, None, None, None)
+    assert data_service._cells_from_rollup(0.5, KZ_BOUNDS, None, None, None, None) is None
+    assert data_service._cells_from_rollup(CELL_ROLLUP_SIZE / 2, KZ_BOUNDS, None, None, None, None) is None
+    assert data_service._cells_from_rollup(CELL_ROLLUP_SIZE, (42.0, 68.0, 52.0, 80.0),
+                                           None, None, None, None) is None
+    # Период короче недели читается из crimes
+    assert data_service._cells_from_rollup(CELL_ROLLUP_SIZE, KZ_BOUNDS, "2023-06-06", "2023-06-08",
+                                           None, None) is None
+
+
+def test_ingested_rollup_equals_rebuild(dataset):
+    query = "SELECT * FROM crime_cells ORDER BY week, region_id, crime_type_id, cell_row, cell_col"
+    with db_reader() as conn:
+        ingested = [tuple(row) for row in conn.execute(query)]
+    with db_writer() as conn:
+        rebuild_cells(conn)
+    with db_reader() as conn:
+        rebuilt = [tuple(row) for row in conn.execute(query)]
+
+    assert [row[:6] for row in ingested] == [row[:6] for row in rebuilt]
+    for a, b in zip(ingested, rebuilt):
+        assert a[6:] == pytest.approx(b[6:])
+
+
+@pytest.mark.parametrize("start_date, end_date", PERIODS[:3])
+@pytest.mark.parametrize("region, crime_type", FILTERS)
+def test_snapshot_grid_matches_crimes(monkeypatch, dataset, start_date, end_date, region, crime_type):
+    # Большая область без R*Tree и ячейка не из сетки агрегатов - ответ по снимку
+    args = (0.0045, (41.0, 60.0, 53.0, 85.0), start_date, end_date, region, crime_type)
+    with monkeypatch.context() as patch:
+        patch.setattr(DataService, "_cells_from_rollup", lambda self, *args, **kwargs: None)
+        cells = data_service.get_heatmap_cells(*args)
+    assert rounded(cells) == rounded(from_crimes(monkeypatch, lambda: data_service.get_heatmap_cells(*args)))
+
+
+def test_hotspots_match_crimes(monkeypatch, dataset):
+    hotspots = gis_service.get_hotspots(min_incidents=20)
+    assert hotspots["hotspots"]
+    assert hotspots == from_crimes(monkeypatch, lambda: gis_service.get_hotspots(min_incidents=20))
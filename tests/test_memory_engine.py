@@ -0,0 +1,92 @@
+"""
+In-memory движок против SQL: одни и те же ответы DataService с движком и без него
+"""
+import pytest
+
+from app.database import KZ_BOUNDS
+from app.services import data_service as data_service_module
+from app.services.data_service import DataService
+from app.services.memory_engine import MemoryEngine
+
+data_service = DataService()
+
+PERIODS = [
+    (None, None, None),
+    ("2023-04-03", "2023-10-15", None),
+    ("2024-01-01", None, "Алматинская область"),
+    (None, "2023-02-28", "Астана"),
+]
+
+
+@pytest.fixture(scope="module")
+def engine(dataset):
+    engine = MemoryEngine(enabled=True)
+    engine.refresh()
+    assert engine.ready()
+    return engine
+
+
+def answers(monkeypatch, engine, call):
+    """Ответ call() из SQL и из движка"""
+    from_sql = call()
+    monkeypatch.setattr(data_service_module, "memory_engine", engine)
+    from_memory = call()
+    monkeypatch.undo()
+    return from_sql, from_memory
+
+
+def rounded(cells):
+    return sorted(tuple(round(value, 6) for value in cell) for cell in cells)
+
+
+@pytest.mark.parametrize("start_date, end_date, region", PERIODS)
+def test_summary_matches_sql(monkeypatch, engine, start_date, end_date, region):
+    from_sql, from_memory = answers(
+        monkeypatch, engine, lambda: data_service.get_summary_stats(start_date, end_date, region)
+    )
+    assert from_sql["total"] > 0
+    assert from_memory == from_sql
+
+
+@pytest.mark.parametrize("group_by", ["day", "week", "month"])
+@pytest.mark.parametrize("start_date, end_date, region", PERIODS)
+def test_timeline_matches_sql(monkeypatch, engine, start_date, end_date, region, group_by):
+    from_sql, from_memory = answers(
+        monkeypatch, engine, lambda: data_service.get_timeline(start_date, end_date, region, group_by)
+    )
+    assert from_memory == from_sql
+
+
+@pytest.mark.parametrize("start_date, end_date", [period[:2] for period in PERIODS])
+def test_regions_comparison_matches_sql(monkeypatch, engine, start_date, end_date):
+    from_sql, from_memory = answers(
+        monkeypatch, engine, lambda: data_service.get_regions_comparison(start_date, end_date)
+    )
+    assert from_memory == from_sql
+
+
+@pytest.mark.parametrize("cell_size, bounds", [
+    (0.05, (42.0, 68.0, 52.0, 80.0)),
+    (0.01, (43.0, 76.5, 43.5, 77.2)),
+])
+@pytest.mark.parametrize("start_date, end_date, region", PERIODS)
+def test_grid_cells_match_sql(monkeypatch, engine, cell_size, bounds, start_date, end_date, region):
+    # Эталон - запрос к crimes: без недельных агрегатов и колоночного снимка
+    monkeypatch.setattr(DataService, "_cells_from_snapshot", lambda self, *args: None)
+    from_sql = data_service.get_heatmap_cells(cell_size, bounds, start_date, end_date, region)
+    week_sql = data_service.get_cell_week_counts(cell_size, bounds, start_date, end_date, region)
+    monkeypatch.setattr(data_service_module, "memory_engine", engine)
+    from_memory = data_service.get_heatmap_cells(cell_size, bounds, start_date, end_date, region)
+    week_memory = data_service.get_cell_week_counts(cell_size, bounds, start_date, end_date, region)
+
+    assert rounded(from_memory) == rounded(from_sql)
+    assert rounded(week_memory) == rounded(week_sql)
+
+
+def test_country_grid_matches_sql(monkeypatch, engine):
+    monkeypatch.setattr(DataService, "_cells_from_snapshot", lambda self, *args: None)
+    monkeypatch.setattr(DataService, "_cells_from_rollup", lambda self, *args, **kwargs: None)
+    from_sql = data_service.get_heatmap_cells(0.2, KZ_BOUNDS, crime_type="Грабёж")
+    assert from_sql
+    monkeypatch.setattr(data_service_module, "memory_engine", engine)
+    assert rounded(data_service.get_heatmap_cells(0.2, KZ_BOUNDS, crime_type="Грабёж")) == rounded(from_sql)
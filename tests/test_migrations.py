@@ -0,0 +1,97 @@
+"""
+Цепочка миграций схемы: БД исходного формата (строковые столбцы, дата
+YYYY-MM-DD) доводится до последней версии SCHEMA_MIGRATIONS
+"""
+import sqlite3
+
+from app.database import KZ_BOUNDS, SCHEMA_MIGRATIONS, migrate_schema
+
+LEGACY_ROWS = [
+    ("2024-01-01", "Алматы", "Алматы", "Кража", 43.25, 76.95, 2),
+    ("2024-01-01", "Алматы", None, "Кража", 43.26, 76.94, 4),
+    ("2024-01-02", "Астана", "Астана", "Грабёж", 51.17, 71.45, 3),
+    ("2024-02-15", "Астана", None, "Разбой", 51.18, 71.44, 5),
+    ("2024-02-16", "Шымкент", "Шымкент", "Кража", None, None, 1),
+    ("не дата", "Шымкент", None, "Кража", 42.34, 69.59, 1),
+]
+
+
+def legacy_db(path) -> sqlite3.Connection:
+    """БД в формате до первой миграции: таблица crimes и одностолбцовые индексы"""
+    conn = sqlite3.connect(str(path))
+    conn.execute("""
+        CREATE TABLE crimes (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            date DATE NOT NULL,
+            region TEXT NOT NULL,
+            city TEXT,
+            crime_type TEXT NOT NULL,
+            latitude REAL,
+            longitude REAL,
+            severity INTEGER DEFAULT 1,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    """)
+    conn.execute("CREATE INDEX idx_date ON crimes(date)")
+    conn.execute("CREATE INDEX idx_region ON crimes(region)")
+    conn.execute("CREATE INDEX idx_crime_type ON crimes(crime_type)")
+    conn.executemany("""
+        INSERT INTO crimes (date, region, city, crime_type, latitude, longitude, severity)
+        VALUES (?, ?, ?, ?, ?, ?, ?)
+    """, LEGACY_ROWS)
+    conn.commit()
+    return conn
+
+
+def test_legacy_db_migrates_to_latest_version(tmp_path):
+    conn = legacy_db(tmp_path / "legacy.db")
+    applied = migrate_schema(conn)
+    conn.commit()
+
+    assert applied == list(SCHEMA_MIGRATIONS)
+    assert conn.execute("PRAGMA user_version").fetchone()[0] == len(SCHEMA_MIGRATIONS)
+    assert migrate_schema(conn) == []
+
+    tables = {row[0] for row in conn.execute("SELECT name FROM sqlite_master WHERE type = 'table'")}
+    assert {"crimes", "crime_daily", "crime_cells", "regions", "cities", "crime_types"} <= tables
+    assert "crimes_legacy" not in tables
+    indexes = {row[0] for row in conn.execute("SELECT name FROM sqlite_master WHERE type = 'index'")}
+    assert {"idx_crimes_day", "idx_crimes_region_day", "idx_crimes_type_day"} <= indexes
+    assert not {"idx_date", "idx_region", "idx_crime_type"} & indexes
+
+
+def test_migrated_rows_keep_ids_and_values(tmp_path):
+    conn = legacy_db(tmp_path / "legacy.db")
+    migrate_schema(conn)
+
+    rows = conn.execute("""
+        SELECT c.id, date(c.day * 86400, 'unixepoch'), reg.name, cty.name, typ.name,
+               c.latitude, c.longitude, c.severity
+        FROM crimes c
+        JOIN regions reg ON reg.id = c.region_id
+        LEFT JOIN cities cty ON cty.id = c.city_id
+        JOIN crime_types typ ON typ.id = c.crime_type_id
+        ORDER BY c.id
+    """).fetchall()
+    # Строка с нераспознаваемой датой пропускается
+    assert rows == [(i, *row) for i, row in enumerate(LEGACY_ROWS[:-1], start=1)]
+
+
+def test_migrated_aggregates_match_crimes(tmp_path):
+    conn = legacy_db(tmp_path / "legacy.db")
+    migrate_schema(conn)
+    valid = LEGACY_ROWS[:-1]
+
+    assert conn.execute("SELECT SUM(count), SUM(severity_sum) FROM crime_daily").fetchone() == (
+        len(valid), sum(row[6] for row in valid)
+    )
+    catalog = dict(conn.execute("SELECT name, incidents FROM regions").fetchall())
+    assert catalog == {"Алматы": 2, "Астана": 2, "Шымкент": 1}
+
+    # В недельные агрегаты по ячейкам попадают только строки с координатами в KZ_BOUNDS
+    min_lat, min_lon, max_lat, max_lon = KZ_BOUNDS
+    located = [row for row in valid if row[4] is not None
+               and min_lat <= row[4] <= max_lat and min_lon <= row[5] <= max_lon]
+    count, lat_sum = conn.execute("SELECT SUM(count), SUM(lat_sum) FROM crime_cells").fetchone()
+    assert count == len(located)
+    assert abs(lat_sum - sum(row[4] for row in located)) < 1e-9
@@ -0,0 +1,71 @@
+"""
+Keyset-пагинация /api/crimes: курсор (date, id) и обход страниц без пропусков и повторов
+"""
+import base64
+
+import pytest
+
+from app.database import db_reader
+from app.services.data_service import DataService
+
+data_service = DataService()
+
+
+def test_cursor_round_trip():
+    cursor = data_service.encode_cursor("2024-03-01", 123456)
+    assert "=" not in cursor
+    assert data_service.decode_cursor(cursor) == ("2024-03-01", 123456)
+
+
+@pytest.mark.parametrize("cursor", [
+    "!!!",
+    base64.urlsafe_b64encode(b"no separator").decode(),
+    base64.urlsafe_b64encode(b"2024-03-01|not-a-number").decode(),
+    base64.urlsafe_b64encode(b"\xff\xfe|1").decode(),
+])
+def test_invalid_cursor_raises_value_error(cursor):
+    with pytest.raises(ValueError):
+        data_service.decode_cursor(cursor)
+
+
+@pytest.mark.parametrize("filters", [
+    {},
+    {"region": "Астана"},
+    {"start_date": "2023-06-01", "crime_type": "Кража"},
+])
+def test_pages_cover_all_rows_once_in_order(dataset, filters):
+    pages, cursor = [], None
+    while True:
+        page = data_service.get_crimes_page(limit=357, cursor=cursor, **filters)
+        pages.append(page["crimes"])
+        cursor = page["next_cursor"]
+        if cursor is None:
+            break
+    crimes = [crime for page in pages for crime in page]
+    keys = [(crime["date"], crime["id"]) for crime in crimes]
+
+    assert all(len(page) == 357 for page in pages[:-1])
+    assert len(set(keys)) == len(keys)
+    assert keys == sorted(keys, reverse=True)
+    assert crimes == data_service.get_crimes(limit=len(crimes) + 1, **filters)
+
+    conditions = {"region": "region_id = (SELECT id FROM regions WHERE name = ?)",
+                  "crime_type": "crime_type_id = (SELECT id FROM crime_types WHERE name = ?)",
+                  "start_date": "day >= CAST(julianday(?) - 2440587.5 AS INTEGER)"}
+    where = " AND ".join(["1=1"] + [conditions[name] for name in filters])
+    with db_reader() as conn:
+        total = conn.execute(f"SELECT COUNT(*) FROM crimes WHERE {where}", list(filters.values())).fetchone()[0]
+    assert len(crimes) == total
+
+
+def test_api_pages_follow_next_cursor(client):
+    first = client.get("/api/crimes", params={"limit": 5, "region": "Шымкент"}).json()
+    second = client.get("/api/crimes", params={"limit": 5, "region": "Шымкент",
+                                               "cursor": first["next_cursor"]}).json()
+    both = client.get("/api/crimes", params={"limit": 10, "region": "Шымкент"}).json()
+    assert first["crimes"] + second["crimes"] == both["crimes"]
+
+
+def test_api_rejects_invalid_cursor(client):
+    response = client.get("/api/crimes", params={"cursor": "!!!"})
+    assert response.status_code == 400
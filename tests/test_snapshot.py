@@ -0,0 +1,85 @@
+"""
+Колоночный снимок crimes против SQL: столбцы, фильтры, последние строки и точки тепловой карты
+"""
+import numpy as np
+import pytest
+
+from app.database import db_reader
+from app.services.data_service import DataService
+from app.services.gis_service import GISService
+from app.services.snapshot_service import snapshot
+
+data_service = DataService()
+gis_service = GISService()
+
+FILTERS = [
+    {},
+    {"start_date": "2023-05-10", "end_date": "2023-11-20"},
+    {"region": "Алматы"},
+    {"crime_type": "Разбой", "end_date": "2023-08-31"},
+    {"region": "Астана", "crime_type": "Кража", "start_date": "2024-01-15"},
+]
+
+
+def sql_rows(filters):
+    """(id, day, region, crime_type, latitude, longitude, severity) отфильтрованных строк по id"""
+    conditions = {
+        "start_date": "c.day >= CAST(julianday(?) - 2440587.5 AS INTEGER)",
+        "end_date": "c.day <= CAST(julianday(?) - 2440587.5 AS INTEGER)",
+        "region": "reg.name = ?",
+        "crime_type": "typ.name = ?",
+    }
+    where = " AND ".join(["1=1"] + [conditions[name] for name in filters])
+    with db_reader() as conn:
+        return [tuple(row) for row in conn.execute(f"""
+            SELECT c.id, c.day, reg.name, typ.name, c.latitude, c.longitude, c.severity
+            FROM crimes c
+            JOIN regions reg ON reg.id = c.region_id
+            JOIN crime_types typ ON typ.id = c.crime_type_id
+            WHERE {where}
+            ORDER BY c.id
+        """, list(filters.values())).fetchall()]
+
+
+@pytest.fixture(autouse=True)
+def current_snapshot(dataset):
+    assert snapshot.is_current()
+
+
+@pytest.mark.parametrize("filters", FILTERS)
+def test_columns_match_sql(filters):
+    data = snapshot.columns(start_date=filters.get("start_date"), end_date=filters.get("end_date"),
+                            region=filters.get("region"), crime_type=filters.get("crime_type"))
+    dictionaries = snapshot.meta()["dictionaries"]
+    order = np.argsort(data["id"])
+    rows = list(zip(
+        data["id"][order].tolist(),
+        data["day"][order].tolist(),
+        [dictionaries["region"][code] for code in data["region"][order]],
+        [dictionaries["crime_type"][code] for code in data["crime_type"][order]],
+        data["latitude"][order].tolist(),
+        data["longitude"][order].tolist(),
+        data["severity"][order].tolist(),
+    ))
+    assert rows == sql_rows(filters)
+
+
+@pytest.mark.parametrize("filters", FILTERS)
+def test_latest_matches_get_crimes_order(filters):
+    latest = snapshot.latest(("id",), 500, **filters)
+    crimes = data_service.get_crimes(limit=500, **filters)
+    assert latest["id"].tolist() == [crime["id"] for crime in crimes]
+
+
+def test_unknown_region_selects_nothing():
+    assert len(snapshot.columns(("id",), region="Нет такого региона")["id"]) == 0
+    assert len(snapshot.latest(("id",), 10, region="Нет такого региона")["id"]) == 0
+
+
+@pytest.mark.parametrize("filters", [{}, {"region": "Шымкент", "start_date": "2023-03-01"}])
+def test_heatmap_points_match_sql(monkeypatch, filters):
+    from_snapshot = gis_service.get_heatmap_data(**filters)
+    monkeypatch.setattr(snapshot, "is_current", lambda: False)
+    from_sql = gis_service.get_heatmap_data(**filters)
+    assert from_snapshot["count"] > 0
+    assert from_snapshot == from_sql
@@ -0,0 +1,88 @@
+"""
+Пространственный индекс R*Tree: массовая загрузка без построчного триггера
+и отбор по области через индекс
+"""
+import sqlite3
+
+import pytest
+
+from app.database import bulk_spatial_index, create_tables, db_reader, init_spatial_index
+from app.services.data_service import DataService
+
+data_service = DataService()
+
+INSERT_SQL = """
+    INSERT INTO crimes (day, region_id, crime_type_id, latitude, longitude, severity)
+    VALUES (?, 1, 1, ?, ?, 1)
+"""
+
+
+def spatial_db(path) -> sqlite3.Connection:
+    conn = sqlite3.connect(str(path))
+    create_tables(conn)
+    init_spatial_index(conn)
+    conn.commit()
+    return conn
+
+
+def has_insert_trigger(conn) -> bool:
+    return conn.execute(
+        "SELECT EXISTS(SELECT 1 FROM sqlite_master WHERE type = 'trigger' AND name = 'crimes_rtree_insert')"
+    ).fetchone()[0] == 1
+
+
+def test_bulk_load_fills_index_and_restores_trigger(tmp_path):
+    conn = spatial_db(tmp_path / "spatial.db")
+    conn.execute(INSERT_SQL, (19000, 43.2, 76.9))
+    conn.commit()
+
+    with conn:
+        with bulk_spatial_index(conn):
+            assert not has_insert_trigger(conn)
+            conn.executemany(INSERT_SQL, [(19000, 43.0 + i / 100, 76.0) for i in range(50)])
+            conn.execute(INSERT_SQL, (19000, None, None))
+    assert has_insert_trigger(conn)
+    assert conn.execute("SELECT COUNT(*) FROM crimes_rtree").fetchone()[0] == 51
+
+    # Отдельные строки после загрузки снова индексируются триггером
+    conn.execute(INSERT_SQL, (19001, 51.1, 71.4))
+    assert conn.execute("SELECT COUNT(*) FROM crimes_rtree").fetchone()[0] == 52
+
+
+def test_failed_bulk_load_rolls_back_with_trigger(tmp_path):
+    conn = spatial_db(tmp_path / "spatial.db")
+    with pytest.raises(RuntimeError):
+        with conn:
+            with bulk_spatial_index(conn):
+                conn.execute(INSERT_SQL, (19000, 43.2, 76.9))
+                raise RuntimeError("ошибка загрузки")
+    assert has_insert_trigger(conn)
+    assert conn.execute("SELECT COUNT(*) FROM crimes").fetchone()[0] == 0
+    assert conn.execute("SELECT COUNT(*) FROM crimes_rtree").fetchone()[0] == 0
+
+
+def test_dataset_index_matches_crimes(dataset):
+    with db_reader() as conn:
+        indexed = conn.execute("SELECT COUNT(*) FROM crimes_rtree").fetchone()[0]
+        located = conn.execute("SELECT COUNT(*) FROM crimes WHERE latitude IS NOT NULL").fetchone()[0]
+    assert indexed == located
+
+
+def test_bbox_and_radius_match_full_scan(dataset):
+    bbox = (43.2, 76.85, 43.3, 76.95)
+    crimes = data_service.get_crimes(bbox=bbox, limit=10000)
+    with db_reader() as conn:
+        expected = {row[0] for row in conn.execute(
+            "SELECT id FROM crimes WHERE latitude BETWEEN ? AND ? AND longitude BETWEEN ? AND ?",
+            (bbox[0], bbox[2], bbox[1], bbox[3])
+        )}
+    assert expected
+    assert {crime["id"] for crime in crimes} == expected
+
+    near = data_service.get_crimes(near=(43.25, 76.9, 3.0), limit=10000)
+    with db_reader() as conn:
+        within = {row[0] for row in conn.execute(
+            "SELECT id FROM crimes WHERE distance_km(latitude, longitude, 43.25, 76.9) <= 3.0"
+        )}
+    assert within
+    assert {crime["id"] for crime in near} == within